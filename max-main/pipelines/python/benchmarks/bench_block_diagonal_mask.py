@@ -0,0 +1,73 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+"""Memory benchmark for the Pixtral vision encoder attention mask.
+
+Compares, at 1, 4 and 8 images, the memory of the multi-image attention
+mask and scores when stored densely versus with the `BlockDiagonalMask`
+representation. The dense path needs a `(seq_len, seq_len)` float32 mask and
+a `(seq_len, seq_len)` score matrix per head on the device. The block diagonal
+attention only builds each image's `(n, n)` scores and needs no mask beyond
+the image boundary offsets.
+
+Run from the `pipelines/python` directory:
+
+    python benchmarks/bench_block_diagonal_mask.py
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+
+import click
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pixtral.vision_encoder.attention_utils import (  # noqa: E402
+    BlockDiagonalMask,
+)
+
+
+def _mib(nbytes: int) -> float:
+    return nbytes / (1024 * 1024)
+
+
+@click.command()
+@click.option("--image-size", type=int, default=1024)
+@click.option("--patch-size", type=int, default=16)
+def main(image_size: int, patch_size: int) -> None:
+    patches_per_image = (image_size // patch_size) ** 2
+    print(
+        f"{'images':>6} {'seq_len':>8} {'dense mask (MiB)':>17}"
+        f" {'dense scores/head (MiB)':>24} {'block scores/head (MiB)':>24}"
+        f" {'offsets (B)':>12}"
+    )
+    for num_images in (1, 4, 8):
+        mask = BlockDiagonalMask.from_num_patches([patches_per_image] * num_images)
+
+        # The dense mask and the dense scores of one head have the same size.
+        float32_size = np.dtype(np.float32).itemsize
+        dense_scores = mask.seq_len**2 * float32_size
+        block_scores = sum(
+            (end - start) ** 2 * float32_size for start, end in mask.blocks()
+        )
+        print(
+            f"{num_images:>6} {mask.seq_len:>8} {_mib(dense_scores):>17.1f}"
+            f" {_mib(dense_scores):>24.1f} {_mib(block_scores):>24.1f}"
+            f" {mask.nbytes:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+"""Micro-benchmark for `dataprocessing.causal_attention_mask`.
+
+Compares the original per-row `np.triu` + `np.stack` implementation against
+the broadcast implementation, both uncached and through the public function,
+at several batch sizes. The public function caches context encoding masks, so
+pass `--seq-len` greater than 1 to measure a cache hit (a copy of the cached
+mask); token generation masks are always built.
+
+Run from the `pipelines/python` directory:
+
+    python benchmarks/bench_causal_attention_mask.py
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import sys
+import timeit
+
+import click
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dataprocessing import causal_attention_mask  # noqa: E402
+from dataprocessing.causal_attention_mask import (  # noqa: E402
+    _build_causal_attention_mask,
+)
+
+
+def _reference_causal_attention_mask(
+    original_start_pos: list[int],
+    original_seq_len: list[int],
+    pad_to_multiple_of: int = 1,
+) -> np.ndarray:
+    start_pos = np.array(original_start_pos, dtype=np.int64)
+    seq_len = np.array(original_seq_len, dtype=np.int64)
+    if seq_len.max() == 1:
+        padded_length = 1
+    else:
+        padded_length = (
+            math.ceil(seq_len.max() / pad_to_multiple_of) * pad_to_multiple_of
+        )
+    post_seq_len = (start_pos + padded_length).max()
+    fill_matrix = np.full(
+        (padded_length, post_seq_len), -10000.0, dtype=np.float32
+    )
+    return np.stack([np.triu(fill_matrix, k=k + 1) for k in start_pos])
+
+
+def _time_us(fn, repeat: int) -> float:
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) * 1e6
+
+
+@click.command()
+@click.option("--context-length", type=int, default=2048)
+@click.option("--seq-len", type=int, default=1)
+@click.option("--repeat", type=int, default=50)
+def main(context_length: int, seq_len: int, repeat: int) -> None:
+    print(
+        f"{'batch':>6} {'reference (us)':>16} {'broadcast (us)':>16}"
+        f" {'public (us)':>14}"
+    )
+    for batch_size in (1, 32, 128):
+        start_pos = [context_length] * batch_size
+        seq_lens = [seq_len] * batch_size
+
+        expected = _reference_causal_attention_mask(start_pos, seq_lens)
+        np.testing.assert_array_equal(
+            causal_attention_mask(start_pos, seq_lens), expected
+        )
+
+        reference = _time_us(
+            lambda: _reference_causal_attention_mask(start_pos, seq_lens),
+            repeat,
+        )
+        broadcast = _time_us(
+            lambda: _build_causal_attention_mask(
+                tuple(start_pos), tuple(seq_lens), 1
+            ),
+            repeat,
+        )
+        public = _time_us(
+            lambda: causal_attention_mask(start_pos, seq_lens), repeat
+        )
+        print(
+            f"{batch_size:>6} {reference:>16.1f} {broadcast:>16.1f} {public:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+"""Peak memory benchmark for padding the Llama Vision patch embeddings.
+
+Replays the ops of the previous `VisionModel._manual_constant_pad_4d` and of
+`nn.ConstantPad` in NumPy, materializing every op output as an unfused graph
+would, and reports the peak memory of each for a 4-tile 448x448 image
+(`(1, 4, 1025, 1280)` patch embeddings padded to 1032 patches per tile).
+
+Run from the `pipelines/python` directory:
+
+    python benchmarks/bench_constant_pad.py
+"""
+
+from __future__ import annotations
+
+import tracemalloc
+
+import click
+import numpy as np
+
+
+def _manual_constant_pad_4d(x: np.ndarray, top: int, bottom: int) -> np.ndarray:
+    """The slice/concat chain of `VisionModel._manual_constant_pad_4d`."""
+    batch_size, channels, height, width = x.shape
+    padded = np.broadcast_to(
+        np.zeros((), dtype=x.dtype),
+        (batch_size, channels, height + top + bottom, width),
+    ).copy()
+    top_region = padded[:, :, :top, :].copy()
+    bottom_region = padded[:, :, top + height :, :].copy()
+    left_region = padded[:, :, top : top + height, :0].copy()
+    middle_region = np.concatenate((left_region, x), axis=3)
+    return np.concatenate((top_region, middle_region, bottom_region), axis=2)
+
+
+def _constant_pad(x: np.ndarray, top: int, bottom: int) -> np.ndarray:
+    """The single concat of `nn.ConstantPad` for padding along dim -2."""
+    batch_size, channels, _, width = x.shape
+    regions = []
+    if top:
+        regions.append(np.zeros((batch_size, channels, top, width), dtype=x.dtype))
+    regions.append(x)
+    if bottom:
+        regions.append(np.zeros((batch_size, channels, bottom, width), dtype=x.dtype))
+    return np.concatenate(regions, axis=2)
+
+
+def _peak_bytes(fn) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@click.command()
+@click.option("--num-tiles", type=int, default=4)
+@click.option("--image-size", type=int, default=448)
+@click.option("--patch-size", type=int, default=14)
+@click.option("--hidden-size", type=int, default=1280)
+def main(num_tiles: int, image_size: int, patch_size: int, hidden_size: int) -> None:
+    num_patches = (image_size // patch_size) ** 2 + 1
+    num_padding_patches = (8 - (num_patches % 8)) % 8
+    # bfloat16 is not a NumPy dtype; float16 has the same size.
+    x = np.ones((1, num_tiles, num_patches, hidden_size), dtype=np.float16)
+
+    np.testing.assert_array_equal(
+        _manual_constant_pad_4d(x, 0, num_padding_patches),
+        _constant_pad(x, 0, num_padding_patches),
+    )
+
+    mib = 1024 * 1024
+    output_bytes = x.nbytes // num_patches * (num_patches + num_padding_patches)
+    before = _peak_bytes(lambda: _manual_constant_pad_4d(x, 0, num_padding_patches))
+    after = _peak_bytes(lambda: _constant_pad(x, 0, num_padding_patches))
+    print(f"input {x.shape}, padded output {output_bytes / mib:.1f} MiB")
+    print(f"{'manual slice/concat peak (MiB)':>32} {before / mib:>8.1f}")
+    print(f"{'ConstantPad peak (MiB)':>32} {after / mib:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
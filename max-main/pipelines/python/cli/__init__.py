@@ -14,19 +14,30 @@
 
 from .config import config_to_flag, pipeline_config_options
 from .device_options import DevicesOptionType
-from .generate import generate_text_for_pipeline, stream_text_to_console
+from .generate import (
+    generate_jsonl_for_pipeline,
+    generate_text_for_pipeline,
+    stream_text_to_console,
+)
 from .list import list_pipelines_to_console
-from .metrics import TextGenerationMetrics
+from .metrics import LatencyHistogram, ResourceSampler, TextGenerationMetrics
 from .serve import batch_config_from_pipeline_config, serve_pipeline
+from .warmup import WarmupShape, warmup_pipeline, warmup_shapes
 
 __all__ = [
     "DevicesOptionType",
+    "LatencyHistogram",
+    "ResourceSampler",
     "TextGenerationMetrics",
     "config_to_flag",
     "pipeline_config_options",
     "batch_config_from_pipeline_config",
     "serve_pipeline",
     "generate_text_for_pipeline",
+    "generate_jsonl_for_pipeline",
     "stream_text_to_console",
     "list_pipelines_to_console",
+    "WarmupShape",
+    "warmup_pipeline",
+    "warmup_shapes",
 ]
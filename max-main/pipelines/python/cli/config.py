@@ -21,6 +21,8 @@ from pathlib import Path
 from typing import Any, Union, get_args, get_origin
 
 import click
+from dataprocessing.compiled_model_cache import set_compiled_model_cache_enabled
+from dataprocessing.tokenizer import set_tokenizer_cache_enabled
 from max.driver import DeviceSpec
 from max.pipelines import PipelineConfig, SupportedEncoding
 
@@ -165,8 +167,33 @@ def pipeline_config_options(func):
             " provided optionally to indicate the device ID to target."
         ),
     )
+    @click.option(
+        "--no-tokenizer-cache",
+        is_flag=True,
+        show_default=True,
+        default=False,
+        help=(
+            "Disable the persistent tokenizer cache, and build the tokenizer"
+            " from its source."
+        ),
+    )
+    @click.option(
+        "--no-compiled-model-cache",
+        is_flag=True,
+        show_default=True,
+        default=False,
+        help=(
+            "Disable the persistent compiled model cache, and compile the model"
+            " on every start."
+        ),
+    )
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
+        if kwargs.pop("no_tokenizer_cache"):
+            set_tokenizer_cache_enabled(False)
+        if kwargs.pop("no_compiled_model_cache"):
+            set_compiled_model_cache_enabled(False)
+
         if kwargs["use_gpu"]:
             kwargs["device_spec"] = DeviceSpec.cuda(id=kwargs["use_gpu"][0])
             # If the user is passing in a specific, quantization_encoding don't overwrite it.
@@ -13,18 +13,26 @@
 """Utilities for generating text in the cli."""
 
 import asyncio
+import contextlib
+import json
 import logging
+import sys
 import uuid
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator, Optional, TextIO
 
+from dataprocessing import reset_load_profile
 from max.pipelines import PIPELINE_REGISTRY, PipelineConfig
 from max.pipelines.interfaces import (
     PipelineTokenizer,
     TokenGenerator,
     TokenGeneratorRequest,
 )
+from max.pipelines.kv_cache import KVCacheStrategy
+from nn.layer import profile_layers as layer_profiler
 
 from .metrics import TextGenerationMetrics
+from .warmup import warmup_pipeline, warmup_shapes_for_pipeline
 
 logger = logging.getLogger(__name__)
 
@@ -59,34 +67,58 @@ async def stream_text_to_console(
     if print_tokens:
         print(prompt, end="", flush=True)
 
-    first_token = True
-    while True:
-        responses = pipeline.next_token(request_id_context)[0]
-        if not responses:
-            break
+    # Decode and print tokens in a separate task, fed by a queue, while the
+    # next step runs on the engine thread. This keeps detokenization and
+    # terminal I/O off the critical path of generation.
+    token_queue: asyncio.Queue = asyncio.Queue()
 
-        for req_id, context in request_id_context.items():
-            if req_id not in responses or context.is_done(tokenizer.eos):
-                del request_id_context[req_id]
-                continue
-
-            encoded_text = responses[req_id].next_token
+    async def decode_tokens():
+        while (item := await token_queue.get()) is not None:
+            req_id, context, encoded_text = item
             response_text = await tokenizer.decode(context, encoded_text)
-            if metrics:
-                if first_token:
-                    first_token = False
-                    metrics.signpost("first_token")
-                metrics.new_token()
             if print_tokens:
                 print(response_text, end="", flush=True)
             else:
                 decoded_responses[req_id].append(response_text)
 
-        if not request_id_context:
-            break
+    decoder = asyncio.create_task(decode_tokens())
+    loop = asyncio.get_running_loop()
+    # Run every step on the same thread, for engines that expect that.
+    engine_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="next-token")
 
-    if metrics:
-        metrics.signpost("end_generation")
+    first_token = True
+    try:
+        while True:
+            responses = (
+                await loop.run_in_executor(
+                    engine_thread, pipeline.next_token, request_id_context
+                )
+            )[0]
+            if not responses:
+                break
+
+            for req_id, context in list(request_id_context.items()):
+                if req_id not in responses or context.is_done(tokenizer.eos):
+                    del request_id_context[req_id]
+                    pipeline.release(context)
+                    continue
+
+                if metrics:
+                    if first_token:
+                        first_token = False
+                        metrics.signpost("first_token")
+                    metrics.new_token()
+                token_queue.put_nowait((req_id, context, responses[req_id].next_token))
+
+            if not request_id_context:
+                break
+
+        if metrics:
+            metrics.signpost("end_generation")
+    finally:
+        token_queue.put_nowait(None)
+        await decoder
+        engine_thread.shutdown()
 
     for context in request_id_context.values():
         pipeline.release(context)
@@ -96,14 +128,37 @@ async def stream_text_to_console(
 
 
 def generate_text_for_pipeline(
-    pipeline_config: PipelineConfig, prompt: str, num_warmups: int = 0
+    pipeline_config: PipelineConfig,
+    prompt: str,
+    num_warmups: int = 0,
+    shape_warmup: bool = False,
+    profile_layers: bool = False,
+    metrics_json: Optional[str] = None,
+    resource_sample_interval: Optional[float] = None,
 ):
     # Run timed run & print results.
-    with TextGenerationMetrics(print_report=True) as metrics:
+    with TextGenerationMetrics(
+        print_report=True, sample_interval=resource_sample_interval
+    ) as metrics:
         # Load tokenizer and Pipeline.
-        tokenizer, pipeline = PIPELINE_REGISTRY.retrieve(pipeline_config)
+        load_profile = reset_load_profile()
+        with (
+            layer_profiler() if profile_layers else contextlib.nullcontext()
+        ) as profiler:
+            tokenizer, pipeline = PIPELINE_REGISTRY.retrieve(pipeline_config)
+        logger.info("Load profile: %s", load_profile.to_json())
+        if profiler is not None:
+            print("Graph build time and ops by layer type:")
+            print(profiler.summary())
+        metrics.add_load_profile(load_profile)
 
         # Run warmups if requested.
+        if shape_warmup:
+            asyncio.run(
+                warmup_pipeline(
+                    pipeline, tokenizer, warmup_shapes_for_pipeline(pipeline_config)
+                )
+            )
         if num_warmups > 0:
             logger.info("Running warmup...")
             for _ in range(num_warmups):
@@ -128,3 +183,195 @@ def generate_text_for_pipeline(
                 print_tokens=True,
             )
         )
+
+    if metrics_json:
+        metrics.write_json(metrics_json)
+
+
+def read_prompts_file(path: str) -> Iterator[dict[str, Any]]:
+    """Reads prompts from a JSONL file.
+
+    Each line is either a JSON string, or an object with a "prompt" key. All
+    other keys of an object (such as an "id") are copied to its result.
+    """
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"prompt": record}
+            if not isinstance(record, dict) or "prompt" not in record:
+                msg = (
+                    f"{path}:{line_number}: expected a string or an object with a"
+                    " prompt"
+                )
+                raise ValueError(msg)
+            yield record
+
+
+async def generate_batch_to_jsonl(
+    pipeline: TokenGenerator,
+    tokenizer: PipelineTokenizer,
+    records: list[dict[str, Any]],
+    output: TextIO,
+    batch_size: int,
+    metrics: Optional[TextGenerationMetrics] = None,
+    refill: bool = True,
+):
+    """Generates a response for each prompt, writing the results as JSONL.
+
+    Up to `batch_size` requests are executed together. As soon as a request
+    finishes, its result is written. If `refill` is set, the next prompt
+    takes its place in the batch, so the batch stays full until the prompts
+    run out. Otherwise the next batch is only admitted once every request of
+    the previous one finished, for pipelines that cannot mix requests at
+    different positions, such as those with a naive KV cache.
+
+    Results are written in the order that requests finish. Each result is its
+    prompt record, with the "index" of the prompt in `records`, the
+    "response" text and the number of prompt and response tokens.
+
+    The index of each `TokenGeneratorRequest` is the KV cache slot of the
+    request, so admitted requests take a free slot in `range(batch_size)` and
+    return it when they finish.
+    """
+    if batch_size < 1:
+        msg = f"batch_size must be positive, got {batch_size}"
+        raise ValueError(msg)
+
+    # The request index is the KV cache slot, so prompts are tokenized when a
+    # slot frees up rather than up front.
+    pending = list(reversed(range(len(records))))
+    free_slots = list(reversed(range(batch_size)))
+    # request id -> (prompt index, slot, context, prompt size, response pieces)
+    in_flight: dict[str, tuple[int, int, Any, int, list[str]]] = {}
+
+    def finish(req_id: str):
+        index, slot, context, prompt_size, pieces = in_flight.pop(req_id)
+        pipeline.release(context)
+        free_slots.append(slot)
+        result = dict(records[index])
+        result["index"] = index
+        result["response"] = "".join(pieces)
+        result["num_prompt_tokens"] = prompt_size
+        result["num_response_tokens"] = len(pieces)
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+        if metrics:
+            metrics.end_request(req_id)
+
+    if metrics:
+        metrics.signpost("begin_generation")
+
+    first_token = True
+    while pending or in_flight:
+        admit = refill or not in_flight
+        while admit and pending and free_slots:
+            index = pending.pop()
+            slot = free_slots.pop()
+            req_id = str(uuid.uuid4())
+            context = await tokenizer.new_context(
+                TokenGeneratorRequest(
+                    id=req_id,
+                    index=slot,
+                    prompt=records[index]["prompt"],
+                    model_name=MODEL_NAME,
+                )
+            )
+            in_flight[req_id] = (index, slot, context, context.current_length, [])
+            if metrics:
+                metrics.prompt_size += context.current_length
+                metrics.begin_request(req_id, prompt_size=context.current_length)
+
+        batch = {req_id: entry[2] for req_id, entry in in_flight.items()}
+        responses = pipeline.next_token(batch)[0]
+        for req_id, context in batch.items():
+            if req_id not in responses or context.is_done(tokenizer.eos):
+                finish(req_id)
+                continue
+
+            encoded_text = responses[req_id].next_token
+            in_flight[req_id][4].append(await tokenizer.decode(context, encoded_text))
+            if metrics:
+                if first_token:
+                    first_token = False
+                    metrics.signpost("first_token")
+                metrics.new_token(req_id)
+
+    if metrics:
+        metrics.signpost("end_generation")
+
+
+def generate_jsonl_for_pipeline(
+    pipeline_config: PipelineConfig,
+    prompts_file: str,
+    output_file: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    metrics_json: Optional[str] = None,
+    resource_sample_interval: Optional[float] = None,
+    shape_warmup: bool = False,
+):
+    """Generates a response for each prompt of a JSONL file.
+
+    Args:
+        pipeline_config: Config of the pipeline to generate with.
+        prompts_file: Path of the prompts, see `read_prompts_file`.
+        output_file: Path to write the results to as JSONL, or None to write
+            them to stdout.
+        batch_size: Maximum number of requests executed together. Defaults to
+            the pipeline's max cache batch size, which it cannot exceed.
+        metrics_json: Path to write the generation metrics to as JSON.
+        resource_sample_interval: If set, the process' resource usage is
+            sampled at this interval in seconds, see `ResourceSampler`.
+        shape_warmup: Whether to warm up the pipeline on the shapes of
+            `warmup_shapes_for_pipeline` before generating.
+    """
+    if batch_size is None:
+        batch_size = pipeline_config.max_cache_batch_size
+    if batch_size > pipeline_config.max_cache_batch_size:
+        msg = (
+            f"batch size {batch_size} is larger than the max cache batch size"
+            f" {pipeline_config.max_cache_batch_size}"
+        )
+        raise ValueError(msg)
+
+    records = list(read_prompts_file(prompts_file))
+    with TextGenerationMetrics(
+        print_report=True, sample_interval=resource_sample_interval
+    ) as metrics:
+        load_profile = reset_load_profile()
+        tokenizer, pipeline = PIPELINE_REGISTRY.retrieve(pipeline_config)
+        logger.info("Load profile: %s", load_profile.to_json())
+        metrics.add_load_profile(load_profile)
+        if shape_warmup:
+            asyncio.run(
+                warmup_pipeline(
+                    pipeline, tokenizer, warmup_shapes_for_pipeline(pipeline_config)
+                )
+            )
+
+        logger.info(
+            "Generating %d prompts with batch size %d...", len(records), batch_size
+        )
+        with (
+            open(output_file, "w")
+            if output_file
+            else contextlib.nullcontext(sys.stdout)
+        ) as output:
+            asyncio.run(
+                generate_batch_to_jsonl(
+                    pipeline,
+                    tokenizer,
+                    records,
+                    output,
+                    batch_size,
+                    metrics=metrics,
+                    refill=(
+                        pipeline_config.cache_strategy == KVCacheStrategy.CONTINUOUS
+                    ),
+                )
+            )
+
+    if metrics_json:
+        metrics.write_json(metrics_json)
@@ -13,14 +13,180 @@
 
 """Metric-gathering utilities for the pipelines."""
 
+import json
+import threading
 import time
-from typing import Any, Union
+from array import array
+from typing import Any, Hashable, Optional, Union
 
+import numpy as np
 import psutil
+from dataprocessing import LoadProfile
+
+
+class LatencyHistogram:
+    """Records latencies in a compact array, and reports their distribution.
+
+    Each latency takes 8 bytes, so that percentiles are exact rather than
+    approximated from buckets.
+    """
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self):
+        self._seconds = array("d")
+
+    def __len__(self) -> int:
+        return len(self._seconds)
+
+    def record(self, seconds: float, count: int = 1):
+        """Records `count` latencies of `seconds` each."""
+        if count == 1:
+            self._seconds.append(seconds)
+        else:
+            self._seconds.extend([seconds] * count)
+
+    def summary(self) -> dict[str, float]:
+        """Returns the count, mean, percentiles and max of the latencies in ms.
+
+        Returns an empty dict if no latency was recorded.
+        """
+        if not self._seconds:
+            return {}
+
+        milliseconds = np.frombuffer(self._seconds, dtype=np.float64) * 1000.0
+        summary = {"count": len(milliseconds), "mean_ms": float(milliseconds.mean())}
+        for q, value in zip(
+            self.PERCENTILES, np.percentile(milliseconds, self.PERCENTILES)
+        ):
+            summary[f"p{q}_ms"] = float(value)
+        summary["max_ms"] = float(milliseconds.max())
+        return summary
+
+
+class ResourceSampler:
+    """Samples the process' RSS, CPU usage and thread count in the background.
+
+    Samples are taken every `interval` seconds by a daemon thread, and stored
+    in a ring buffer that keeps the last `capacity` samples. Reading the
+    samples only takes a lock for as long as it takes to copy them, so the
+    sampler never slows down the thread being measured.
+    """
+
+    FIELDS = ("time", "rss", "cpu_percent", "num_threads")
+
+    def __init__(
+        self,
+        process: Optional[psutil.Process] = None,
+        interval: float = 0.1,
+        capacity: int = 36_000,
+    ):
+        if interval <= 0:
+            msg = f"interval must be positive, got {interval}"
+            raise ValueError(msg)
+        if capacity < 1:
+            msg = f"capacity must be positive, got {capacity}"
+            raise ValueError(msg)
+
+        self.interval = interval
+        self._process = process or psutil.Process()
+        self._samples = np.zeros((capacity, len(self.FIELDS)), dtype=np.float64)
+        self._num_samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="resource-sampler", daemon=True
+        )
+
+    def start(self):
+        # The first CPU percentage is measured from this call.
+        self._process.cpu_percent()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """Takes a sample now."""
+        with self._process.oneshot():
+            sample = (
+                time.time(),
+                self._process.memory_info().rss,
+                self._process.cpu_percent(),
+                self._process.num_threads(),
+            )
+        with self._lock:
+            self._samples[self._num_samples % len(self._samples)] = sample
+            self._num_samples += 1
+
+    def latest_rss(self) -> Optional[float]:
+        """Returns the RSS of the last sample in bytes, or None if there is none."""
+        with self._lock:
+            if not self._num_samples:
+                return None
+            return float(self._samples[(self._num_samples - 1) % len(self._samples)][1])
+
+    def samples(self) -> np.ndarray:
+        """Returns the samples in the ring buffer, oldest first.
+
+        Each row is a sample, with the columns of `FIELDS`.
+        """
+        with self._lock:
+            if self._num_samples <= len(self._samples):
+                return self._samples[: self._num_samples].copy()
+            start = self._num_samples % len(self._samples)
+            return np.concatenate((self._samples[start:], self._samples[:start]))
+
+    def phase_summary(self, phases: dict[str, tuple[float, float]]) -> dict[str, Any]:
+        """Returns the peak and mean resource usage during each phase.
+
+        Args:
+            phases: The start and end time of each phase.
+
+        Returns:
+            For each phase with samples, the number of samples, the peak and
+            mean RSS in GB, the mean and peak CPU usage in percent, and the
+            peak thread count.
+        """
+        samples = self.samples()
+        summary = {}
+        for name, (start, end) in phases.items():
+            in_phase = samples[(samples[:, 0] >= start) & (samples[:, 0] < end)]
+            if not len(in_phase):
+                continue
+
+            rss_gb = in_phase[:, 1] / (1024 * 1024 * 1024)
+            summary[name] = {
+                "samples": len(in_phase),
+                "peak_rss_gb": float(rss_gb.max()),
+                "mean_rss_gb": float(rss_gb.mean()),
+                "mean_cpu_percent": float(in_phase[:, 2].mean()),
+                "peak_cpu_percent": float(in_phase[:, 2].max()),
+                "peak_num_threads": int(in_phase[:, 3].max()),
+            }
+        return summary
 
 
 class TextGenerationMetrics:
-    """Metrics capturing and reporting for a text generation pipeline."""
+    """Metrics capturing and reporting for a text generation pipeline.
+
+    Args:
+        print_report: Whether to print a report when the `with` block exits.
+        print_raw: Whether the report includes the raw signposts.
+        batch_size: Number of requests generated together.
+        throughput_window: Length in seconds of the windows that the token
+            generation throughput is measured over.
+        sample_interval: If set, the RSS, CPU usage and thread count are
+            sampled every `sample_interval` seconds by a `ResourceSampler`,
+            and reported for each phase between signposts. Signposts then use
+            the last sampled RSS rather than measuring it.
+    """
 
     prompt_size: int
     output_size: int
@@ -35,22 +201,60 @@ class TextGenerationMetrics:
     _should_print_report: bool
     _process: psutil.Process
     _print_raw: bool
+    _load_profile: Optional[LoadProfile]
+    _time_per_output_token: LatencyHistogram
+    _time_to_first_token: LatencyHistogram
+    _token_times: array
+    _request_start_times: dict[Hashable, float]
+    _request_prompt_sizes: dict[Hashable, int]
+    _request_prompt_throughputs: list[float]
+    _num_finished_requests: int
+    _has_request_ids: bool
+    _last_token_times: dict[Hashable, float]
+    _resource_sampler: Optional[ResourceSampler]
 
-    def __init__(self, print_report: bool = False, print_raw: bool = False):
+    def __init__(
+        self,
+        print_report: bool = False,
+        print_raw: bool = False,
+        batch_size: int = 1,
+        throughput_window: float = 1.0,
+        sample_interval: Optional[float] = None,
+    ):
         self._signposts = {}
         self._mem_usage_marker = {}
-        self.batch_size = 1
+        self.batch_size = batch_size
+        self.throughput_window = throughput_window
         self.prompt_size = 0
         self.output_size = 0
         self._should_print_report = print_report
         self._start_time = time.time()
         self._process = psutil.Process()
         self._print_raw = print_raw
+        self._load_profile = None
+        self._time_per_output_token = LatencyHistogram()
+        self._time_to_first_token = LatencyHistogram()
+        self._token_times = array("d")
+        self._request_start_times = {}
+        self._request_prompt_sizes = {}
+        self._request_prompt_throughputs = []
+        self._num_finished_requests = 0
+        self._has_request_ids = False
+        self._last_token_times = {}
+        self._resource_sampler = None
+        self.resource_usage: dict[str, Any] = {}
+        if sample_interval is not None:
+            self._resource_sampler = ResourceSampler(
+                self._process, interval=sample_interval
+            )
+            self._resource_sampler.start()
 
     def __enter__(self):
         return self
 
     def __exit__(self, *exc):
+        if self._resource_sampler is not None:
+            self._resource_sampler.stop()
         self._calculate_results()
         if self._should_print_report:
             self._print_report(self._print_raw)
@@ -58,19 +262,118 @@ class TextGenerationMetrics:
     def signpost(self, name: str):
         """Measure the current time and memory usage, tagging it with a name for later reporting."""
         self._signposts[name] = time.time()
-        self._mem_usage_marker[name] = (self._process.memory_info().rss) / (
-            1024 * 1024 * 1024
-        )
+        rss = None
+        if self._resource_sampler is not None:
+            rss = self._resource_sampler.latest_rss()
+        if rss is None:
+            rss = self._process.memory_info().rss
+        self._mem_usage_marker[name] = rss / (1024 * 1024 * 1024)
+
+    def add_load_profile(self, profile: LoadProfile):
+        """Report the per-phase profile of loading the pipeline's model."""
+        self._load_profile = profile
+
+    @property
+    def load_profile(self) -> Optional[dict[str, Any]]:
+        """The load profile as a dict, see `LoadProfile.to_dict`."""
+        if self._load_profile is None:
+            return None
+        return self._load_profile.to_dict()
+
+    def begin_request(self, request_id: Hashable, prompt_size: Optional[int] = None):
+        """Report that a request started, to measure its time to first token.
 
-    def new_token(self):
+        Requests that are not begun are timed from the `begin_generation`
+        signpost. If `prompt_size` is given, the context-encoding throughput
+        of the request is measured at its first token.
+        """
+        self._request_start_times[request_id] = time.time()
+        if prompt_size is not None:
+            self._request_prompt_sizes[request_id] = prompt_size
+
+    def end_request(self, request_id: Hashable = None):
+        """Report that a request finished, to measure the requests per second.
+
+        If no request is ended, `batch_size` requests are assumed to finish
+        at the `end_generation` signpost.
+        """
+        self._num_finished_requests += 1
+        self._request_start_times.pop(request_id, None)
+        self._last_token_times.pop(request_id, None)
+
+    def new_token(self, request_id: Hashable = None):
         """Report that a new token has been generated."""
-        self.new_tokens(1)
+        self.new_tokens(1, request_id)
+
+    def new_tokens(self, num_tokens: int, request_id: Hashable = None):
+        """Report that a num_tokens tokens have been generated.
 
-    def new_tokens(self, num_tokens: int):
-        """Report that a num_tokens tokens have been generated."""
+        When several requests run together, pass the `request_id` that the
+        tokens belong to, so that latencies are measured per request.
+        """
+        now = time.time()
         self.output_size += num_tokens
+        if request_id is not None:
+            self._has_request_ids = True
+        self._token_times.extend([now] * num_tokens)
+
+        last_token_time = self._last_token_times.get(request_id)
+        self._last_token_times[request_id] = now
+        if last_token_time is not None:
+            self._time_per_output_token.record(
+                (now - last_token_time) / num_tokens, num_tokens
+            )
+            return
+
+        start_time = self._request_start_times.get(
+            request_id, self._signposts.get("begin_generation")
+        )
+        if start_time is not None:
+            self._time_to_first_token.record(now - start_time)
+            prompt_size = self._request_prompt_sizes.pop(request_id, None)
+            if prompt_size is not None and now > start_time:
+                self._request_prompt_throughputs.append(
+                    prompt_size / (now - start_time)
+                )
+        if num_tokens > 1:
+            # Tokens after the first one arrived together with it.
+            self._time_per_output_token.record(0.0, num_tokens - 1)
+
+    def windowed_throughput(self) -> list[float]:
+        """Returns the tokens per second of each full `throughput_window`.
+
+        Windows start at the first token, and the last, partial, window is
+        dropped.
+        """
+        if not self._token_times:
+            return []
+        times = np.frombuffer(self._token_times, dtype=np.float64)
+        windows = ((times - times[0]) // self.throughput_window).astype(np.int64)
+        counts = np.bincount(windows)[:-1]
+        return (counts / self.throughput_window).tolist()
+
+    def _signpost_phases(self) -> dict[str, tuple[float, float]]:
+        """Returns the start and end time of the phases between signposts.
+
+        The first phase, "startup", starts when the metrics are created, and
+        each signpost starts a phase of the same name.
+        """
+        phases = {}
+        name, start = "startup", self._start_time
+        for next_name, next_start in sorted(
+            self._signposts.items(), key=lambda item: item[1]
+        ):
+            phases[name] = (start, next_start)
+            name, start = next_name, next_start
+        phases[name] = (start, time.time())
+        return phases
 
     def _calculate_results(self):
+        if self._resource_sampler is not None:
+            self.resource_usage = self._resource_sampler.phase_summary(
+                self._signpost_phases()
+            )
+
         begin_generation = self._signposts.get("begin_generation")
         if begin_generation:
             self.startup_time = (
@@ -85,9 +388,18 @@ class TextGenerationMetrics:
             self.time_to_first_token = (
                 self._signposts["first_token"] - self._signposts["begin_generation"]
             ) * 1000.0
-            self.prompt_eval_throughput = (
-                self.prompt_size * self.batch_size / (self.time_to_first_token / 1000.0)
-            )
+            if self._request_prompt_throughputs:
+                # With requests of their own, the first token only times the
+                # first batch, so report the mean throughput of the requests.
+                self.prompt_eval_throughput = float(
+                    np.mean(self._request_prompt_throughputs)
+                )
+            else:
+                self.prompt_eval_throughput = (
+                    self.prompt_size
+                    * self.batch_size
+                    / (self.time_to_first_token / 1000.0)
+                )
         else:
             self.time_to_first_token = "n/a"
             self.prompt_eval_throughput = "n/a"
@@ -104,6 +416,13 @@ class TextGenerationMetrics:
             self.time_per_output_token: Any = (
                 generation_time * 1000.0 / (self.output_size - 1)
             )
+            if self._has_request_ids and len(self._time_per_output_token):
+                # Tokens of concurrent requests interleave, so the time
+                # between any two tokens understates the time each request
+                # waits for its next token. Report the mean per request.
+                self.time_per_output_token = (
+                    self._time_per_output_token.summary()["mean_ms"]
+                )
         else:
             self.eval_throughput = "n/a"
             self.time_per_output_token = "n/a"
@@ -112,12 +431,41 @@ class TextGenerationMetrics:
             total_batch_time = (
                 self._signposts["end_generation"] - self._signposts["begin_generation"]
             )
-            self.requests_per_second: Any = self.batch_size / total_batch_time
+            num_requests = self._num_finished_requests or self.batch_size
+            self.requests_per_second: Any = num_requests / total_batch_time
             self.total_exe_time: Any = total_batch_time * 1000
         else:
             self.total_exe_time = "n/a"
             self.requests_per_second = "n/a"
 
+    def to_dict(self) -> dict[str, Any]:
+        """Returns the calculated results as a JSON serializable dict."""
+        return {
+            "prompt_size": self.prompt_size,
+            "output_size": self.output_size,
+            "batch_size": self.batch_size,
+            "num_finished_requests": self._num_finished_requests,
+            "startup_time_ms": self.startup_time,
+            "time_to_first_token_ms": self.time_to_first_token,
+            "prompt_eval_throughput": self.prompt_eval_throughput,
+            "time_per_output_token_ms": self.time_per_output_token,
+            "eval_throughput": self.eval_throughput,
+            "total_latency_ms": self.total_exe_time,
+            "requests_per_second": self.requests_per_second,
+            "time_per_output_token_distribution": self._time_per_output_token.summary(),
+            "time_to_first_token_distribution": self._time_to_first_token.summary(),
+            "throughput_window_s": self.throughput_window,
+            "windowed_eval_throughput": self.windowed_throughput(),
+            "load_profile": self.load_profile,
+            "resource_usage": self.resource_usage,
+        }
+
+    def write_json(self, path: str):
+        """Writes the calculated results to `path` as JSON, see `to_dict`."""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write("\n")
+
     def _print_report(self, print_raw=False):
         print()
         print("Prompt size:", self.prompt_size)
@@ -130,16 +478,56 @@ class TextGenerationMetrics:
             "tokens per second",
         )
         print("Time per Output Token:", self.time_per_output_token, "ms")
+        if tpot := self._time_per_output_token.summary():
+            print("Time per Output Token distribution:", _format_latencies(tpot))
         print(
             "Eval throughput (token-generation):",
             self.eval_throughput,
             "tokens per second",
         )
+        if windows := self.windowed_throughput():
+            print(
+                f"Eval throughput over {self.throughput_window:g}s windows:"
+                f" min {min(windows):.1f}, p50 {float(np.median(windows)):.1f},"
+                f" max {max(windows):.1f} tokens per second"
+            )
+        if len(self._time_to_first_token) > 1:
+            print(
+                "Time to first token per request:",
+                _format_latencies(self._time_to_first_token.summary()),
+            )
         print("Total Latency:", self.total_exe_time, "ms")
         print("Total Throughput:", self.requests_per_second, "req/s")
+        if self.resource_usage:
+            print("Resource usage by phase:")
+            for name, usage in self.resource_usage.items():
+                print(
+                    f"  {name}: peak RSS {usage['peak_rss_gb']:.2f} GB,"
+                    f" mean RSS {usage['mean_rss_gb']:.2f} GB,"
+                    f" mean CPU {usage['mean_cpu_percent']:.0f}%,"
+                    f" peak threads {usage['peak_num_threads']}"
+                )
+        if self._load_profile is not None:
+            print("Load time by phase:")
+            for phase in self._load_profile.phases():
+                line = f"  {phase.name}: {phase.seconds * 1000.0:.1f} ms"
+                if phase.mb_per_s is not None:
+                    line += (
+                        f", {phase.nbytes / 1e6:.1f} MB"
+                        f" at {phase.mb_per_s:.1f} MB/s"
+                    )
+                print(line)
         if print_raw:
             print("=============raw stats=================")
             for k, v in self._signposts.items():
                 print(
                     f"Started {k} at {v} with memory" f" {self._mem_usage_marker[k]} GB"
                 )
+
+
+def _format_latencies(summary: dict[str, float]) -> str:
+    return ", ".join(
+        f"{name[: -len('_ms')]} {value:.2f} ms"
+        for name, value in summary.items()
+        if name.endswith("_ms") and name != "mean_ms"
+    )
@@ -36,6 +36,8 @@ from opentelemetry import trace
 from transformers import AutoTokenizer
 from uvicorn import Server
 
+from .warmup import warmed_up_pipeline_factory
+
 logger = logging.getLogger(__name__)
 
 
@@ -79,6 +81,7 @@ def serve_pipeline(
     profile: bool = False,
     batch_timeout: float = 0.0,
     model_name: Union[str, None] = None,
+    shape_warmup: bool = False,
 ):
     # TODO: make validate_pipeline_config more generic or cleanly handle the
     # case where this is a generalized model unsupported by MAX
@@ -92,6 +95,12 @@ def serve_pipeline(
         tokenizer, pipeline_factory = PIPELINE_REGISTRY.retrieve_factory(
             pipeline_config,
         )
+        if shape_warmup:
+            # Warm up each pipeline as it is created, before serving reports
+            # that the model is ready.
+            pipeline_factory = warmed_up_pipeline_factory(
+                pipeline_factory, tokenizer, pipeline_config
+            )
     else:
         logger.info(f"Starting server using performance fake {performance_fake}.")
         tokenizer = PerformanceFakingPipelineTokenizer(
@@ -0,0 +1,315 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+
+"""Warms up a pipeline on the batch and sequence shapes it will serve."""
+
+import asyncio
+import functools
+import logging
+import math
+import os
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Coroutine, Optional
+
+from max.pipelines import PipelineConfig
+from max.pipelines.interfaces import (
+    PipelineTokenizer,
+    TokenGenerator,
+    TokenGeneratorRequest,
+)
+
+logger = logging.getLogger(__name__)
+
+WARMUP_MODEL_NAME = "warmup"
+
+# Word repeated to build synthetic prompts, which is a single token for most
+# tokenizers.
+_FILLER_WORD = "the"
+
+# Number of token generation steps run after each context encoding step.
+_NUM_TOKEN_GENERATION_STEPS = 1
+
+# Overrides the token budget of a warmup context encoding step.
+_WARMUP_MAX_TOKENS_ENV = "MODULAR_WARMUP_MAX_TOKENS"
+
+# Default token budget of a warmup context encoding step. Longer prompts and
+# larger batches are rare enough that they are left to compile on demand,
+# rather than risk running out of memory or stalling startup.
+DEFAULT_WARMUP_MAX_TOKENS = 8192
+
+
+@dataclass(frozen=True)
+class WarmupShape:
+    """A batch of `batch_size` requests with prompts of `seq_len` tokens.
+
+    If `context_encoding_batch_size` is set, the prompts are encoded in steps
+    of at most that many requests, so that token generation runs on a batch
+    larger than a context encoding step allows.
+    """
+
+    batch_size: int
+    seq_len: int
+    context_encoding_batch_size: Optional[int] = None
+
+
+@dataclass
+class WarmupResult:
+    """Step latencies of a warmup shape, in milliseconds.
+
+    The first run includes any compilation or allocation that the shape
+    triggers, while the steady state is the median of the following runs.
+    """
+
+    shape: WarmupShape
+    prompt_len: int
+    context_encoding_first_ms: float
+    context_encoding_steady_ms: Optional[float]
+    token_generation_first_ms: float
+    token_generation_steady_ms: Optional[float]
+
+
+def _powers_of_two_up_to(start: int, stop: int) -> list[int]:
+    """Returns `start`, doubled while at most `stop`, and `stop` itself."""
+    values = []
+    value = start
+    while value < stop:
+        values.append(value)
+        value *= 2
+    values.append(stop)
+    return values
+
+
+def warmup_shapes(
+    max_cache_batch_size: int,
+    max_ce_batch_size: int,
+    pad_to_multiple_of: int,
+    max_length: int,
+    min_seq_len: int = 128,
+    max_tokens: int = DEFAULT_WARMUP_MAX_TOKENS,
+) -> list[WarmupShape]:
+    """Returns the representative shapes of the traffic a pipeline serves.
+
+    Batch sizes are the powers of two up to the largest context encoding
+    batch. Sequence lengths start at `min_seq_len` rounded up to a multiple of
+    `pad_to_multiple_of`, and double up to the longest prompt that still
+    leaves room to generate, or `max_tokens` if that is shorter. Shapes of
+    more than `max_tokens` tokens are left out, except for a single request
+    of the shortest sequence length.
+
+    Token generation batches can grow up to `max_cache_batch_size`, so the
+    larger powers of two up to it are added with the shortest sequence
+    length, and encoded in several context encoding steps.
+
+    Args:
+        max_cache_batch_size: Maximum number of requests in the KV cache.
+        max_ce_batch_size: Maximum number of requests encoded together.
+        pad_to_multiple_of: Multiple that sequence lengths are padded to.
+        max_length: Maximum sequence length of a request.
+        min_seq_len: Shortest prompt length to warm up.
+        max_tokens: Maximum number of tokens of a context encoding step.
+    """
+    if max_tokens < 1:
+        msg = f"max_tokens must be positive, got {max_tokens}"
+        raise ValueError(msg)
+    max_batch_size = max(1, min(max_cache_batch_size, max_ce_batch_size))
+    max_seq_len = max_length - _NUM_TOKEN_GENERATION_STEPS
+    if max_seq_len < 1:
+        msg = f"max_length {max_length} leaves no room for a prompt"
+        raise ValueError(msg)
+
+    bucket = max(1, pad_to_multiple_of)
+    first_seq_len = min(math.ceil(max(1, min_seq_len) / bucket) * bucket, max_seq_len)
+    last_seq_len = max(first_seq_len, min(max_seq_len, max_tokens))
+    batch_sizes = _powers_of_two_up_to(1, max_batch_size)
+    seq_lens = _powers_of_two_up_to(first_seq_len, last_seq_len)
+    shapes = [
+        WarmupShape(batch_size, seq_len)
+        for batch_size in batch_sizes
+        for seq_len in seq_lens
+        if batch_size * seq_len <= max_tokens
+        or (batch_size == 1 and seq_len == first_seq_len)
+    ]
+
+    context_encoding_batch_size = max(
+        1, min(max_batch_size, max_tokens // first_seq_len)
+    )
+    shapes.extend(
+        WarmupShape(batch_size, first_seq_len, context_encoding_batch_size)
+        for batch_size in _powers_of_two_up_to(1, max(1, max_cache_batch_size))
+        if batch_size > max_batch_size
+    )
+    return shapes
+
+
+def warmup_shapes_for_pipeline(pipeline_config: PipelineConfig) -> list[WarmupShape]:
+    """Returns `warmup_shapes` for the limits of `pipeline_config`.
+
+    The token budget of a step defaults to the value of the
+    `MODULAR_WARMUP_MAX_TOKENS` environment variable, or
+    `DEFAULT_WARMUP_MAX_TOKENS`.
+    """
+    return warmup_shapes(
+        max_cache_batch_size=pipeline_config.max_cache_batch_size,
+        max_ce_batch_size=pipeline_config.max_ce_batch_size,
+        pad_to_multiple_of=pipeline_config.pad_to_multiple_of,
+        max_length=pipeline_config.max_length,
+        max_tokens=int(os.getenv(_WARMUP_MAX_TOKENS_ENV, DEFAULT_WARMUP_MAX_TOKENS)),
+    )
+
+
+async def _run_shape(
+    pipeline: TokenGenerator,
+    tokenizer: PipelineTokenizer,
+    shape: WarmupShape,
+) -> tuple[int, float, float]:
+    """Runs a batch of `shape` once.
+
+    Returns the prompt length and the context encoding and token generation
+    step latencies, in milliseconds.
+    """
+    # Leave a token for the BOS token that most tokenizers add.
+    prompt = " ".join([_FILLER_WORD] * max(1, shape.seq_len - 1))
+    batch = {}
+    for index in range(shape.batch_size):
+        req_id = str(uuid.uuid4())
+        batch[req_id] = await tokenizer.new_context(
+            TokenGeneratorRequest(
+                id=req_id, index=index, prompt=prompt, model_name=WARMUP_MODEL_NAME
+            )
+        )
+    prompt_len = next(iter(batch.values())).current_length
+    context_encoding_batches = [batch]
+    if shape.context_encoding_batch_size is not None:
+        items = list(batch.items())
+        context_encoding_batches = [
+            dict(items[start : start + shape.context_encoding_batch_size])
+            for start in range(0, len(items), shape.context_encoding_batch_size)
+        ]
+
+    try:
+        start = time.perf_counter()
+        for context_encoding_batch in context_encoding_batches:
+            pipeline.next_token(context_encoding_batch)
+        context_encoding_ms = (time.perf_counter() - start) * 1000.0
+
+        start = time.perf_counter()
+        for _ in range(_NUM_TOKEN_GENERATION_STEPS):
+            pipeline.next_token(batch)
+        token_generation_ms = (
+            (time.perf_counter() - start) * 1000.0 / _NUM_TOKEN_GENERATION_STEPS
+        )
+    finally:
+        for context in batch.values():
+            pipeline.release(context)
+    return prompt_len, context_encoding_ms, token_generation_ms
+
+
+async def warmup_pipeline(
+    pipeline: TokenGenerator,
+    tokenizer: PipelineTokenizer,
+    shapes: list[WarmupShape],
+    num_runs: int = 3,
+) -> list[WarmupResult]:
+    """Runs synthetic requests of each shape through `pipeline`.
+
+    Each shape is run `num_runs` times: a context encoding step followed by a
+    token generation step. The first run and steady state latencies of each
+    shape are logged, so that shapes which still stall after warmup stand out.
+    """
+    if num_runs < 1:
+        msg = f"num_runs must be positive, got {num_runs}"
+        raise ValueError(msg)
+
+    logger.info("Warming up %d shapes...", len(shapes))
+    warmup_start = time.perf_counter()
+    results = []
+    for shape in shapes:
+        runs = [await _run_shape(pipeline, tokenizer, shape) for _ in range(num_runs)]
+        steady_runs = runs[1:]
+        result = WarmupResult(
+            shape=shape,
+            prompt_len=runs[0][0],
+            context_encoding_first_ms=runs[0][1],
+            context_encoding_steady_ms=(
+                statistics.median(run[1] for run in steady_runs)
+                if steady_runs
+                else None
+            ),
+            token_generation_first_ms=runs[0][2],
+            token_generation_steady_ms=(
+                statistics.median(run[2] for run in steady_runs)
+                if steady_runs
+                else None
+            ),
+        )
+        results.append(result)
+        logger.info(
+            "Warmup batch size %d, prompt length %d: context encoding first %.1f"
+            " ms, steady %s ms; token generation first %.1f ms, steady %s ms",
+            shape.batch_size,
+            result.prompt_len,
+            result.context_encoding_first_ms,
+            _format_ms(result.context_encoding_steady_ms),
+            result.token_generation_first_ms,
+            _format_ms(result.token_generation_steady_ms),
+        )
+
+    logger.info("Warmup finished in %.1f s", time.perf_counter() - warmup_start)
+    return results
+
+
+def _format_ms(milliseconds: Optional[float]) -> str:
+    return "n/a" if milliseconds is None else f"{milliseconds:.1f}"
+
+
+def _run_coroutine(coroutine: Coroutine[Any, Any, Any]) -> Any:
+    """Runs `coroutine` to completion, even from a thread with a running loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def _create_warmed_up_pipeline(
+    pipeline_factory: Callable[[], TokenGenerator],
+    tokenizer: PipelineTokenizer,
+    shapes: list[WarmupShape],
+) -> TokenGenerator:
+    pipeline = pipeline_factory()
+    _run_coroutine(warmup_pipeline(pipeline, tokenizer, shapes))
+    return pipeline
+
+
+def warmed_up_pipeline_factory(
+    pipeline_factory: Callable[[], TokenGenerator],
+    tokenizer: PipelineTokenizer,
+    pipeline_config: PipelineConfig,
+) -> Callable[[], TokenGenerator]:
+    """Wraps a pipeline factory to warm up the pipelines it creates.
+
+    Serving creates the pipeline with the factory before the model worker
+    reports that it is ready, so the warmup runs before any request is
+    accepted.
+    """
+    return functools.partial(
+        _create_warmed_up_pipeline,
+        pipeline_factory,
+        tokenizer,
+        warmup_shapes_for_pipeline(pipeline_config),
+    )
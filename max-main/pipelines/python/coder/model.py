@@ -16,7 +16,13 @@ from __future__ import annotations
 import logging
 
 import numpy as np
-from dataprocessing import batch_padded_tokens_and_mask
+from dataprocessing import (
+    RaggedBatchBuilder,
+    batch_padded_tokens_and_mask,
+    file_nbytes,
+    load_profile,
+    weights_registry_nbytes,
+)
 from max.driver import Tensor
 from max.dtype import DType
 from max.engine import InferenceSession, Model
@@ -51,25 +57,7 @@ class CoderModel(PipelineModel):
     def _prepare_continuous_initial_token_inputs(
         self, context_batch: list[TextContext]
     ) -> tuple[Tensor, ...]:
-        # Get tokens and seq_ids
-        tokens = [ctx.next_tokens for ctx in context_batch]
-
-        # Get input_row_offsets: start and end position of each batch in the
-        # combined total_seq_len dimension.
-        input_row_offsets = Tensor.from_numpy(
-            np.cumsum(
-                [0] + [ctx.seq_len for ctx in context_batch],
-                dtype=np.uint32,
-            )
-        ).to(self.pipeline_config.device)
-
-        # Create a ragged token vector of length: sum(len(t) for t in tokens).
-        next_tokens_batch = np.concatenate(tokens)
-        next_tokens_batch = Tensor.from_numpy(next_tokens_batch).to(
-            self.pipeline_config.device
-        )
-
-        return (next_tokens_batch, input_row_offsets)
+        return self._ragged_batch_builder([ctx.next_tokens for ctx in context_batch])
 
     def _prepare_naive_initial_token_inputs(
         self, context_batch: list[TextContext]
@@ -185,8 +173,18 @@ class CoderModel(PipelineModel):
             np.arange(self.pipeline_config.max_cache_batch_size + 1, dtype=np.uint32)
         ).to(self.pipeline_config.device)
 
+        # Reuse host staging buffers to build the ragged context encoding batch.
+        self._ragged_batch_builder = RaggedBatchBuilder(
+            max_batch_size=self.pipeline_config.max_cache_batch_size,
+            max_length=self.pipeline_config.max_length,
+            device=self.pipeline_config.device,
+        )
+
+        profile = load_profile()
+
         # Read in weights.
-        self._weights = self.pipeline_config.load_weights()
+        with profile.phase("weight_read"):
+            self._weights = self.pipeline_config.load_weights()
 
         if serialized_path := self.pipeline_config.serialized_model_path:
             # Hydrate all weights to be referenced by the serialized path.
@@ -196,24 +194,34 @@ class CoderModel(PipelineModel):
 
             logging.info("Loading serialized model from ", serialized_path)
 
-            return session.load(serialized_path, weights_registry=weights_registry)
+            with profile.phase(
+                "mef_import",
+                nbytes=file_nbytes(serialized_path)
+                + weights_registry_nbytes(weights_registry),
+            ):
+                return session.load(serialized_path, weights_registry=weights_registry)
 
         else:
             logging.info("Building model...")
-            graph = _build_graph(
-                self.pipeline_config,
-                self._weights,
-                self._get_kv_params(),
-                kv_manager=self.kv_manager,
-            )
+            with profile.phase("graph_build"):
+                graph = _build_graph(
+                    self.pipeline_config,
+                    self._weights,
+                    self._get_kv_params(),
+                    kv_manager=self.kv_manager,
+                )
             logging.info("Compiling...")
-            model = session.load(
-                graph,
-                weights_registry=self._weights.allocated_weights,  # type: ignore
-            )
+            weights_registry = self._weights.allocated_weights
+            with profile.phase("compile"):
+                model = session.load(
+                    graph,
+                    weights_registry=weights_registry,  # type: ignore
+                )
             if export_path := self.pipeline_config.save_to_serialized_model_path:
                 logging.info("Exporting serialized model to %s", export_path)
-                model._export_mef(export_path)
+                with profile.phase("mef_export"):
+                    model._export_mef(export_path)
+                profile.add_bytes("mef_export", file_nbytes(export_path))
             return model
 
     def compute_log_probabilities(
@@ -12,15 +12,57 @@
 # ===----------------------------------------------------------------------=== #
 
 from .causal_attention_mask import causal_attention_mask
-from .causal_attention_mask_with_alibi import causal_attention_mask_with_alibi
-from .collate_batch import PaddingDirection, batch_padded_tokens_and_mask, collate_batch
+from .causal_attention_mask_with_alibi import (
+    alibi_bias,
+    alibi_slopes,
+    causal_attention_mask_with_alibi,
+)
+from .collate_batch import (
+    PaddingDirection,
+    batch_padded_tokens_and_mask,
+    collate_batch,
+    collate_into,
+)
+from .compiled_model_cache import (
+    CompiledModelCache,
+    compiled_model_cache_dir,
+    compiled_model_cache_enabled,
+    pipeline_config_fingerprint,
+    set_compiled_model_cache_enabled,
+)
+from .incremental_causal_attention_mask import IncrementalCausalAttentionMask
+from .load_profile import (
+    LoadPhase,
+    LoadProfile,
+    file_nbytes,
+    load_profile,
+    reset_load_profile,
+    weights_registry_nbytes,
+)
 from .max_tokens_to_generate import max_tokens_to_generate
+from .ragged_batch import RaggedBatchBuilder
 
 __all__ = [
+    "alibi_bias",
+    "alibi_slopes",
     "causal_attention_mask",
     "causal_attention_mask_with_alibi",
+    "CompiledModelCache",
+    "compiled_model_cache_dir",
+    "compiled_model_cache_enabled",
+    "pipeline_config_fingerprint",
+    "set_compiled_model_cache_enabled",
+    "IncrementalCausalAttentionMask",
+    "LoadPhase",
+    "LoadProfile",
+    "file_nbytes",
+    "load_profile",
+    "reset_load_profile",
+    "weights_registry_nbytes",
     "collate_batch",
+    "collate_into",
     "batch_padded_tokens_and_mask",
     "PaddingDirection",
     "max_tokens_to_generate",
+    "RaggedBatchBuilder",
 ]
@@ -14,9 +14,20 @@
 from __future__ import annotations
 
 import math
+import threading
+from collections import OrderedDict
 
 import numpy as np
 
+# TODO(KERN-782): This should be -inf but softmax saturates with NaNs.
+MASK_FILL_VALUE = -10000.0
+
+# Total size of the context encoding masks kept by the mask cache, in bytes.
+# Hits come from repeated batches of the same shape, such as benchmarks or
+# replayed prompts, whose masks can be large, so the cache is bounded by bytes
+# rather than by entries.
+_MASK_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
 
 def causal_attention_mask(
     original_start_pos: list[int],
@@ -37,31 +48,96 @@ def causal_attention_mask(
     #
     # We call the total length "post_seq_len", referring to the total context
     # length after this pass concludes.
-    start_pos: np.ndarray = np.array(original_start_pos, dtype=np.int64)
-    seq_len: np.ndarray = np.array(original_seq_len, dtype=np.int64)
+    #
+    # The returned mask is owned by the caller: cached masks are copied, so
+    # the result is writable and can be exported to the device with DLPack.
+    key = (
+        tuple(int(s) for s in original_start_pos),
+        tuple(int(s) for s in original_seq_len),
+        pad_to_multiple_of,
+    )
+    if max(key[1]) == 1:
+        # Token generation steps advance `start_pos` every step, so their
+        # masks are never reused.
+        return _build_causal_attention_mask(*key)
+
+    mask = _mask_cache.get(key)
+    if mask is None:
+        mask = _build_causal_attention_mask(*key)
+        _mask_cache.put(key, mask)
+    return mask.copy()
+
+
+class _MaskCache:
+    """LRU cache of causal attention masks, bounded by their total size."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._masks: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> np.ndarray | None:
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+            return mask
+
+    def put(self, key: tuple, mask: np.ndarray) -> None:
+        if mask.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._masks:
+                return
+            self._masks[key] = mask
+            self._nbytes += mask.nbytes
+            while self._nbytes > self.max_bytes:
+                _, evicted = self._masks.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._masks.clear()
+            self._nbytes = 0
+
+
+_mask_cache = _MaskCache(_MASK_CACHE_MAX_BYTES)
+
+
+def _build_causal_attention_mask(
+    start_pos: tuple[int, ...],
+    seq_len: tuple[int, ...],
+    pad_to_multiple_of: int,
+) -> np.ndarray:
+    start = np.array(start_pos, dtype=np.int64)
+    max_seq_len = max(seq_len)
 
     # Provided `pad_to_multiple_of` ensure the padded_length is cleanly divisible
     # by this multiple.
     # If max_len is 1, we are presumably in a token generation phase batch.
     # W scenario, padding from 1 -> 2, does not result in a performance gain.
-    if seq_len.max() == 1:
+    if max_seq_len == 1:
         padded_length = 1
     else:
         padded_length = (
-            math.ceil(seq_len.max() / pad_to_multiple_of) * pad_to_multiple_of
+            math.ceil(max_seq_len / pad_to_multiple_of) * pad_to_multiple_of
         )
 
     # Mask shape: for each token being generated, attend to tokens _before_ it
     # in the entire sequence including context. Pad all values to the longest
     # sequence length and total length.
-    post_seq_len = (start_pos + padded_length).max()
-    mask_shape = (padded_length, post_seq_len)
+    post_seq_len = int(start.max()) + padded_length
 
-    # TODO(KERN-782): This should be -inf but softmax saturates with NaNs.
-    fill_val = -10000.0
-    fill_matrix = np.full(mask_shape, fill_val, dtype=np.float32)
-
-    return np.stack(
-        # Set diagonal to k + 1 so that tokens attend to themselves.
-        [np.triu(fill_matrix, k=k + 1) for k in start_pos]
+    # Token `i` of batch item `b` sits at absolute position `start[b] + i`, so
+    # it may see every column `j <= start[b] + i`. Compare the column indices
+    # against that limit once for the whole batch and write the result into a
+    # single output buffer.
+    last_visible = (
+        start[:, None, None] + np.arange(padded_length)[None, :, None]
     )
+    hidden = np.arange(post_seq_len)[None, None, :] > last_visible
+
+    mask = np.zeros((len(start), padded_length, post_seq_len), dtype=np.float32)
+    np.copyto(mask, np.float32(MASK_FILL_VALUE), where=hidden)
+    return mask
@@ -13,22 +13,18 @@
 
 from __future__ import annotations
 
+import math
+
 import numpy as np
 
 from .causal_attention_mask import causal_attention_mask
 
 
-def _alibi_bias(max_seq_len: int, alibi_bias_max: int, n_heads: int) -> np.ndarray:
-    # This bias has to be calculated in fp32, as numpy does not have support for bf16.
-    bias = np.arange(1 - max_seq_len, 1, 1).reshape((1, 1, 1, max_seq_len))
-    rounded_n_heads = int(
-        np.power(np.asfarray(2), np.ceil(np.log2(np.asfarray(n_heads))))
-    )
-    m = np.arange(1.0, 1.0 + rounded_n_heads) * (
-        np.asfarray(alibi_bias_max) / np.asfarray(rounded_n_heads)
-    )
-
-    slopes = np.asfarray(1.0) / np.power(2.0, m)
+def alibi_slopes(alibi_bias_max: int, n_heads: int) -> np.ndarray:
+    """Computes the `(n_heads,)` ALiBi slope of each attention head."""
+    rounded_n_heads = 2 ** math.ceil(math.log2(n_heads))
+    m = np.arange(1.0, 1.0 + rounded_n_heads) * (alibi_bias_max / rounded_n_heads)
+    slopes = 1.0 / np.power(2.0, m)
 
     if rounded_n_heads != n_heads:
         slopes = np.concatenate(
@@ -36,11 +32,21 @@ def _alibi_bias(max_seq_len: int, alibi_bias_max: int, n_heads: int) -> np.ndarr
         )
         slopes = slopes[0:n_heads]
 
-    slopes = slopes.reshape(1, n_heads, 1, 1)
+    return slopes
 
-    alibi_bias = bias * slopes
 
-    return alibi_bias[:, :, :, :max_seq_len]
+def alibi_bias(max_seq_len: int, alibi_bias_max: int, n_heads: int) -> np.ndarray:
+    """Computes an `(n_heads, max_seq_len)` float32 ALiBi bias table.
+
+    The bias for a mask with `post_seq_len` columns is the trailing slice
+    `table[:, -post_seq_len:]`, so a table computed once for the longest
+    sequence serves every shorter one.
+    """
+    # The product is calculated in fp64 and rounded once, as numpy does not
+    # have support for bf16.
+    bias = np.arange(1 - max_seq_len, 1, 1).reshape((1, max_seq_len))
+    slopes = alibi_slopes(alibi_bias_max, n_heads).reshape(n_heads, 1)
+    return (bias * slopes).astype(np.float32)
 
 
 def causal_attention_mask_with_alibi(
@@ -49,18 +55,27 @@ def causal_attention_mask_with_alibi(
     alibi_bias_max: int,
     n_heads: int,
     pad_to_multiple_of: int = 1,
+    alibi_bias_table: np.ndarray | None = None,
 ) -> np.ndarray:
+    """Computes a `(batch, n_heads, seq_len, post_seq_len)` causal ALiBi mask.
+
+    If `alibi_bias_table` is provided (see `alibi_bias`) and is long enough,
+    it is sliced instead of recomputing the bias for every call.
+    """
     # Get original causal mask
     causal_mask = causal_attention_mask(
         original_start_pos, original_seq_len, pad_to_multiple_of
     )
 
-    max_seq_len = causal_mask.shape[2]
-
-    # Broadcast causal_mask out for n_heads
-    causal_mask = np.expand_dims(causal_mask, axis=1)
+    batch_size, seq_len, post_seq_len = causal_mask.shape
 
     # Get alibi bias
-    alibi_bias = _alibi_bias(max_seq_len, alibi_bias_max, n_heads)
-
-    return causal_mask + np.float32(alibi_bias)
+    if alibi_bias_table is None or alibi_bias_table.shape[-1] < post_seq_len:
+        alibi_bias_table = alibi_bias(post_seq_len, alibi_bias_max, n_heads)
+    bias = alibi_bias_table[:, alibi_bias_table.shape[-1] - post_seq_len :]
+
+    # Broadcast the causal mask out for n_heads and add the bias directly into
+    # the output, without materializing any full size intermediates.
+    mask = np.empty((batch_size, n_heads, seq_len, post_seq_len), dtype=np.float32)
+    np.add(causal_mask[:, np.newaxis], bias[np.newaxis, :, np.newaxis], out=mask)
+    return mask
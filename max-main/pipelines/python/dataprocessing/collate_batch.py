@@ -16,6 +16,7 @@ from __future__ import annotations
 
 import enum
 import math
+from typing import Sequence
 
 import numpy as np
 
@@ -29,8 +30,86 @@ class PaddingDirection(enum.Enum):
     RIGHT = "right"
 
 
+def _padded_length(max_len: int, pad_to_multiple_of: int) -> int:
+    # If max_len is 1, we are presumably in a token generation phase batch.
+    # W scenario, padding from 1 -> 2, does not result in a performance gain.
+    if max_len == 1:
+        return 1
+    return math.ceil(max_len / pad_to_multiple_of) * pad_to_multiple_of
+
+
+def collate_into(
+    out: np.ndarray,
+    batch: Sequence[np.ndarray],
+    direction: PaddingDirection = PaddingDirection.RIGHT,
+    pad_value: int = 0,
+    batch_size: int | None = None,
+    pad_to_multiple_of: int = 1,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Collates a batch of inputs into a reusable preallocated buffer.
+
+    Behaves like `collate_batch`, but writes the padded rows into `out`
+    instead of allocating a new matrix, and never modifies `batch`. The
+    buffer is typically a `(max_batch_size, max_length)` int64 array that is
+    reused across calls.
+
+    Returns:
+        A tuple of:
+            A `(batch_size, padded_length)` view over the start of `out`
+            holding all rows padded to the max sequence length.
+            A list with last token indices prior to any padding.
+
+    Raises:
+        ValueError: if the batch is empty, `out` is not contiguous or `out`
+            is too small to hold the padded batch.
+        NotImplementedError: if the batch contains anything other than vectors.
+    """
+    if not len(batch):
+        msg = "Must provide at least one batch item."
+        raise ValueError(msg)
+
+    if not all(a.ndim == 1 for a in batch):
+        msg = "Collate only supports rank 1 tensors for now."
+        raise NotImplementedError(msg)
+
+    if not out.flags.c_contiguous:
+        msg = "Collate output buffer must be contiguous."
+        raise ValueError(msg)
+
+    lengths = np.fromiter((len(a) for a in batch), dtype=np.int64, count=len(batch))
+    pad_to = _padded_length(int(lengths.max()), pad_to_multiple_of)
+    num_rows = max(len(batch), batch_size or 0)
+
+    if num_rows * pad_to > out.size:
+        msg = (
+            f"Collate output buffer of size {out.size} cannot hold a"
+            f" ({num_rows}, {pad_to}) batch."
+        )
+        raise ValueError(msg)
+
+    # View the start of the buffer as a contiguous (num_rows, pad_to) matrix,
+    # so that the result can be handed to the model without another copy.
+    tokens = out.reshape(-1)[: num_rows * pad_to].reshape(num_rows, pad_to)
+    tokens.fill(pad_value)
+    for row, a in zip(tokens, batch):
+        if direction == PaddingDirection.LEFT:
+            row[pad_to - len(a) :] = a
+        else:
+            row[: len(a)] = a
+
+    # Generate unpadded last token index. Padding rows added to reach
+    # `batch_size` count as full length.
+    if direction == PaddingDirection.LEFT:
+        unpadded_last_token_index = np.full(num_rows, -1)
+    else:
+        unpadded_last_token_index = np.full(num_rows, pad_to - 1)
+        unpadded_last_token_index[: len(batch)] = lengths - 1
+
+    return tokens, unpadded_last_token_index
+
+
 def collate_batch(
-    batch: list[np.ndarray],
+    batch: Sequence[np.ndarray],
     direction: PaddingDirection = PaddingDirection.RIGHT,
     pad_value: int = 0,
     batch_size: int | None = None,
@@ -53,54 +132,39 @@ def collate_batch(
         ValueError: if the batch is empty.
         NotImplementedError: if the batch contains anything other than vectors.
     """
-    if not batch:
+    if not len(batch):
         msg = "Must provide at least one batch item."
         raise ValueError(msg)
 
-    if not all(a.ndim == 1 for a in batch):
-        msg = "Collate only supports rank 1 tensors for now."
-        raise NotImplementedError(msg)
-
-    max_len = max((len(a) for a in batch), default=0)
-
-    # If max_len is 1, we are presumably in a token generation phase batch.
-    # W scenario, padding from 1 -> 2, does not result in a performance gain.
-    if max_len == 1:
-        pad_to = 1
-    else:
-        pad_to = math.ceil(max_len / pad_to_multiple_of) * pad_to_multiple_of
-
-    def pad(a: np.ndarray) -> np.ndarray:
-        npad = pad_to - len(a)
-        if npad == 0:
-            return a
-        padding = (npad, 0) if direction == PaddingDirection.LEFT else (0, npad)
-        return np.pad(a, padding, mode="constant", constant_values=pad_value)
-
-    if batch_size is not None:
-        pad_batch_item = np.array([pad_value] * pad_to)
-        batch.extend([pad_batch_item] * (batch_size - len(batch)))
-
-    # Generate unpadded last token index.
-    unpadded_last_token_index = (
-        np.full(len(batch), -1)
-        if direction == PaddingDirection.LEFT
-        else np.array([len(a) - 1 for a in batch])
+    max_len = max(len(a) for a in batch)
+    num_rows = max(len(batch), batch_size or 0)
+    out = np.empty(
+        (num_rows, _padded_length(max_len, pad_to_multiple_of)),
+        dtype=np.result_type(*{a.dtype for a in batch}),
+    )
+    return collate_into(
+        out,
+        batch,
+        direction=direction,
+        pad_value=pad_value,
+        batch_size=batch_size,
+        pad_to_multiple_of=pad_to_multiple_of,
     )
-
-    return np.stack([pad(a) for a in batch], axis=0), unpadded_last_token_index
 
 
 def batch_padded_tokens_and_mask(
     start_pos: list[int],
     tokens: list[np.ndarray],
     pad_to_multiple_of: int = 1,
+    out: np.ndarray | None = None,
 ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """Batches input tokens and computes a batched attention mask.
 
     Args:
         start_pos: index into the end of the KV cache for each batch item.
         tokens: unpadded input tokens for this batch.
+        out: optional preallocated buffer to collate the tokens into. See
+            `collate_into`.
 
     Returns:
         A (batched tokens, unpadded last token indices, batch attention mask) pair.
@@ -114,7 +178,12 @@ def batch_padded_tokens_and_mask(
 
     # Create batched input token tensor by padding all input token tensors
     # to the maximum sequence length in the batch.
-    next_tokens_batch, unpadded_last_token_index = collate_batch(
-        tokens, batch_size=len(tokens), pad_to_multiple_of=pad_to_multiple_of
-    )
+    if out is None:
+        next_tokens_batch, unpadded_last_token_index = collate_batch(
+            tokens, batch_size=len(tokens), pad_to_multiple_of=pad_to_multiple_of
+        )
+    else:
+        next_tokens_batch, unpadded_last_token_index = collate_into(
+            out, tokens, batch_size=len(tokens), pad_to_multiple_of=pad_to_multiple_of
+        )
     return next_tokens_batch, unpadded_last_token_index, attn_mask
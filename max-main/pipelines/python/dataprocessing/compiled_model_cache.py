@@ -0,0 +1,306 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+"""Persistent cache of compiled models, saved as MEF files."""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import tempfile
+from functools import lru_cache
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence, Union
+
+import huggingface_hub
+
+logger = logging.getLogger(__name__)
+
+# Bump when the cache layout or the fingerprint changes, to invalidate
+# previously cached models.
+_COMPILED_MODEL_CACHE_VERSION = 3
+
+# Set to "0" to disable the compiled model cache, in this process and in the
+# processes it starts.
+_COMPILED_MODEL_CACHE_ENV = "MODULAR_COMPILED_MODEL_CACHE"
+
+# Overrides the size budget of the compiled model cache, in bytes.
+_COMPILED_MODEL_CACHE_MAX_BYTES_ENV = "MODULAR_COMPILED_MODEL_CACHE_MAX_BYTES"
+
+# Default size budget of the compiled model cache, in bytes.
+DEFAULT_COMPILED_MODEL_CACHE_BYTES = 16 * 1024 * 1024 * 1024
+
+# Pipeline config fields that change the compiled graph. `max_length` and
+# `max_cache_batch_size` size the KV cache inputs of the graph. Fields that
+# only affect scheduling or host side batching, such as `max_new_tokens` or
+# `pad_to_multiple_of`, are left out so that changing them does not force a
+# recompile. The device is identified by its `device_spec` value rather than
+# the driver object. Fields that an older or newer `PipelineConfig` does not
+# have are hashed as None.
+_FINGERPRINT_FIELDS = (
+    "architecture",
+    "version",
+    "quantization_encoding",
+    "dtype",
+    "cache_strategy",
+    "max_length",
+    "max_cache_batch_size",
+    "kv_cache_page_size",
+    "enable_echo",
+    "device_spec",
+)
+
+# Source of the layers that every pipeline's graph is built from.
+_NN_SOURCE_DIR = Path(__file__).resolve().parent.parent / "nn"
+
+
+def compiled_model_cache_dir() -> Path:
+    """Returns the directory of the persistent compiled model cache."""
+    cache_folder = os.getenv("XDG_CACHE_PATH", str(Path.home() / ".cache"))
+    return Path(cache_folder) / "modular" / "compiled_models"
+
+
+def compiled_model_cache_enabled() -> bool:
+    return os.getenv(_COMPILED_MODEL_CACHE_ENV, "1") != "0"
+
+
+def set_compiled_model_cache_enabled(enabled: bool) -> None:
+    """Enables or disables the compiled model cache.
+
+    This is stored in the environment so that it also applies to model worker
+    processes.
+    """
+    os.environ[_COMPILED_MODEL_CACHE_ENV] = "1" if enabled else "0"
+
+
+def _max_version() -> Optional[str]:
+    try:
+        return metadata.version("max")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _weight_file_fingerprint(pipeline_config: Any, path: os.PathLike) -> Optional[str]:
+    """Returns a fingerprint of a weight file, or None if it cannot be found.
+
+    Local files are fingerprinted by their path, size and modification time.
+    Files of a HuggingFace repo are fingerprinted by the commit of their
+    locally cached snapshot, without any network access.
+    """
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    repo_id = getattr(pipeline_config, "huggingface_repo_id", None)
+    if repo_id is None:
+        return None
+    cached_path = huggingface_hub.try_to_load_from_cache(repo_id, str(path))
+    if not isinstance(cached_path, str):
+        return None
+    # Cached files live in `snapshots/<commit>/`, so the path identifies the
+    # file's contents.
+    return f"{repo_id}:{cached_path}:{os.path.getsize(cached_path)}"
+
+
+@lru_cache
+def _source_dir_fingerprint(path: str) -> str:
+    """Returns a hash of the Python source files under the directory `path`.
+
+    Sources are only read once per process, since they do not change while
+    it runs.
+    """
+    root = Path(path)
+    digest = hashlib.blake2b(digest_size=16)
+    for source in sorted(root.rglob("*.py")):
+        digest.update(f"{source.relative_to(root).as_posix()};".encode())
+        digest.update(source.read_bytes())
+    return digest.hexdigest()
+
+
+def pipeline_config_fingerprint(
+    pipeline_config: Any,
+    source_dirs: Sequence[Union[str, os.PathLike]] = (),
+    **extra: Any,
+) -> Optional[str]:
+    """Returns a key identifying the model compiled for `pipeline_config`.
+
+    The key hashes the MAX version, the source of the graph building code,
+    the config fields that change the compiled graph, the HuggingFace config
+    and the weight files.
+
+    Args:
+        pipeline_config: Config of the pipeline being compiled.
+        source_dirs: Directories of the Python source that builds the graph,
+            such as the pipeline model's package. The `nn` package is always
+            included.
+        extra: Anything else that changes the compiled graph, such as the name
+            of the pipeline model class.
+
+    Returns:
+        The key, or None if a weight file cannot be fingerprinted.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"v{_COMPILED_MODEL_CACHE_VERSION};max={_max_version()};".encode())
+    for source_dir in (_NN_SOURCE_DIR, *source_dirs):
+        fingerprint = _source_dir_fingerprint(str(Path(source_dir).resolve()))
+        digest.update(f"source={fingerprint};".encode())
+    for name in _FINGERPRINT_FIELDS:
+        value = getattr(pipeline_config, name, None)
+        digest.update(f"{name}={value!r};".encode())
+    for name in sorted(extra):
+        digest.update(f"{name}={extra[name]!r};".encode())
+
+    huggingface_config = getattr(pipeline_config, "huggingface_config", None)
+    if to_json_string := getattr(huggingface_config, "to_json_string", None):
+        digest.update(to_json_string(use_diff=False).encode())
+
+    weight_paths = getattr(pipeline_config, "weight_path", None) or []
+    for path in weight_paths:
+        fingerprint = _weight_file_fingerprint(pipeline_config, path)
+        if fingerprint is None:
+            return None
+        digest.update(f"weights={fingerprint};".encode())
+    return digest.hexdigest()
+
+
+class CompiledModelCache:
+    """Size bounded cache of compiled models, saved as MEF files.
+
+    Entries are keyed by `pipeline_config_fingerprint`. When the total size of
+    the cached files exceeds `max_bytes`, the least recently used files are
+    deleted. Use is tracked with the file modification times, so that the
+    cache can be shared by several processes.
+
+    Args:
+        cache_dir: Directory of the cached files. Defaults to
+            `compiled_model_cache_dir()`.
+        max_bytes: Size budget of the cached files. Defaults to the value of
+            the `MODULAR_COMPILED_MODEL_CACHE_MAX_BYTES` environment variable,
+            or `DEFAULT_COMPILED_MODEL_CACHE_BYTES`.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[os.PathLike] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        if max_bytes is None:
+            max_bytes = int(
+                os.getenv(
+                    _COMPILED_MODEL_CACHE_MAX_BYTES_ENV,
+                    DEFAULT_COMPILED_MODEL_CACHE_BYTES,
+                )
+            )
+        if max_bytes < 0:
+            msg = f"max_bytes must be non-negative, got {max_bytes}"
+            raise ValueError(msg)
+
+        self.cache_dir = Path(cache_dir or compiled_model_cache_dir())
+        self.max_bytes = max_bytes
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.mef"
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """Returns the cached model for `key`, or None if it is not cached."""
+        path = self.path(key)
+        try:
+            # Mark the entry as recently used.
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def remove(self, key: str) -> None:
+        """Removes the cached model for `key`, for example if it is corrupt."""
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def store(self, key: str, export: Callable[[str], Any]) -> Optional[Path]:
+        """Caches a model, then evicts entries to fit the size budget.
+
+        Args:
+            key: Cache key, from `pipeline_config_fingerprint`.
+            export: Writes the model to the given path, such as
+                `Model._export_mef`.
+
+        Returns:
+            The path of the cached model, or None if it could not be cached.
+        """
+        path = self.path(key)
+        # Export to a temporary file first, so that concurrent processes never
+        # load a partially written model.
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=self.cache_dir, prefix=".tmp-", suffix=".mef"
+            )
+            os.close(fd)
+        except OSError as e:
+            logger.warning("Unable to cache compiled model in %s: %s", path, e)
+            return None
+
+        try:
+            export(tmp_path)
+            if os.path.getsize(tmp_path) > self.max_bytes:
+                os.remove(tmp_path)
+                return None
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning("Unable to cache compiled model in %s: %s", path, e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: Optional[Path] = None) -> int:
+        """Deletes the least recently used files until the cache fits its budget.
+
+        Args:
+            keep: A file that is never deleted, such as the one just cached.
+
+        Returns:
+            The number of deleted files.
+        """
+        entries = []
+        for path in self.cache_dir.glob("*.mef"):
+            if path.name.startswith("."):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                # Deleted by another process.
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        return evicted
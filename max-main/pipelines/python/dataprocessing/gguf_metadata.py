@@ -0,0 +1,203 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+"""Fast reader for the key-value metadata section of a GGUF file."""
+
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import struct
+from typing import Any, List, Optional, Union
+
+import numpy as np
+
+_GGUF_MAGIC = b"GGUF"
+
+# GGUF value types, from
+# https://github.com/ggerganov/ggml/blob/master/docs/gguf.md
+_UINT8, _INT8, _UINT16, _INT16, _UINT32, _INT32, _FLOAT32, _BOOL = range(8)
+_STRING, _ARRAY, _UINT64, _INT64, _FLOAT64 = range(8, 13)
+
+_SCALAR_DTYPES = {
+    _UINT8: np.dtype("<u1"),
+    _INT8: np.dtype("<i1"),
+    _UINT16: np.dtype("<u2"),
+    _INT16: np.dtype("<i2"),
+    _UINT32: np.dtype("<u4"),
+    _INT32: np.dtype("<i4"),
+    _FLOAT32: np.dtype("<f4"),
+    _BOOL: np.dtype("?"),
+    _UINT64: np.dtype("<u8"),
+    _INT64: np.dtype("<i8"),
+    _FLOAT64: np.dtype("<f8"),
+}
+
+_SCALAR_STRUCTS = {
+    _UINT8: struct.Struct("<B"),
+    _INT8: struct.Struct("<b"),
+    _UINT16: struct.Struct("<H"),
+    _INT16: struct.Struct("<h"),
+    _UINT32: struct.Struct("<I"),
+    _INT32: struct.Struct("<i"),
+    _FLOAT32: struct.Struct("<f"),
+    _BOOL: struct.Struct("<?"),
+    _UINT64: struct.Struct("<Q"),
+    _INT64: struct.Struct("<q"),
+    _FLOAT64: struct.Struct("<d"),
+}
+
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+
+
+class _StringArray:
+    """A GGUF string array, decoded on first access."""
+
+    def __init__(self, buffer: memoryview, offsets: np.ndarray):
+        self._buffer = buffer
+        # Start offset of each string's bytes, followed by the end offset of
+        # the last string. Each string is preceded by its 8 byte length.
+        self._offsets = offsets
+        self._strings: Optional[List[str]] = None
+
+    def decode(self) -> List[str]:
+        if self._strings is None and len(self._offsets) == 1:
+            self._strings = []
+        if self._strings is None:
+            starts = self._offsets[:-1].tolist()
+            ends = (self._offsets[1:] - _U64.size).tolist()
+            ends[-1] = int(self._offsets[-1])
+            # Copy the whole array once, then slice and decode the bytes
+            # object, which is much cheaper than per-string numpy arrays.
+            base = starts[0]
+            data = self._buffer[base : ends[-1]].tobytes()
+            self._strings = [
+                data[start - base : end - base].decode()
+                for start, end in zip(starts, ends)
+            ]
+        return self._strings
+
+
+class GGUFMetadata:
+    """Reads the key-value metadata of a GGUF file.
+
+    Unlike `gguf.GGUFReader`, this does not parse the tensor infos or build a
+    numpy array per value. The file is memory mapped, so only the pages of
+    the metadata section are read from disk. Numeric arrays are read with a
+    single copy, and string arrays are decoded in bulk on first access.
+
+    Raises:
+        ValueError: If the file is not a little-endian GGUF v2 or v3 file.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = os.fspath(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+        self._fields: dict[str, Any] = {}
+
+        if self._buffer[:4] != _GGUF_MAGIC:
+            msg = f"{self.path} is not a GGUF file"
+            raise ValueError(msg)
+        (version,) = _U32.unpack_from(self._buffer, 4)
+        if version not in (2, 3):
+            msg = f"unsupported GGUF version {version} in {self.path}"
+            raise ValueError(msg)
+
+        (kv_count,) = _U64.unpack_from(self._buffer, 16)
+        offset = 24
+        for _ in range(kv_count):
+            key, offset = self._read_string(offset)
+            (value_type,) = _U32.unpack_from(self._buffer, offset)
+            self._fields[key], offset = self._read_value(value_type, offset + 4)
+        self.kv_end = offset
+
+    def _read_string(self, offset: int) -> tuple[str, int]:
+        (length,) = _U64.unpack_from(self._buffer, offset)
+        start = offset + _U64.size
+        return self._buffer[start : start + length].tobytes().decode(), start + length
+
+    def _read_value(self, value_type: int, offset: int) -> tuple[Any, int]:
+        if value_type == _STRING:
+            return self._read_string(offset)
+        if value_type != _ARRAY:
+            scalar = _SCALAR_STRUCTS[value_type]
+            (value,) = scalar.unpack_from(self._buffer, offset)
+            return value, offset + scalar.size
+
+        (item_type,) = _U32.unpack_from(self._buffer, offset)
+        (count,) = _U64.unpack_from(self._buffer, offset + 4)
+        offset += 12
+        if item_type == _STRING:
+            # String lengths have to be walked to find where each one starts.
+            starts = []
+            unpack_from = _U64.unpack_from
+            buffer = self._buffer
+            for _ in range(count):
+                (length,) = unpack_from(buffer, offset)
+                offset += _U64.size
+                starts.append(offset)
+                offset += length
+            starts.append(offset)
+            offsets = np.array(starts, dtype=np.int64)
+            return _StringArray(self._buffer, offsets), offset
+        if item_type in _SCALAR_DTYPES:
+            dtype = _SCALAR_DTYPES[item_type]
+            # Copy out of the mapping so that the file can be closed.
+            array = np.frombuffer(self._buffer, dtype, count=count, offset=offset)
+            return array.copy(), offset + dtype.itemsize * count
+
+        # Nested arrays are not used by tokenizer metadata, but still have to
+        # be skipped over.
+        values = []
+        for _ in range(count):
+            value, offset = self._read_value(item_type, offset)
+            values.append(value)
+        return values, offset
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the value of `key`, or None if it is not present.
+
+        Strings and numbers are returned as Python values, string arrays as a
+        list of `str` and numeric arrays as a numpy array.
+        """
+        value = self._fields.get(key)
+        if isinstance(value, _StringArray):
+            return value.decode()
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._fields
+
+    def digest(self) -> str:
+        """Returns a hash of the file's header and key-value metadata.
+
+        This identifies everything that is derived from the metadata, such as
+        the tokenizer, without reading the (much larger) tensor data.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self._buffer[: self.kv_end])
+        return digest.hexdigest()
+
+    def close(self) -> None:
+        self._fields.clear()
+        self._buffer.release()
+        self._mmap.close()
+
+    def __enter__(self) -> GGUFMetadata:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
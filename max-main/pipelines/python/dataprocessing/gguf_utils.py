@@ -18,12 +18,16 @@ from typing import Any, List, Optional
 import numpy as np
 from gguf import GGUFValueType
 
+from .gguf_metadata import GGUFMetadata
+
 
 def _to_string(arr: np.ndarray) -> str:
     return arr.tobytes().decode()
 
 
 def read_string(reader, key) -> Optional[str]:
+    if isinstance(reader, GGUFMetadata):
+        return reader.get(key)
     field = reader.get_field(key)
     if field is None:
         return None
@@ -32,6 +36,8 @@ def read_string(reader, key) -> Optional[str]:
 
 
 def read_string_array(reader, key) -> Optional[List[str]]:
+    if isinstance(reader, GGUFMetadata):
+        return reader.get(key)
     field = reader.get_field(key)
     if field is None:
         return None
@@ -41,6 +47,8 @@ def read_string_array(reader, key) -> Optional[List[str]]:
 
 
 def read_number(reader, key) -> Optional[Any]:
+    if isinstance(reader, GGUFMetadata):
+        return reader.get(key)
     field = reader.get_field(key)
     if field is None:
         return None
@@ -48,6 +56,9 @@ def read_number(reader, key) -> Optional[Any]:
 
 
 def read_array(reader, key) -> Optional[List[Any]]:
+    if isinstance(reader, GGUFMetadata):
+        array = reader.get(key)
+        return None if array is None else array.tolist()
     field = reader.get_field(key)
     if field is None:
         return None
@@ -0,0 +1,65 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+"""Attention masks for naive-cache token generation steps."""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+class IncrementalCausalAttentionMask:
+    """Grows token generation attention masks one column at a time.
+
+    During token generation every batch item encodes a single token at the
+    end of the shared context, so that token may attend to every column and
+    the `(batch_size, 1, post_seq_len)` mask is entirely zero. Each step's
+    mask differs from the previous one only by the appended column.
+
+    Rather than rebuilding the mask from scratch each step, the masks are
+    served as contiguous views into a zero-filled arena. Appending a column
+    only advances the view, and the arena is reallocated (doubling its
+    capacity) when a step no longer fits, so the per-step cost is amortized
+    over the whole generation instead of proportional to
+    `batch_size * post_seq_len`.
+
+    The returned masks share memory with the arena and must not be modified.
+    They are writable nonetheless, since `Model.execute` exports its inputs
+    with DLPack, which rejects read-only arrays.
+    """
+
+    def __init__(self, max_batch_size: int = 1, max_seq_len: int = 0) -> None:
+        self._arena = np.zeros(0, dtype=np.float32)
+        self._reserve(max_batch_size * max_seq_len)
+
+    def _reserve(self, size: int) -> None:
+        if size <= self._arena.size:
+            return
+        # Token generation grows the mask by one column per step, so double
+        # the capacity to keep reallocations logarithmic in the step count.
+        self._arena = np.zeros(
+            max(size, 2 * self._arena.size), dtype=np.float32
+        )
+
+    def mask(self, batch_size: int, post_seq_len: int) -> np.ndarray:
+        """Returns the `(batch_size, 1, post_seq_len)` token generation mask."""
+        size = batch_size * post_seq_len
+        self._reserve(size)
+        return self._arena[:size].reshape(batch_size, 1, post_seq_len)
+
+    def append(self, prev_mask: np.ndarray) -> np.ndarray:
+        """Returns the mask for the step following `prev_mask`.
+
+        `prev_mask` may be the `(batch_size, seq_len, post_seq_len)` mask of
+        the context encoding step or a previous token generation mask.
+        """
+        return self.mask(prev_mask.shape[0], prev_mask.shape[-1] + 1)
@@ -0,0 +1,157 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+"""Per-phase timing and throughput of loading a model."""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Iterator, Mapping, Optional, Union
+
+
+@dataclass
+class LoadPhase:
+    """Accumulated wall time and bytes of one load phase."""
+
+    name: str
+    seconds: float = 0.0
+    nbytes: int = 0
+    count: int = 0
+
+    @property
+    def mb_per_s(self) -> Optional[float]:
+        """Throughput of the phase in MB/s, or None if it read no bytes."""
+        if not self.nbytes or self.seconds <= 0:
+            return None
+        return self.nbytes / self.seconds / 1e6
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "seconds": self.seconds,
+            "bytes": self.nbytes,
+            "mb_per_s": self.mb_per_s,
+            "count": self.count,
+        }
+
+
+class LoadProfile:
+    """Records the wall time, bytes read and throughput of each load phase.
+
+    The pipeline models record the phases `weight_read`, `weight_read_wait`,
+    `name_mapping`, `graph_build`, `compile`, `mef_export` and `mef_import`.
+    `weight_read` times opening the weights, and `weight_read_wait` the wait
+    for each tensor that is read lazily while the graph is built, with the
+    bytes of the tensors. The bytes of `mef_import` are the serialized model
+    and the weights it references, and those of `mef_export` are the size of
+    the serialized model.
+
+    A phase can be recorded several times (for example once for the vision
+    encoder and once for the language model), in which case its times and
+    bytes add up. Phases may nest: `weight_read_wait` overlaps
+    `graph_build`.
+
+    Recording is thread safe.
+    """
+
+    def __init__(self):
+        self._phases: OrderedDict[str, LoadPhase] = OrderedDict()
+        self._lock = threading.Lock()
+        self._start_time = time.perf_counter()
+
+    def _phase(self, name: str) -> LoadPhase:
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = LoadPhase(name)
+        return phase
+
+    def record(self, name: str, seconds: float, nbytes: int = 0) -> None:
+        """Adds `seconds` of wall time and `nbytes` read to the phase `name`."""
+        with self._lock:
+            phase = self._phase(name)
+            phase.seconds += seconds
+            phase.nbytes += nbytes
+            phase.count += 1
+
+    def add_bytes(self, name: str, nbytes: int) -> None:
+        """Adds `nbytes` read to the phase `name`, without timing it."""
+        with self._lock:
+            self._phase(name).nbytes += nbytes
+
+    @contextmanager
+    def phase(self, name: str, nbytes: int = 0) -> Iterator[None]:
+        """Times the body of the `with` statement as the phase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, nbytes)
+
+    def __getitem__(self, name: str) -> LoadPhase:
+        return self._phases[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._phases
+
+    def phases(self) -> list[LoadPhase]:
+        """Returns the recorded phases, in the order they first ran."""
+        with self._lock:
+            return list(self._phases.values())
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "phases": {phase.name: phase.to_dict() for phase in self.phases()},
+            "elapsed_seconds": time.perf_counter() - self._start_time,
+        }
+
+    def to_json(self, **kwargs) -> str:
+        """Returns the profile as a JSON object. Accepts `json.dumps` options."""
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+_current_load_profile: Optional[LoadProfile] = None
+
+
+def load_profile() -> LoadProfile:
+    """Returns the profile that model loading is currently recorded into."""
+    global _current_load_profile
+    if _current_load_profile is None:
+        _current_load_profile = LoadProfile()
+    return _current_load_profile
+
+
+def reset_load_profile() -> LoadProfile:
+    """Starts a new profile for the next model load, and returns it."""
+    global _current_load_profile
+    _current_load_profile = LoadProfile()
+    return _current_load_profile
+
+
+def weights_registry_nbytes(weights_registry: Mapping[str, Any]) -> int:
+    """Returns the total size of the arrays in a weights registry, in bytes.
+
+    Values without an `nbytes` attribute are not counted.
+    """
+    return sum(getattr(value, "nbytes", 0) for value in weights_registry.values())
+
+
+def file_nbytes(path: Union[str, os.PathLike]) -> int:
+    """Returns the size of the file at `path`, or 0 if it does not exist."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
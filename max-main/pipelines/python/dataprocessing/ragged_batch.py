@@ -0,0 +1,84 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+"""Ragged batch construction for continuous batching models."""
+
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+from max.driver import Device, Tensor
+
+
+class RaggedBatchBuilder:
+    """Packs variable length token sequences into a ragged batch.
+
+    A ragged batch is a flat `(total_seq_len,)` int64 token vector, plus
+    `(batch_size + 1,)` uint32 row offsets holding the start and end position
+    of each sequence in the token vector.
+
+    Tokens and row offsets are written into host staging buffers sized for
+    `max_batch_size` sequences of `max_length` tokens, which are reused across
+    batches instead of allocating fresh arrays for every batch, and then
+    transferred to the device.
+
+    Args:
+        max_batch_size: Maximum number of sequences in a batch.
+        max_length: Maximum number of tokens in a sequence.
+        device: Device to transfer the ragged batch to.
+    """
+
+    def __init__(self, max_batch_size: int, max_length: int, device: Device) -> None:
+        self.device = device
+        self._row_offsets = np.zeros(max_batch_size + 1, dtype=np.uint32)
+        self._tokens = np.empty(max_batch_size * max_length, dtype=np.int64)
+
+    def __call__(self, tokens: Sequence[np.ndarray]) -> tuple[Tensor, Tensor]:
+        """Builds a ragged batch from a batch of token sequences.
+
+        The staging buffers are reused by the next call, so the returned
+        tensors should be consumed before building another batch.
+
+        Returns:
+            A (ragged tokens, input row offsets) pair, resident on the device.
+
+        Raises:
+            ValueError: if the batch has more sequences than `max_batch_size`.
+        """
+        batch_size = len(tokens)
+        if batch_size + 1 > self._row_offsets.size:
+            msg = (
+                f"Ragged batch of {batch_size} sequences exceeds the maximum"
+                f" batch size of {self._row_offsets.size - 1}."
+            )
+            raise ValueError(msg)
+
+        # Get input_row_offsets: start and end position of each batch in the
+        # combined total_seq_len dimension.
+        row_offsets = self._row_offsets[: batch_size + 1]
+        np.cumsum(
+            np.fromiter((len(t) for t in tokens), dtype=np.uint32, count=batch_size),
+            out=row_offsets[1:],
+        )
+        total_seq_len = int(row_offsets[-1])
+
+        # Create a ragged token vector of length: sum(len(t) for t in tokens).
+        if total_seq_len > self._tokens.size:
+            self._tokens = np.empty(total_seq_len, dtype=np.int64)
+        ragged_tokens = self._tokens[:total_seq_len]
+        np.concatenate(tokens, out=ragged_tokens)
+
+        return (
+            Tensor.from_numpy(ragged_tokens).to(self.device),
+            Tensor.from_numpy(row_offsets).to(self.device),
+        )
@@ -13,25 +13,221 @@
 
 """Utilities for creating a HuggingFace tokenizer for a pipeline model."""
 
+import hashlib
+import logging
 import os
+import shutil
+import tempfile
+from pathlib import Path
 from typing import Any, Optional, Union
 
 import gguf
+import huggingface_hub
 from gguf import GGUFReader, Keys
+from max.pipelines import TextTokenizer
 from tokenizers import Regex, Tokenizer, decoders, pre_tokenizers, processors
 from tokenizers.models import BPE
 from transformers import PreTrainedTokenizerFast
 
 from . import gguf_utils
+from .gguf_metadata import GGUFMetadata
+
+logger = logging.getLogger(__name__)
+
+# Bump when the cached tokenizers change, to invalidate previously cached
+# tokenizers.
+_TOKENIZER_CACHE_VERSION = 1
+
+# Set to "0" to disable the tokenizer cache, in this process and in the
+# processes it starts.
+_TOKENIZER_CACHE_ENV = "MODULAR_TOKENIZER_CACHE"
+
+# Files that define a HuggingFace tokenizer, used to fingerprint local
+# tokenizer directories.
+_TOKENIZER_FILES = (
+    "tokenizer.json",
+    "tokenizer_config.json",
+    "special_tokens_map.json",
+    "added_tokens.json",
+    "vocab.json",
+    "merges.txt",
+    "tokenizer.model",
+)
+
+
+def tokenizer_cache_dir() -> Path:
+    """Returns the directory of the persistent tokenizer cache."""
+    cache_folder = os.getenv("XDG_CACHE_PATH", str(Path.home() / ".cache"))
+    return Path(cache_folder) / "modular" / "tokenizers"
+
+
+def tokenizer_cache_enabled() -> bool:
+    return os.getenv(_TOKENIZER_CACHE_ENV, "1") != "0"
+
+
+def set_tokenizer_cache_enabled(enabled: bool) -> None:
+    """Enables or disables the tokenizer cache.
+
+    This is stored in the environment so that it also applies to model worker
+    processes.
+    """
+    os.environ[_TOKENIZER_CACHE_ENV] = "1" if enabled else "0"
+
+
+def _pretrained_fingerprint(
+    model_path: str, revision: Optional[str] = None
+) -> Optional[str]:
+    """Returns a fingerprint of a HuggingFace tokenizer's source.
+
+    Local directories are fingerprinted by the contents of their tokenizer
+    files. Hub repos are fingerprinted by the commit of their locally cached
+    snapshot, without any network access. Returns None if the repo has not
+    been downloaded yet.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if os.path.isdir(model_path):
+        for name in _TOKENIZER_FILES:
+            path = os.path.join(model_path, name)
+            if os.path.isfile(path):
+                digest.update(name.encode())
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+        return digest.hexdigest()
+
+    cached_config = huggingface_hub.try_to_load_from_cache(
+        model_path, "tokenizer_config.json", revision=revision
+    )
+    if not isinstance(cached_config, str):
+        return None
+
+    # Cached files live in `snapshots/<commit>/`.
+    commit = Path(cached_config).parent.name
+    digest.update(f"{model_path}@{commit}".encode())
+    return digest.hexdigest()
+
+
+def _pretrained_cache_path(
+    model_path: str,
+    revision: Optional[str] = None,
+    cache_dir: Optional[os.PathLike] = None,
+) -> Optional[Path]:
+    """Returns where a HuggingFace tokenizer is saved in the tokenizer cache.
+
+    Returns:
+        The path of the cached tokenizer, which may not exist yet, or None if
+        it cannot be cached: the cache is disabled, or the tokenizer source
+        cannot be fingerprinted.
+    """
+    if not tokenizer_cache_enabled():
+        return None
+
+    fingerprint = _pretrained_fingerprint(model_path, revision)
+    if fingerprint is None:
+        return None
+
+    return Path(cache_dir or tokenizer_cache_dir()) / (
+        f"hf-tokenizer-v{_TOKENIZER_CACHE_VERSION}-{fingerprint}"
+    )
+
+
+class CachedTextTokenizer(TextTokenizer):
+    """A `TextTokenizer` that loads from, and saves to, the tokenizer cache.
+
+    When the tokenizer of `model_path` was cached before, it is loaded from
+    the saved local copy, which skips resolving the files on the hub and
+    converting slow tokenizers. Otherwise it is loaded from `model_path` and
+    then saved to the cache. Tokenizers that need remote code, or that are
+    not fast tokenizers, are never cached.
+
+    Takes the same arguments as `TextTokenizer`.
+    """
+
+    def __init__(self, model_path: str, *args, **kwargs):
+        cache_path = None
+        if not kwargs.get("trust_remote_code", False):
+            cache_path = _pretrained_cache_path(
+                model_path, revision=kwargs.get("revision")
+            )
+
+        if cache_path is not None and cache_path.is_dir():
+            super().__init__(str(cache_path), *args, **kwargs)
+        else:
+            super().__init__(model_path, *args, **kwargs)
+            if cache_path is not None and isinstance(
+                self.delegate, PreTrainedTokenizerFast
+            ):
+                _save_tokenizer(self.delegate, cache_path)
+
+        # Report the requested model path, not the cache location.
+        self.model_path = model_path
 
 
 def tokenizer_from_gguf(
     gguf_or_path: Union[GGUFReader, os.PathLike],
+    cache_dir: Optional[os.PathLike] = None,
 ) -> Tokenizer:
-    reader = gguf_or_path
-    if not isinstance(gguf_or_path, GGUFReader):
-        reader = GGUFReader(gguf_or_path)
+    """Builds a HuggingFace tokenizer from the metadata of a GGUF file.
+
+    Args:
+        gguf_or_path: A GGUF reader, or the path of a GGUF file. Paths are
+            read with `GGUFMetadata`, which only reads the metadata section.
+        cache_dir: Directory in which built tokenizers are saved, keyed by a
+            hash of the GGUF metadata, and loaded from instead of being
+            rebuilt. Defaults to `tokenizer_cache_dir()`, unless the cache is
+            disabled.
+    """
+    if isinstance(gguf_or_path, GGUFReader):
+        return _build_tokenizer(gguf_or_path)
+
+    try:
+        metadata = GGUFMetadata(gguf_or_path)
+    except ValueError:
+        # Fall back to the full reader for older GGUF versions.
+        return _build_tokenizer(GGUFReader(gguf_or_path))
+
+    with metadata:
+        if cache_dir is None:
+            if not tokenizer_cache_enabled():
+                return _build_tokenizer(metadata)
+            cache_dir = tokenizer_cache_dir()
+
+        cache_path = (
+            Path(cache_dir)
+            / f"gguf-tokenizer-v{_TOKENIZER_CACHE_VERSION}-{metadata.digest()}"
+        )
+        if cache_path.is_dir():
+            return PreTrainedTokenizerFast.from_pretrained(cache_path)
+
+        tokenizer = _build_tokenizer(metadata)
+
+    _save_tokenizer(tokenizer, cache_path)
+    return tokenizer
+
+
+def _save_tokenizer(tokenizer: PreTrainedTokenizerFast, cache_path: Path) -> bool:
+    """Saves `tokenizer` to `cache_path`, returning whether it is cached."""
+    # Save to a temporary directory first, so that concurrent processes never
+    # load a partially written tokenizer.
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=cache_path.parent, prefix=".tmp-")
+    except OSError as e:
+        logger.warning("Unable to cache tokenizer in %s: %s", cache_path.parent, e)
+        return False
+
+    try:
+        tokenizer.save_pretrained(tmp_dir)
+        os.rename(tmp_dir, cache_path)
+    except OSError:
+        # Either another process cached the same tokenizer first, or the
+        # cache is not writable. Either way the built tokenizer is usable.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return cache_path.is_dir()
+
 
+def _build_tokenizer(
+    reader: Union[GGUFReader, GGUFMetadata],
+) -> PreTrainedTokenizerFast:
     architecture = gguf_utils.read_string(reader, gguf.KEY_GENERAL_ARCHITECTURE)
     if architecture != "llama":
         raise NotImplementedError(f"Unsupported GGUF architecture: {architecture}")
@@ -11,12 +11,12 @@
 # limitations under the License.
 # ===----------------------------------------------------------------------=== #
 
+from dataprocessing.tokenizer import CachedTextTokenizer
 from max.pipelines import (
     HuggingFaceFile,
     SupportedArchitecture,
     SupportedEncoding,
     SupportedVersion,
-    TextTokenizer,
     WeightsFormat,
 )
 from max.pipelines.kv_cache import KVCacheStrategy
@@ -119,7 +119,7 @@ llama_arch = SupportedArchitecture(
     ],
     default_version="3.1",
     pipeline_model=Llama3Model,
-    tokenizer=TextTokenizer,
+    tokenizer=CachedTextTokenizer,
     default_weights_format=WeightsFormat.gguf,
     weight_converters={WeightsFormat.safetensors: LlamaSafetensorWeights},
 )
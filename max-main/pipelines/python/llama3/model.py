@@ -14,11 +14,24 @@
 from __future__ import annotations
 
 import logging
+import math
+import os
 import warnings
-from typing import Sequence
+from typing import Sequence, Union
 
 import numpy as np
-from dataprocessing import batch_padded_tokens_and_mask
+from dataprocessing import (
+    CompiledModelCache,
+    IncrementalCausalAttentionMask,
+    RaggedBatchBuilder,
+    batch_padded_tokens_and_mask,
+    collate_into,
+    compiled_model_cache_enabled,
+    file_nbytes,
+    load_profile,
+    pipeline_config_fingerprint,
+    weights_registry_nbytes,
+)
 from max.driver import CPU, Tensor
 from max.dtype import DType
 from max.engine import InferenceSession, Model
@@ -38,9 +51,10 @@ from max.pipelines.kv_cache import (
     estimate_kv_cache_size,
     load_kv_manager,
 )
-from nn.compute_log_probabilities import compute_log_probabilities
+from nn.compute_log_probabilities import LazyLogits, compute_log_probabilities
 
 from .gguf import transformer
+from .safetensor_converter import LlamaSafetensorWeights
 
 
 class Llama3Model(PipelineModel):
@@ -63,20 +77,7 @@ class Llama3Model(PipelineModel):
     def _prepare_continuous_initial_token_inputs(
         self, context_batch: Sequence[TextContext]
     ) -> tuple[Tensor, ...]:
-        # Get input_row_offset: start and end position of each batch in the
-        # combined total_seq_len dimension.
-        input_row_offset = np.cumsum(
-            [0] + [ctx.seq_len for ctx in context_batch],
-            dtype=np.uint32,
-        )
-
-        # Create a ragged token vector of length: sum(len(t) for t in tokens).
-        tokens = np.concatenate([ctx.next_tokens for ctx in context_batch])
-
-        return (
-            Tensor.from_numpy(tokens).to(self.pipeline_config.device),
-            Tensor.from_numpy(input_row_offset).to(self.pipeline_config.device),
-        )
+        return self._ragged_batch_builder([ctx.next_tokens for ctx in context_batch])
 
     def _prepare_naive_initial_token_inputs(
         self, context_batch: Sequence[TextContext]
@@ -91,6 +92,7 @@ class Llama3Model(PipelineModel):
             start_pos=start_pos,
             tokens=tokens,
             pad_to_multiple_of=self.pipeline_config.pad_to_multiple_of,
+            out=self._naive_tokens_buffer,
         )
 
         return (next_tokens_batch, attn_mask)
@@ -123,12 +125,15 @@ class Llama3Model(PipelineModel):
     ):
         prev_tokens, prev_attn_mask = prev_model_inputs
         batch_size = prev_tokens.shape[0]
-        start_pos = [prev_attn_mask.shape[-1]] * batch_size
-        next_tokens_batch, _, attn_mask = batch_padded_tokens_and_mask(
-            start_pos=start_pos,
-            tokens=next_tokens,
+        next_tokens_batch, _ = collate_into(
+            self._naive_tokens_buffer,
+            next_tokens,  # type: ignore
+            batch_size=batch_size,
             pad_to_multiple_of=self.pipeline_config.pad_to_multiple_of,
         )
+        # Each step only appends a column to the previous mask, so extend it
+        # in place rather than rebuilding the whole mask.
+        attn_mask = self._naive_next_token_mask.append(prev_attn_mask)
         next_token_inputs = (next_tokens_batch, attn_mask)
 
         return next_token_inputs
@@ -192,30 +197,103 @@ class Llama3Model(PipelineModel):
             np.arange(self.pipeline_config.max_cache_batch_size + 1, dtype=np.uint32)
         ).to(self.pipeline_config.device)
 
-        # Read in weights.
-        self._weights = self.pipeline_config.load_weights()
-
-        if serialized_path := self.pipeline_config.serialized_model_path:
-            # Hydrate all weights to be referenced by the serialized path.
-            weights_registry = {}
-            for name, tensor in self._weights._tensors.items():
-                weights_registry[name] = tensor.data
+        # Reuse host staging buffers to build the ragged context encoding batch.
+        self._ragged_batch_builder = RaggedBatchBuilder(
+            max_batch_size=self.pipeline_config.max_cache_batch_size,
+            max_length=self.pipeline_config.max_length,
+            device=self.pipeline_config.device,
+        )
 
-            logging.info("Loading serialized model from %s", serialized_path)
+        # Reuse token generation attention masks across naive cache steps.
+        self._naive_next_token_mask = IncrementalCausalAttentionMask()
+
+        # Pre-allocate a buffer to collate padded naive cache token batches
+        # into, rather than allocating a new batch matrix with each step.
+        pad_to_multiple_of = self.pipeline_config.pad_to_multiple_of
+        self._naive_tokens_buffer = np.empty(
+            (
+                self.pipeline_config.max_cache_batch_size,
+                math.ceil(self.pipeline_config.max_length / pad_to_multiple_of)
+                * pad_to_multiple_of,
+            ),
+            dtype=np.int64,
+        )
 
-            return session.load(serialized_path, weights_registry=weights_registry)
+        profile = load_profile()
 
-        else:
-            logging.info("Building model...")
-            graph = self._build_graph(self._weights)
-            logging.info("Compiling...")
-            model = session.load(
-                graph, weights_registry=self._weights.allocated_weights
+        # Read in weights.
+        with profile.phase("weight_read"):
+            self._weights = self.pipeline_config.load_weights()
+
+        try:
+            return self._load_model_from_weights(session)
+        finally:
+            # Safetensors shards are read ahead of use. Once the model is
+            # loaded, whichever way, nothing takes the remaining tensors.
+            if isinstance(self._weights, LlamaSafetensorWeights):
+                self._weights.stop_prefetch()
+
+    def _load_model_from_weights(self, session: InferenceSession) -> Model:
+        profile = load_profile()
+        if serialized_path := self.pipeline_config.serialized_model_path:
+            logging.info("Loading serialized model from %s", serialized_path)
+            return self._load_serialized_model(session, serialized_path)
+
+        # Only models with GGUF weights are cached, since the serialized model
+        # references the weights by their names in the GGUF file.
+        cache = CompiledModelCache()
+        cache_key = None
+        if compiled_model_cache_enabled() and isinstance(self._weights, GGUFWeights):
+            cache_key = pipeline_config_fingerprint(
+                self.pipeline_config,
+                source_dirs=[os.path.dirname(__file__)],
+                model=type(self).__name__,
             )
-            if export_path := self.pipeline_config.save_to_serialized_model_path:
-                logging.info("Exporting serialized model to %s", export_path)
+        if cache_key is not None and (cached_path := cache.lookup(cache_key)):
+            logging.info("Loading cached compiled model from %s", cached_path)
+            try:
+                return self._load_serialized_model(session, cached_path)
+            except Exception as e:
+                logging.warning("Recompiling, unable to load cached model: %s", e)
+                cache.remove(cache_key)
+
+        logging.info("Building model...")
+        with profile.phase("graph_build"):
+            graph = self._build_graph(self._weights)
+        if isinstance(self._weights, LlamaSafetensorWeights):
+            # Every weight has been read once the graph is built.
+            self._weights.stop_prefetch()
+        logging.info("Compiling...")
+        weights_registry = self._weights.allocated_weights
+        with profile.phase("compile"):
+            model = session.load(graph, weights_registry=weights_registry)
+        if export_path := self.pipeline_config.save_to_serialized_model_path:
+            logging.info("Exporting serialized model to %s", export_path)
+            with profile.phase("mef_export"):
                 model._export_mef(export_path)
-            return model
+            profile.add_bytes("mef_export", file_nbytes(export_path))
+        if cache_key is not None:
+            with profile.phase("mef_export"):
+                cached_path = cache.store(cache_key, model._export_mef)
+            if cached_path is not None:
+                logging.info("Cached compiled model in %s", cached_path)
+                profile.add_bytes("mef_export", file_nbytes(cached_path))
+        return model
+
+    def _load_serialized_model(
+        self, session: InferenceSession, serialized_path: Union[str, os.PathLike]
+    ) -> Model:
+        # Hydrate all weights to be referenced by the serialized path.
+        weights_registry = {}
+        for name, tensor in self._weights._tensors.items():
+            weights_registry[name] = tensor.data
+
+        with load_profile().phase(
+            "mef_import",
+            nbytes=file_nbytes(serialized_path)
+            + weights_registry_nbytes(weights_registry),
+        ):
+            return session.load(serialized_path, weights_registry=weights_registry)
 
     def _build_opaque_graph(self, weights: GGUFWeights) -> Graph:
         tokens_type = TensorType(DType.int64, shape=["total_seq_len"])
@@ -311,7 +389,9 @@ class Llama3Model(PipelineModel):
                     not self.pipeline_config.enable_echo
                 ), "Echo was enabled but logits were not returned."
                 return None
-            logits = model_outputs.logits.to(CPU()).to_numpy()
+            # Leave the full logits on the device, they are copied to the host
+            # in blocks of rows while computing the log probabilities.
+            logits = model_outputs.logits
         next_token_logits = model_outputs.next_token_logits.to(CPU()).to_numpy()
 
         sampled_tokens = next_tokens.to(CPU()).to_numpy()
@@ -323,11 +403,15 @@ class Llama3Model(PipelineModel):
 
             def _get_logits_and_samples(
                 batch_index: int, echo: bool
-            ) -> tuple[np.ndarray, np.ndarray]:
+            ) -> tuple[np.ndarray | LazyLogits, np.ndarray]:
                 if echo:
                     start_offset = input_row_offsets[batch_index]
                     end_offset = input_row_offsets[batch_index + 1]
-                    batch_logits = logits[start_offset:end_offset]
+                    batch_logits = LazyLogits(
+                        logits,
+                        num_rows=int(end_offset - start_offset),
+                        row_offset=int(start_offset),
+                    )
                     samples = np.concatenate(
                         (
                             tokens[start_offset + 1 : end_offset],
@@ -347,12 +431,14 @@ class Llama3Model(PipelineModel):
 
             def _get_logits_and_samples(
                 batch_index: int, echo: bool
-            ) -> tuple[np.ndarray, np.ndarray]:
+            ) -> tuple[np.ndarray | LazyLogits, np.ndarray]:
                 if echo:
                     seq_len = seq_lens[batch_index]
                     padded_tokens = tokens[batch_index]
 
-                    batch_logits = logits[batch_index, :seq_len, :]
+                    batch_logits = LazyLogits(
+                        logits, num_rows=int(seq_len), batch_index=batch_index
+                    )
                     samples = np.concatenate(
                         (
                             padded_tokens[1:seq_len],
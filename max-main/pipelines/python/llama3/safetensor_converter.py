@@ -13,19 +13,28 @@
 
 from __future__ import annotations
 
+import json
 import math
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
 from collections.abc import Mapping, Sequence
-from functools import cached_property
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cached_property, lru_cache
 from os import PathLike
 from pathlib import Path
 
 import torch
+from dataprocessing import load_profile
 from max.dtype import DType
 from max.graph.weights import SafetensorWeights, WeightsConverter
 from max.graph.weights._torch_dtype_map import (
     modular_to_torch_type,
     torch_to_modular_type,
 )
+from safetensors import safe_open
 from transformers import LlamaConfig
 
 # Map from GGUF tensor names to Safetensor names.
@@ -47,6 +56,142 @@ LLAMA_GGUF_TENSOR_MAPPING = {
 }
 
 
+# Number of threads reading safetensors shards.
+DEFAULT_NUM_LOAD_THREADS = 8
+
+# Maximum number of bytes read ahead of the tensors requested by graph
+# building. A tensor larger than the window is still read, on its own.
+DEFAULT_PREFETCH_WINDOW_BYTES = 1024 * 1024 * 1024
+
+
+def _natural_sort_key(name: str) -> list:
+    """Sorts "layers.2" before "layers.10", the order in which layers are built."""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def _graph_build_order_key(name: str) -> tuple[int, list]:
+    """Orders tensors the way the Llama graph requests them: the embedding,
+    the layers in order, the final norm and then the output weight."""
+    if name.startswith("model.embed_tokens."):
+        group = 0
+    elif name.startswith("model.layers."):
+        group = 1
+    elif name.startswith("lm_head."):
+        group = 3
+    else:
+        group = 2
+    return group, _natural_sort_key(name)
+
+
+def _safetensors_nbytes(filepath: PathLike) -> dict[str, int]:
+    """Returns the size in bytes of each tensor of a safetensors file.
+
+    Only the header is read.
+    """
+    with open(filepath, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    return {
+        name: info["data_offsets"][1] - info["data_offsets"][0]
+        for name, info in header.items()
+        if name != "__metadata__"
+    }
+
+
+class _ShardPrefetcher:
+    """Reads safetensors tensors ahead of use from a thread pool.
+
+    Tensors are read in the order graph building requests them, so reads from
+    different shards overlap with each other and with graph building. At most
+    `window_bytes` of tensors are read ahead of the tensors taken with `take`.
+    Call `close` once loading finishes, to drop the tensors that were never
+    taken and stop the threads.
+    """
+
+    def __init__(
+        self,
+        filepaths: Sequence[PathLike],
+        tensors_to_file_idx: Mapping[str, int],
+        num_threads: int = DEFAULT_NUM_LOAD_THREADS,
+        window_bytes: int = DEFAULT_PREFETCH_WINDOW_BYTES,
+    ):
+        self._filepaths = filepaths
+        self._tensors_to_file_idx = tensors_to_file_idx
+        self._window_bytes = window_bytes
+        self._nbytes: dict[str, int] = {}
+        for filepath in filepaths:
+            self._nbytes.update(_safetensors_nbytes(filepath))
+        self._pending = sorted(tensors_to_file_idx, key=_graph_build_order_key)
+        self._pending.reverse()
+        self._inflight: OrderedDict[str, Future[torch.Tensor]] = OrderedDict()
+        self._inflight_bytes = 0
+        # Tensors that were requested before being prefetched, and have been
+        # loaded by the caller instead.
+        self._skipped: set[str] = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(
+            max_workers=num_threads, thread_name_prefix="safetensors-prefetch"
+        )
+        with self._lock:
+            self._fill()
+
+    def _read(self, name: str) -> torch.Tensor:
+        # Each thread keeps its own handle per shard, so that the shard header
+        # is only parsed once per thread.
+        handles = getattr(self._local, "handles", None)
+        if handles is None:
+            handles = self._local.handles = {}
+        file_idx = self._tensors_to_file_idx[name]
+        if file_idx not in handles:
+            handles[file_idx] = safe_open(self._filepaths[file_idx], framework="pt")
+        return handles[file_idx].get_tensor(name)
+
+    def _fill(self) -> None:
+        while self._pending:
+            name = self._pending[-1]
+            if name in self._skipped:
+                self._pending.pop()
+                continue
+            nbytes = self._nbytes.get(name, 0)
+            if (
+                self._inflight
+                and self._inflight_bytes + nbytes > self._window_bytes
+            ):
+                break
+            self._pending.pop()
+            self._inflight[name] = self._executor.submit(self._read, name)
+            self._inflight_bytes += nbytes
+        if not self._pending and not self._inflight:
+            self._executor.shutdown(wait=False)
+
+    def take(self, name: str) -> torch.Tensor | None:
+        """Returns the tensor `name` if it was prefetched, or None.
+
+        If None is returned, the caller loads the tensor itself, and it is not
+        prefetched later.
+        """
+        with self._lock:
+            future = self._inflight.pop(name, None)
+            if future is None:
+                self._skipped.add(name)
+                return None
+            self._inflight_bytes -= self._nbytes.get(name, 0)
+            self._fill()
+        return future.result()
+
+    def close(self) -> None:
+        """Stops prefetching and drops the tensors that were never taken."""
+        with self._lock:
+            self._pending.clear()
+            inflight = list(self._inflight.values())
+            self._inflight.clear()
+            self._inflight_bytes = 0
+        for future in inflight:
+            future.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
 class LlamaSafetensorWeights(SafetensorWeights, WeightsConverter):
     """Loads Safetensor weights with GGUF names.
 
@@ -57,6 +202,9 @@ class LlamaSafetensorWeights(SafetensorWeights, WeightsConverter):
     (2) Computes the rope_freqs.weight using the HuggingFace config
     (3) Transposes the q_proj and k_proj weights.
 
+    Translated names and the weights created by attribute access are cached,
+    and are shared by all the weights of a tree. Shards are read ahead of use
+    by a `_ShardPrefetcher`.
     """
 
     def __init__(
@@ -66,8 +214,15 @@ class LlamaSafetensorWeights(SafetensorWeights, WeightsConverter):
         huggingface_config: LlamaConfig,
         has_rope_scaling: bool,
         rope_freqs_tensor: torch.Tensor | None,
+        name_cache: dict[str, str] | None = None,
+        children: dict[str, LlamaSafetensorWeights] | None = None,
+        prefetcher: _ShardPrefetcher | None = None,
         **kwargs,
     ):
+        # Set before anything else, since __getattr__ uses them.
+        self._name_cache = {} if name_cache is None else name_cache
+        self._children = {} if children is None else children
+        self._prefetcher = prefetcher
         super().__init__(filepaths, **kwargs)
         self._gguf_name_map = gguf_name_map
         self._huggingface_config = huggingface_config
@@ -88,13 +243,29 @@ class LlamaSafetensorWeights(SafetensorWeights, WeightsConverter):
                     rope_scaling, huggingface_config
                 )
 
-        return LlamaSafetensorWeights(
+        weights = LlamaSafetensorWeights(
             weight_path,
             gguf_name_map=LLAMA_GGUF_TENSOR_MAPPING,
             huggingface_config=config.huggingface_config,
             has_rope_scaling=has_rope_scaling,
             rope_freqs_tensor=rope_freqs_tensor,
         )
+        weights._start_prefetch()
+        return weights
+
+    def _start_prefetch(self) -> None:
+        """Starts reading the shards in the background."""
+        self._prefetcher = _ShardPrefetcher(self._filepaths, self._tensors_to_file_idx)
+
+    def stop_prefetch(self) -> None:
+        """Stops reading the shards in the background.
+
+        Call once the graph is built: tensors read ahead but never requested
+        are released, and the reader threads are shut down. Later loads read
+        the tensors directly.
+        """
+        if self._prefetcher is not None:
+            self._prefetcher.close()
 
     def items(self):
         # This is defined in SafetensorWeights. Currently there's no reason to
@@ -104,6 +275,11 @@ class LlamaSafetensorWeights(SafetensorWeights, WeightsConverter):
     @cached_property
     def name(self) -> str:
         """The current weight name or prefix."""
+        name = self._name_cache.get(self._prefix)
+        if name is not None:
+            return name
+
+        start = time.perf_counter()
         name = self._prefix
         if self._gguf_name_map:
             # Note that the following replacement only works for models like
@@ -111,14 +287,26 @@ class LlamaSafetensorWeights(SafetensorWeights, WeightsConverter):
             # name map.
             for before, after in self._gguf_name_map.items():
                 name = name.replace(before, after)
+        self._name_cache[self._prefix] = name
+        load_profile().record("name_mapping", time.perf_counter() - start)
         return name
 
     def __getattr__(self, attr) -> LlamaSafetensorWeights:
+        if attr.startswith("__") or attr in (
+            "_name_cache",
+            "_children",
+            "_prefetcher",
+        ):
+            raise AttributeError(attr)
+
         if self._prefix:
             full_path = f"{self._prefix}.{attr}"
         else:
             full_path = str(attr)
-        return LlamaSafetensorWeights(
+        if (child := self._children.get(full_path)) is not None:
+            return child
+
+        child = LlamaSafetensorWeights(
             self._filepaths,
             self._gguf_name_map,
             huggingface_config=self._huggingface_config,
@@ -129,7 +317,12 @@ class LlamaSafetensorWeights(SafetensorWeights, WeightsConverter):
             prefix=full_path,
             allocated=self._allocated,
             _st_weight_map=self._st_weight_map,
+            name_cache=self._name_cache,
+            children=self._children,
+            prefetcher=self._prefetcher,
         )
+        self._children[full_path] = child
+        return child
 
     def exists(self) -> bool:
         return self.name in self._tensors_to_file_idx or (
@@ -143,7 +336,21 @@ class LlamaSafetensorWeights(SafetensorWeights, WeightsConverter):
             if dtype is not None and torch_to_modular_type(tensor.dtype) != dtype:
                 tensor = tensor.to(modular_to_torch_type(dtype))
             return tensor
-        tensor = super()._load_tensor(dtype)
+
+        # Only the time spent waiting on reads is recorded, under its own
+        # phase since it overlaps `graph_build`. Tensors that were prefetched
+        # ahead of use raise the effective throughput.
+        start = time.perf_counter()
+        tensor = None
+        if self._prefetcher is not None:
+            tensor = self._prefetcher.take(self.name)
+        if tensor is None:
+            tensor = super()._load_tensor(dtype)
+        elif dtype is not None and torch_to_modular_type(tensor.dtype) != dtype:
+            tensor = tensor.to(modular_to_torch_type(dtype))
+        load_profile().record(
+            "weight_read_wait", time.perf_counter() - start, tensor.nbytes
+        )
 
         if self.name.endswith(("q_proj.weight", "q_proj.bias")):
             n_head = self._huggingface_config.num_attention_heads
@@ -172,28 +379,45 @@ def _compute_rope_scaling(rope_scaling, huggingface_config: LlamaConfig):
     high_freq_wavelen = old_context_len / high_freq_factor
     assert low_freq_wavelen != high_freq_wavelen
 
-    rope_factors = []
-    for freq in freqs:
-        wavelen = 2 * math.pi / freq
-        if wavelen < high_freq_wavelen:
-            rope_factors.append(1)
-        elif wavelen > low_freq_wavelen:
-            rope_factors.append(factor)
-        else:
-            smooth = (old_context_len / wavelen - low_freq_factor) / (
-                high_freq_factor - low_freq_factor
-            )
-            rope_factors.append(1 / ((1 - smooth) / factor + smooth))
-    return torch.tensor(rope_factors, dtype=torch.float32)
+    wavelen = 2 * math.pi / freqs
+    smooth = (old_context_len / wavelen - low_freq_factor) / (
+        high_freq_factor - low_freq_factor
+    )
+    rope_factors = torch.where(
+        wavelen < high_freq_wavelen,
+        1.0,
+        torch.where(
+            wavelen > low_freq_wavelen,
+            factor,
+            1 / ((1 - smooth) / factor + smooth),
+        ),
+    )
+    return rope_factors.to(torch.float32)
+
 
+@lru_cache
+def _permutation_indices(n_rows: int, n_head: int) -> torch.Tensor:
+    """Returns the row order of `_permute_weights` for a q/k weight."""
+    return (
+        torch.arange(n_rows)
+        .reshape(n_head, 2, n_rows // n_head // 2)
+        .swapaxes(1, 2)
+        .reshape(-1)
+    )
 
-def _permute_weights(weights: torch.Tensor, n_head: int, n_head_kv: int | None):
+
+def _permute_weights(
+    weights: torch.Tensor,
+    n_head: int,
+    n_head_kv: int | None,
+):
     # From llama.cpp's HF to GGUF conversion script:
     # https://github.com/ggerganov/llama.cpp/blob/40c6d79fb52f995f47507fedfeaae2ac05d9b35c/convert_hf_to_gguf.py#L1571C1-L1578C41
     if n_head_kv is not None and n_head != n_head_kv:
         n_head = n_head_kv
-    return (
-        weights.reshape(n_head, 2, weights.shape[0] // n_head // 2, *weights.shape[1:])
-        .swapaxes(1, 2)
-        .reshape(weights.shape)
-    )
+
+    # The permutation only reorders rows, so gather them with a single
+    # index_select into a new tensor. The loaded tensor may share storage
+    # with the memory-mapped shard, so it is never written to.
+    indices = _permutation_indices(weights.shape[0], n_head)
+    return weights.index_select(0, indices)
@@ -26,56 +26,62 @@ from .vision_model import VisionModel
 
 
 @dataclass
-class ConditionalGenerator(Layer):
+class CrossAttentionStatesEncoder(Layer):
     """
-    The Llama model which consists of a vision encoder and a language model.
+    The vision encoder and projector that turn images into cross attention
+    states for the language model.
     """
 
     pipeline_config: PipelineConfig
     vision_model: VisionModel
     multi_modal_projector: Linear
-    language_model: CausalLanguageModel
 
     def __call__(
         self,
         pixel_values: TensorValue,
         aspect_ratio_ids: TensorValue,
-        aspect_ratio_mask: TensorValue,
-        input_ids: TensorValue,
-        hidden_input_row_offsets: TensorValue,
-        cross_input_row_offsets: TensorValue,
-        kv_cache_inputs: tuple[TensorValue, ...],
     ) -> TensorValue:
-        if pixel_values is not None:
-            if aspect_ratio_ids is None:
-                msg = (
-                    "`aspect_ratio_ids` must be provided if `pixel_values` is "
-                    "provided"
-                )
-                raise ValueError(msg)
+        # Get vision tokens from vision model.
+        vision_outputs = self.vision_model(
+            pixel_values=pixel_values,
+            aspect_ratio_ids=aspect_ratio_ids,
+        )
+        cross_attention_states = vision_outputs[0]
+
+        num_patches = cross_attention_states.shape[-2]
+
+        return self.multi_modal_projector(cross_attention_states).reshape(
+            [
+                Dim("batch_size")
+                * Dim("num_concurrent_media")
+                * self.pipeline_config.huggingface_config.vision_config.max_num_tiles
+                * num_patches,
+                self.pipeline_config.huggingface_config.text_config.hidden_size,
+            ]
+        )
+
 
-            # Get vision tokens from vision model.
-            vision_outputs = self.vision_model(
-                pixel_values=pixel_values,
-                aspect_ratio_ids=aspect_ratio_ids,
-                aspect_ratio_mask=aspect_ratio_mask,
-            )
-            cross_attention_states = vision_outputs[0]
+@dataclass
+class ConditionalGenerator(Layer):
+    """
+    The Llama model which consists of a vision encoder and a language model.
 
-            num_patches = cross_attention_states.shape[-2]
+    The vision encoder runs as a separate graph, so that its cross attention
+    states can be computed once per request and reused by every token
+    generation step.
+    """
 
-            cross_attention_states = self.multi_modal_projector(
-                cross_attention_states
-            ).reshape(
-                [
-                    Dim("batch_size")
-                    * Dim("num_concurrent_media")
-                    * self.pipeline_config.huggingface_config.vision_config.max_num_tiles
-                    * num_patches,
-                    self.pipeline_config.huggingface_config.text_config.hidden_size,
-                ]
-            )
+    pipeline_config: PipelineConfig
+    language_model: CausalLanguageModel
 
+    def __call__(
+        self,
+        input_ids: TensorValue,
+        hidden_input_row_offsets: TensorValue,
+        cross_attention_states: TensorValue,
+        cross_input_row_offsets: TensorValue,
+        kv_cache_inputs: tuple[TensorValue, ...],
+    ) -> TensorValue:
         return self.language_model(
             kv_cache_inputs=kv_cache_inputs,
             input_ids=input_ids,
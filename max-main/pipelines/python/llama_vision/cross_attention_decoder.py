@@ -83,6 +83,9 @@ class CrossSdpaAttention(Layer):
         )
         query_states = self.q_norm(query_states)
 
+        # Token generation steps pass no cross attention rows, so the cross
+        # keys and values are only projected and written to the KV cache
+        # during context encoding.
         matmul_kv_cache_ragged(
             kv_params=self.kv_params,
             # Here, hidden_states correspond to cross_attention_states.
@@ -16,6 +16,7 @@ import logging
 from collections.abc import Sequence
 
 import numpy as np
+from dataprocessing import RaggedBatchBuilder, load_profile
 from max.driver import Tensor
 from max.dtype import DType
 from max.engine import InferenceSession, Model
@@ -35,7 +36,7 @@ from max.pipelines.kv_cache import (
 )
 from nn import Linear
 
-from .conditional_generator import ConditionalGenerator
+from .conditional_generator import ConditionalGenerator, CrossAttentionStatesEncoder
 from .language_model import instantiate_language_model
 from .vision_model import instantiate_vision_model
 
@@ -59,18 +60,13 @@ class LlamaVision(PipelineModel):
 
         super().__init__(pipeline_config, session)
 
-    def __call__(
+    def _encode_cross_attention_states(
         self,
         pixel_values: TensorValue,
         aspect_ratio_ids: TensorValue,
-        aspect_ratio_mask: TensorValue,
-        input_id_values: TensorValue,
-        pixel_row_offsets: TensorValue,
-        input_id_row_offsets: TensorValue,
-        *kv_cache_inputs: TensorValue,
     ) -> TensorValue:
-        """Builds the graph: all op staging happens here in __call__."""
-        conditional_generator = ConditionalGenerator(
+        """Builds the vision graph: all op staging happens here."""
+        encoder = CrossAttentionStatesEncoder(
             pipeline_config=self.pipeline_config,
             vision_model=instantiate_vision_model(
                 dtype=self.pipeline_config.dtype,
@@ -101,6 +97,21 @@ class LlamaVision(PipelineModel):
                     [self.text_config.hidden_size],
                 ),
             ),
+        )
+
+        return encoder(pixel_values, aspect_ratio_ids)
+
+    def __call__(
+        self,
+        input_id_values: TensorValue,
+        input_id_row_offsets: TensorValue,
+        cross_attention_states: TensorValue,
+        cross_attention_row_offsets: TensorValue,
+        *kv_cache_inputs: TensorValue,
+    ) -> TensorValue:
+        """Builds the language graph: all op staging happens here in __call__."""
+        conditional_generator = ConditionalGenerator(
+            pipeline_config=self.pipeline_config,
             language_model=instantiate_language_model(
                 dtype=self.pipeline_config.dtype,
                 hidden_size=self.text_config.hidden_size,
@@ -119,24 +130,21 @@ class LlamaVision(PipelineModel):
         )
 
         return conditional_generator(
-            pixel_values,
-            aspect_ratio_ids,
-            aspect_ratio_mask,
             input_id_values,
-            pixel_row_offsets,
             input_id_row_offsets,
+            cross_attention_states,
+            cross_attention_row_offsets,
             kv_cache_inputs,
         )
 
-    def _llama3_vision_graph(self) -> Graph:
+    def _llama3_vision_encoder_graph(self) -> Graph:
         # TODO: Verify if the mapping is correct:
         # From dumping the inputs before executing the reference model...
-        # key: input_id_values, shape: torch.Size([1, 14])
         # key: pixel_values, shape: torch.Size([1, 1, 4, 3, 448, 448])
         # but manually transposed by us from CHW -> HWC
         # key: aspect_ratio_ids, shape: torch.Size([1, 1])
-        # key: aspect_ratio_mask, shape: torch.Size([1, 1, 4])
-        # key: cross_attention_mask, shape: torch.Size([1, 14, 1, 4])
+        # The aspect_ratio_mask input of the reference model is not needed:
+        # the attention mask is looked up from aspect_ratio_ids.
 
         # Inserted a manual CHW -> HWC transpose here.
         pixel_values_type = TensorType(
@@ -154,32 +162,43 @@ class LlamaVision(PipelineModel):
             DType.int64,
             shape=["batch_size", "num_concurrent_media"],
         )
-        aspect_ratio_mask_type = TensorType(
-            self.pipeline_config.dtype,
-            shape=[
-                "batch_size",
-                "num_concurrent_media",
-                self.vision_config.max_num_tiles,
+
+        return Graph(
+            "llama3-vision-encoder",
+            forward=self._encode_cross_attention_states,
+            input_types=[
+                pixel_values_type,
+                aspect_ratio_ids_type,
             ],
         )
 
+    def _llama3_vision_graph(self) -> Graph:
+        # TODO: Verify if the mapping is correct:
+        # From dumping the inputs before executing the reference model...
+        # key: input_id_values, shape: torch.Size([1, 14])
+        # key: cross_attention_mask, shape: torch.Size([1, 14, 1, 4])
         input_ids_type = TensorType(DType.int64, shape=["total_seq_len"])
         input_row_offsets_type = TensorType(
             DType.uint32, shape=["input_row_offsets_len"]
         )
+        cross_attention_states_type = TensorType(
+            self.pipeline_config.dtype,
+            shape=["num_vision_embeddings", self.text_config.hidden_size],
+        )
+        cross_attention_row_offsets_type = TensorType(
+            DType.uint32, shape=["cross_attention_row_offsets_len"]
+        )
 
         return Graph(
             "llama3-vision",
             # Pass PipelineModel as the Graph's forward callable until nn.Model.
             forward=self,
             input_types=[
-                pixel_values_type,
-                aspect_ratio_ids_type,
-                aspect_ratio_mask_type,
                 input_ids_type,
                 # Pass 2 sets of offsets for hidden and cross attn states.
                 input_row_offsets_type,
-                input_row_offsets_type,
+                cross_attention_states_type,
+                cross_attention_row_offsets_type,
                 *self.kv_manager.input_symbols()[0],
             ],
         )
@@ -193,6 +212,34 @@ class LlamaVision(PipelineModel):
             raise ValueError(msg)
 
         batch_size = len(context_batch)
+
+        # Run the vision encoder once for the whole request. The context
+        # encoding step writes the cross attention keys and values of these
+        # states to the KV cache, which the token generation steps then reuse.
+        cross_attention_states = self._encode_images(batch_size)
+
+        # Cross attention states are packed with the same number of rows for
+        # each batch item.
+        rows_per_batch_item = cross_attention_states.shape[0] // batch_size
+        cross_attention_row_offsets = Tensor.from_numpy(
+            np.arange(0, batch_size + 1, dtype=np.uint32) * rows_per_batch_item
+        ).to(self.pipeline_config.device)
+
+        # Input Ids: ["total_seq_len"], Int64
+        # Input row offset type: ["input_row_offsets_len"], UInt32
+        input_id_values, input_id_row_offsets = self._ragged_batch_builder(
+            [ctx.next_tokens for ctx in context_batch]
+        )
+
+        return (
+            input_id_values,
+            input_id_row_offsets,
+            cross_attention_states,
+            cross_attention_row_offsets,
+        )
+
+    def _encode_images(self, batch_size: int) -> Tensor:
+        """Runs the vision encoder, returning the cross attention states."""
         height = self.vision_config.image_size
         width = self.vision_config.image_size
         num_channels = self.vision_config.num_channels
@@ -202,39 +249,37 @@ class LlamaVision(PipelineModel):
             dtype=self.pipeline_config.dtype,
         )
         aspect_ratio_ids = Tensor.zeros(shape=[batch_size, 1], dtype=DType.int64)
-        aspect_ratio_mask = Tensor.zeros(
-            shape=[batch_size, 1, max_num_tiles], dtype=DType.int64
-        )
-
-        # Input row offset type: ["input_row_offsets_len"], UInt32
-        pixel_row_offsets = Tensor.from_numpy(
-            np.cumsum(
-                [0] + [ctx.seq_len for ctx in context_batch],
-                dtype=np.uint32,
-            )
-        ).to(self.pipeline_config.device)
-        input_id_row_offsets = pixel_row_offsets
 
-        # Input Ids: ["total_seq_len"], Int64
-        # Create a ragged token vector of length: sum(len(t) for t in tokens).
-        tokens = np.concatenate([ctx.next_tokens for ctx in context_batch])
-        input_id_values = Tensor.from_numpy(tokens).to(self.pipeline_config.device)
-
-        return (
+        cross_attention_states = self.vision_encoder.execute(
             pixel_values,
             aspect_ratio_ids,
-            aspect_ratio_mask,
-            input_id_values,
-            pixel_row_offsets,
-            input_id_row_offsets,
-        )
+            copy_inputs_to_device=False,
+        )[0]
+        assert isinstance(cross_attention_states, Tensor)
+        return cross_attention_states
 
     def prepare_next_token_inputs(
         self,
         next_tokens: Tensor,
         prev_model_inputs: tuple[Tensor, ...],
     ) -> tuple[Tensor, ...]:
-        raise NotImplementedError("not yet implemented.")
+        """Prepare the inputs for the next token in multistep execution.
+        This should avoid any device synchronization or copy operations.
+        """
+        old_row_offsets = prev_model_inputs[1]
+        row_offsets_size = old_row_offsets.shape[0]
+        next_row_offsets = self._input_row_offsets_prealloc[:row_offsets_size]
+        # The context encoding step wrote the cross attention keys and values
+        # of every cross attention layer to the KV cache. Pass no cross
+        # attention states (all-zero row offsets), so that token generation
+        # steps skip the cross key/value projection and cache writes and only
+        # attend to the cached keys and values.
+        return (
+            next_tokens,
+            next_row_offsets,
+            self._empty_cross_attention_states,
+            self._empty_cross_attention_row_offsets[:row_offsets_size],
+        )
 
     def execute(self, *model_inputs: Tensor) -> ModelOutputs:
         model_outputs = self.model.execute(*model_inputs, copy_inputs_to_device=False)
@@ -275,13 +320,53 @@ class LlamaVision(PipelineModel):
         self,
         session: InferenceSession,
     ) -> Model:
-        self.weights = self.pipeline_config.load_weights()
+        # Pre-allocate a buffer for input_row_offsets in multistep execution.
+        # We do this to avoid materializing and copying a buffer with each multistep step
+        self._input_row_offsets_prealloc = Tensor.from_numpy(
+            np.arange(self.pipeline_config.max_cache_batch_size + 1, dtype=np.uint32)
+        ).to(self.pipeline_config.device)
+
+        # Token generation steps reuse the cross attention keys and values
+        # cached by the context encoding step, so they pass empty cross
+        # attention states with all-zero row offsets.
+        self._empty_cross_attention_states = Tensor.zeros(
+            shape=[0, self.text_config.hidden_size],
+            dtype=self.pipeline_config.dtype,
+        ).to(self.pipeline_config.device)
+        self._empty_cross_attention_row_offsets = Tensor.from_numpy(
+            np.zeros(self.pipeline_config.max_cache_batch_size + 1, dtype=np.uint32)
+        ).to(self.pipeline_config.device)
+
+        # Reuse host staging buffers to build the ragged context encoding batch.
+        self._ragged_batch_builder = RaggedBatchBuilder(
+            max_batch_size=self.pipeline_config.max_cache_batch_size,
+            max_length=max_seq_len(self.pipeline_config),
+            device=self.pipeline_config.device,
+        )
+
+        profile = load_profile()
+        with profile.phase("weight_read"):
+            self.weights = self.pipeline_config.load_weights()
+
+        logging.info("Building vision encoder...")
+        with profile.phase("graph_build"):
+            vision_encoder_graph = self._llama3_vision_encoder_graph()
+        logging.info("Compiling vision encoder...")
+        weights_registry = self.weights.allocated_weights
+        with profile.phase("compile"):
+            self.vision_encoder = session.load(
+                vision_encoder_graph,
+                weights_registry=weights_registry,
+            )
 
         logging.info("Building model...")
-        graph = self._llama3_vision_graph()
+        with profile.phase("graph_build"):
+            graph = self._llama3_vision_graph()
         logging.info("Compiling...")
-        model = session.load(
-            graph,
-            weights_registry=self.weights.allocated_weights,
-        )
+        weights_registry = self.weights.allocated_weights
+        with profile.phase("compile"):
+            model = session.load(
+                graph,
+                weights_registry=weights_registry,
+            )
         return model
@@ -17,10 +17,11 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 
+import numpy as np
 from max.dtype import DType
 from max.graph import Dim, StaticDim, TensorValue, TensorValueLike, ops
 from max.graph.weights import Weights
-from nn import Conv2D, Embedding, Linear, LPLayerNorm
+from nn import ConstantPad, Conv2D, Embedding, Linear, LPLayerNorm
 from nn.layer import Layer
 
 from .attention import Attention
@@ -42,6 +43,49 @@ class VisionConv2D(Conv2D):
         return super().__call__(x=x)
 
 
+def _dtype_min(dtype: DType) -> float:
+    """Returns the lowest finite value of a floating point dtype."""
+    if dtype == DType.bfloat16:
+        # Equal to torch.finfo(torch.bfloat16).min.
+        return -3.3895313892515355e38
+    if dtype == DType.float16:
+        return float(np.finfo(np.float16).min)
+    if dtype == DType.float32:
+        return float(np.finfo(np.float32).min)
+    msg = f"unsupported attention mask dtype: {dtype}"
+    raise ValueError(msg)
+
+
+def aspect_ratio_padding_masks(
+    supported_aspect_ratios: list[list[int]],
+    max_num_tiles: int,
+    num_patches: int,
+    target_length: int,
+) -> np.ndarray:
+    """Precomputes the vision encoder padding masks of each aspect ratio.
+
+    An image with aspect ratio `(h, w)` fills its first `h * w` tiles, and the
+    last `target_length - num_patches` patches of every tile are padding.
+    Entry `[aspect_ratio_id, i]` is 1 if position `i` of the flattened
+    `(max_num_tiles, target_length)` patches is an empty tile or a padding
+    patch, and 0 otherwise. Aspect ratio id 0 is used for padding images, which
+    have a single tile.
+
+    Returns:
+        A `(len(supported_aspect_ratios) + 1, max_num_tiles * target_length)`
+        float32 array.
+    """
+    num_tiles = np.array(
+        [1] + [height * width for height, width in supported_aspect_ratios]
+    )
+    empty_tiles = np.arange(max_num_tiles) >= num_tiles[:, None]
+    padding_patches = np.arange(target_length) >= num_patches
+    masks = empty_tiles[:, :, None] | padding_patches[None, None, :]
+    return masks.reshape(len(num_tiles), max_num_tiles * target_length).astype(
+        np.float32
+    )
+
+
 @dataclass
 class VisionModel(Layer):
     """
@@ -63,6 +107,8 @@ class VisionModel(Layer):
         layernorm_post: Layer normalization applied after processing through the transformer layers.
         transformer: Transformer responsible for capturing local spatial relationships in the image.
         global_transformer: Transformer focused on global context and capturing long-range dependencies within the image.
+        aspect_ratio_padding_masks: Precomputed padding masks of each aspect ratio,
+            indexed by aspect ratio id. See `aspect_ratio_padding_masks`.
     """
 
     gated_positional_embedding: PrecomputedPositionEmbedding
@@ -77,6 +123,7 @@ class VisionModel(Layer):
     dtype: DType
     intermediate_layers_indices: list[int]
     num_patches: int
+    aspect_ratio_padding_masks: np.ndarray
 
     def apply_class_embedding(self, hidden_state: TensorValue) -> TensorValue:
         """
@@ -110,119 +157,31 @@ class VisionModel(Layer):
 
     def _prepare_aspect_ratio_attention_mask(
         self,
-        aspect_ratio_mask: TensorValue,
-        num_patches: int,
-        target_length: int,
+        aspect_ratio_ids: TensorValue,
         dtype: DType,
     ) -> TensorValue:
-        # Expand aspect ratio mask to target_length
-        batch_size, max_num_tiles = aspect_ratio_mask.shape
-        attention_mask = aspect_ratio_mask.reshape(
-            (batch_size, max_num_tiles, 1, 1)
-        ).cast(
-            dtype
-        )  # (1, 4, 1, 1)
-        # attention_shape (1, 4, 1, 1) -> (1, 4, 1032, 1)
-        attention_mask = ops.tile(attention_mask, (1, 1, target_length, 1))
-
-        # Mask padding patches
-        pad_patches = target_length - num_patches
-
-        # The snippet below is a workaround for
-        # attention_mask[:, :, 0 - pad_patches :] = 0
-        valid_mask = attention_mask[:, :, :-pad_patches, :]
-        zero_pad = ops.constant(0, dtype).broadcast_to(
-            (batch_size, max_num_tiles, pad_patches, attention_mask.shape[-1])
-        )
-        attention_mask = ops.concat((valid_mask, zero_pad), axis=2)
-
-        # Invert the mask (0 -> 1, 1 -> 0)
-        attention_mask = 1 - attention_mask
-
-        # Reshape to 2D and create 4D attention mask
-        # (batch_size, 1, max_num_tiles * target_length, max_num_tiles * target_length)
-        attention_mask = attention_mask.reshape(
-            (batch_size, max_num_tiles * target_length, 1)
+        # Look up the precomputed padding mask of each image's aspect ratio.
+        # (batch_size, 1, max_num_tiles * target_length)
+        padding_mask = ops.gather(
+            ops.constant(self.aspect_ratio_padding_masks, DType.float32).cast(dtype),
+            aspect_ratio_ids,
+            axis=0,
         )
+        batch_size, _, seq_len = padding_mask.shape
 
-        # TODO: Hardcoded for now. Reference implementation uses torch.finfo(torch.bfloat16).min
-        bfloat_dtype_min_val = -3.3895313892515355e38
         # Perform outer product by broadcasting elementwise multiplication.
+        # (batch_size, max_num_tiles * target_length, max_num_tiles * target_length)
         attention_mask = (
-            attention_mask
-            * attention_mask.reshape((batch_size, 1, max_num_tiles * target_length))
-        ) * bfloat_dtype_min_val
+            padding_mask.reshape((batch_size, seq_len, 1)) * padding_mask
+        ) * _dtype_min(dtype)
 
         # before unsqueeze: attention_mask shape: (1, 4128, 4128)
         return ops.unsqueeze(attention_mask, axis=1)
 
-    def _manual_constant_pad_4d(
-        self,
-        dtype: DType,
-        input_tensor,
-        pad: tuple[int, int, int, int],
-        value=0,
-    ) -> TensorValue:
-        """
-        Manually pads a 4D tensor (batch of images) with constant values.
-
-        Args:
-            input_tensor (TensorValue): The input 4D tensor (batch_size, channels, height, width).
-            pad (tuple): Tuple of the form (left, right, top, bottom) specifying padding sizes.
-            value (float): The value to pad with.
-
-        Returns:
-            TensorValue: Padded tensor.
-        """
-        left, right, top, bottom = pad
-        batch_size, channels, height, width = input_tensor.shape
-
-        # Compute new height and width after padding
-        new_height = height + top + bottom
-        new_width = width + left + right
-
-        padded_tensor = ops.constant(value, dtype).broadcast_to(
-            (batch_size, channels, new_height, new_width)
-        )
-
-        # Insert the original tensor into the center of the padded tensor
-        # The code snippet below is a workaround for:
-        # padded_tensor[
-        #     :, :, top : top + height, left : left + width
-        # ] = input_tensor
-
-        # Slice regions along height (dim=2)
-        # Unchanged region above
-        top_region = padded_tensor[:, :, :top, :]
-        # Unchanged region below
-        bottom_region = padded_tensor[:, :, top + height.dim :, :]
-
-        # Slice regions along width (dim=3)
-        # Unchanged region to the left
-        left_region = padded_tensor[:, :, top : top + height.dim, :left]
-        width_tuple: tuple[TensorValue, ...] = (left_region, input_tensor)
-        if left > 0:
-            # Unchanged region to the right
-            right_region = padded_tensor[
-                :, :, top : top + height.dim, left + width.dim :
-            ]
-            width_tuple += (right_region,)
-
-        # Concatenate along width (axis=3)
-        middle_region = ops.concat(width_tuple, axis=3)
-
-        # Concatenate along height (axis=2)
-        updated_padded_tensor = ops.concat(
-            (top_region, middle_region, bottom_region), axis=2
-        )
-
-        return updated_padded_tensor
-
     def __call__(
         self,
         pixel_values: TensorValue,
         aspect_ratio_ids: TensorValue,
-        aspect_ratio_mask: TensorValue,
     ) -> tuple[TensorValue, TensorValue | None, TensorValue | None]:
         (
             batch_size,
@@ -291,24 +250,13 @@ class VisionModel(Layer):
             num_padding_patches,
         )  # (pad_left, pad_right, pad_left for dim -2, pad_right for dim -2)
         # Pad the tensor
-        hidden_state = self._manual_constant_pad_4d(
-            dtype=self.dtype,
-            input_tensor=hidden_state,
-            pad=padding,
-            value=0,
-        )
+        hidden_state = ConstantPad(padding, value=0)(hidden_state)
 
         slice_index = -num_padding_patches if num_padding_patches > 0 else None
 
         # Prepare attention mask
-        attention_mask = aspect_ratio_mask.reshape(
-            (batch_size * num_concurrent_media, -1)
-        )  # (1, 4)
-
         attention_mask = self._prepare_aspect_ratio_attention_mask(
-            aspect_ratio_mask=attention_mask,
-            num_patches=self.num_patches,
-            target_length=StaticDim(hidden_state.shape[2]).dim,
+            aspect_ratio_ids=aspect_ratio_ids,
             dtype=self.dtype,
         )
 
@@ -441,6 +389,8 @@ def instantiate_vision_model(
     # Shared variables.
     num_patches = (image_size // patch_size) ** 2 + 1
     max_aspect_ratio_id = (len(supported_aspect_ratios)) + 1
+    # Patches of each tile are padded to a multiple of 8.
+    target_length = num_patches + (8 - (num_patches % 8)) % 8
 
     gated_positional_embedding = PrecomputedPositionEmbedding(
         image_size=image_size,
@@ -686,5 +636,11 @@ def instantiate_vision_model(
         global_transformer=global_transformer,
         dtype=dtype,
         intermediate_layers_indices=intermediate_layers_indices,
-        num_patches=(image_size // patch_size) ** 2 + 1,
+        num_patches=num_patches,
+        aspect_ratio_padding_masks=aspect_ratio_padding_masks(
+            supported_aspect_ratios,
+            max_num_tiles=max_num_tiles,
+            num_patches=num_patches,
+            target_length=target_length,
+        ),
     )
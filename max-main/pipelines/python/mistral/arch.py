@@ -11,12 +11,12 @@
 # limitations under the License.
 # ===----------------------------------------------------------------------=== #
 
+from dataprocessing.tokenizer import CachedTextTokenizer
 from max.pipelines import (
     HuggingFaceFile,
     SupportedArchitecture,
     SupportedEncoding,
     SupportedVersion,
-    TextTokenizer,
     WeightsFormat,
 )
 from max.pipelines.kv_cache import KVCacheStrategy
@@ -48,6 +48,6 @@ mistral_arch = SupportedArchitecture(
     ],
     default_version="default",
     pipeline_model=MistralModel,
-    tokenizer=TextTokenizer,
+    tokenizer=CachedTextTokenizer,
     default_weights_format=WeightsFormat.safetensors,
 )
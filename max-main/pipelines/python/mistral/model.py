@@ -17,6 +17,12 @@ import logging
 from typing import Sequence
 
 import numpy as np
+from dataprocessing import (
+    RaggedBatchBuilder,
+    file_nbytes,
+    load_profile,
+    weights_registry_nbytes,
+)
 from max.driver import Tensor
 from max.engine import InferenceSession, Model
 from max.graph.weights import SafetensorWeights
@@ -42,25 +48,7 @@ class MistralModel(PipelineModel):
         self,
         context_batch: Sequence[TextContext],  # type: ignore
     ) -> tuple[Tensor, ...]:
-        # Get tokens and seq ids
-        tokens = [ctx.next_tokens for ctx in context_batch]
-
-        # Get input_row_offsets: start and end position of each batch in the
-        # combined total_seq_len dimension.
-        input_row_offsets = Tensor.from_numpy(
-            np.cumsum(
-                [0] + [ctx.seq_len for ctx in context_batch],
-                dtype=np.uint32,
-            )
-        ).to(self.pipeline_config.device)
-
-        # Create a ragged token vector of length: sum(len(t) for t in tokens).
-        next_tokens_batch = np.concatenate(tokens)
-        next_tokens_batch = Tensor.from_numpy(next_tokens_batch).to(
-            self.pipeline_config.device
-        )
-
-        return (next_tokens_batch, input_row_offsets)
+        return self._ragged_batch_builder([ctx.next_tokens for ctx in context_batch])
 
     def prepare_next_token_inputs(
         self,
@@ -118,7 +106,16 @@ class MistralModel(PipelineModel):
             np.arange(self.pipeline_config.max_cache_batch_size + 1, dtype=np.uint32)
         ).to(self.pipeline_config.device)
 
-        self._weights = self.pipeline_config.load_weights()
+        # Reuse host staging buffers to build the ragged context encoding batch.
+        self._ragged_batch_builder = RaggedBatchBuilder(
+            max_batch_size=self.pipeline_config.max_cache_batch_size,
+            max_length=self.pipeline_config.max_length,
+            device=self.pipeline_config.device,
+        )
+
+        profile = load_profile()
+        with profile.phase("weight_read"):
+            self._weights = self.pipeline_config.load_weights()
 
         if not isinstance(self._weights, SafetensorWeights):
             msg = (
@@ -135,17 +132,25 @@ class MistralModel(PipelineModel):
             ) in self.pipeline_config._tensors.items():  # type:ignore
                 weights_registry[name] = tensor.data
             logging.info("Loading serialized model from ", serialized_path, "...")
-            return session.load(
-                serialized_path,
-                weights_registry=weights_registry,
-            )
+            with profile.phase(
+                "mef_import",
+                nbytes=file_nbytes(serialized_path)
+                + weights_registry_nbytes(weights_registry),
+            ):
+                return session.load(
+                    serialized_path,
+                    weights_registry=weights_registry,
+                )
         else:
             logging.info("Building model...")
-            graph = _build_graph(
-                self.pipeline_config,
-                self._weights,
-                self._get_kv_params(),
-                self.kv_manager,
-            )
+            with profile.phase("graph_build"):
+                graph = _build_graph(
+                    self.pipeline_config,
+                    self._weights,
+                    self._get_kv_params(),
+                    self.kv_manager,
+                )
             logging.info("Compiling...")
-            return session.load(graph, weights_registry=self._weights.allocated_weights)
+            weights_registry = self._weights.allocated_weights
+            with profile.phase("compile"):
+                return session.load(graph, weights_registry=weights_registry)
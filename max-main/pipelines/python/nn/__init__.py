@@ -24,6 +24,7 @@ from .conv import Conv2D
 from .embedding import Embedding
 from .linear import MLP, Linear
 from .norm import LPLayerNorm, RMSNorm
+from .pad import ConstantPad
 from .rotary_embedding import OptimizedRotaryEmbedding, RotaryEmbedding
 from .sequential import Sequential
 from .transformer import (
@@ -41,6 +42,7 @@ __all__ = [
     "AttentionWithRope",
     "AttentionWithRopeQKV",
     "NaiveAttentionWithRope",
+    "ConstantPad",
     "Conv2D",
     "Embedding",
     "Linear",
@@ -13,19 +13,78 @@
 
 from __future__ import annotations
 
-from typing import Callable
+from typing import Callable, Optional, Union
 
 import numpy as np
+from max.driver import CPU, Tensor
 from max.pipelines import LogProbabilities
-from scipy.special import log_softmax  # type: ignore
+
+# Number of logits rows to move to the host and process at once. Peak host
+# memory is proportional to this times the vocabulary size, rather than to
+# the total number of tokens in the batch.
+DEFAULT_BLOCK_SIZE = 64
+
+
+class LazyLogits:
+    """Rows of a logits tensor that are copied to the host on demand.
+
+    Slicing a `LazyLogits` copies only the requested rows to the host, which
+    lets long echo requests be processed in blocks instead of copying the full
+    `(seq_len, vocab_size)` logits at once.
+
+    Args:
+        logits: Either ragged `(total_seq_len, vocab_size)` logits, or padded
+            `(batch_size, seq_len, vocab_size)` logits if `batch_index` is set.
+        num_rows: Number of rows (tokens) to expose.
+        row_offset: Index of the first exposed row.
+        batch_index: Batch item to read from padded logits.
+    """
+
+    def __init__(
+        self,
+        logits: Tensor,
+        num_rows: int,
+        row_offset: int = 0,
+        batch_index: Optional[int] = None,
+    ) -> None:
+        self.logits = logits
+        self.num_rows = num_rows
+        self.row_offset = row_offset
+        self.batch_index = batch_index
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return (self.num_rows, self.logits.shape[-1])
+
+    def __getitem__(self, rows: slice) -> np.ndarray:
+        start, stop, _ = rows.indices(self.num_rows)
+        start += self.row_offset
+        stop += self.row_offset
+        if self.batch_index is None:
+            rows_tensor = self.logits[start:stop]
+        else:
+            rows_tensor = self.logits[
+                self.batch_index : self.batch_index + 1, start:stop
+            ]
+        return rows_tensor.to(CPU()).to_numpy().reshape(stop - start, -1)
+
+
+def _log_softmax_(logits: np.ndarray, scratch: np.ndarray) -> np.ndarray:
+    """Computes the log softmax of each row of `logits` in place."""
+    logits -= logits.max(axis=-1, keepdims=True)
+    np.exp(logits, out=scratch)
+    logits -= np.log(scratch.sum(axis=-1, keepdims=True))
+    return logits
 
 
 def compute_log_probabilities(
     get_logits_and_samples: Callable[
-        [int, bool], (tuple[np.ndarray, np.ndarray] | None)
+        [int, bool],
+        (tuple[Union[np.ndarray, LazyLogits], np.ndarray] | None),
     ],
     batch_top_n: list[int],
     batch_echo: list[bool],
+    block_size: int = DEFAULT_BLOCK_SIZE,
 ) -> list[LogProbabilities | None]:
     """Computes the log probabilities.
 
@@ -36,64 +95,115 @@ def compute_log_probabilities(
             - batch_index is an int between [0, batch_size)
             - echo is whether that item was requested to echo the input tokens.
             Returns (None if batch item is empty):
-            - Logits should have shape = (n_tokens, vocab_size).
+            - Logits should have shape = (n_tokens, vocab_size). They may be
+              a `LazyLogits` to leave them on the device until needed.
             - Sampled tokens should have shape = (n_tokens).
         batch_top_n: Number of top log probabilities to return per input in
             the batch. For any element where `top_n == 0`, the
             LogProbabilities is skipped.
         batch_echo: Whether to include input tokens in the returned log
             probabilities.
+        block_size: Number of logits rows to process at once.
 
     Returns:
         Computed log probabilities for each item in the batch.
     """
-    log_probabilities: list[LogProbabilities | None] = []
+    # Gather the logits and samples of every batch item that requested log
+    # probabilities, so that they can be processed in a single pass.
+    log_probabilities: list[LogProbabilities | None] = [None] * len(batch_top_n)
+    requested: list[tuple[int, int]] = []
+    batch_logits: list[Union[np.ndarray, LazyLogits]] = []
+    batch_samples: list[np.ndarray] = []
     for batch, (top_n, echo) in enumerate(zip(batch_top_n, batch_echo)):
         if top_n == 0:
-            log_probabilities.append(None)
             continue
 
         logits_and_samples = get_logits_and_samples(batch, echo)
         if not logits_and_samples:
-            log_probabilities.append(None)
             continue
 
         logits, samples = logits_and_samples
-        log_probs = log_softmax(logits, axis=-1)
-
-        # Get top n tokens.
-        top_n_indices = np.argpartition(log_probs, -top_n, axis=-1)[..., -top_n:]
+        requested.append((batch, top_n))
+        batch_logits.append(logits)
+        batch_samples.append(samples.reshape(-1))
+
+    if not requested:
+        return log_probabilities
+
+    samples = np.concatenate(batch_samples, axis=0)
+    total_rows = samples.shape[0]
+    vocab_size = batch_logits[0].shape[-1]
+    max_top_n = max(top_n for _, top_n in requested)
+
+    # Per-token results, filled in block by block.
+    top_n_indices = np.empty((total_rows, max_top_n), dtype=np.int64)
+    top_n_log_probs = np.empty((total_rows, max_top_n), dtype=np.float32)
+    sampled_log_probs = np.empty(total_rows, dtype=np.float32)
+
+    # Rows from all batch items are packed into a single reused block buffer.
+    block = np.empty((min(block_size, total_rows), vocab_size), dtype=np.float32)
+    scratch = np.empty_like(block)
+
+    def process_block(start: int, end: int) -> None:
+        log_probs = _log_softmax_(block[: end - start], scratch[: end - start])
+
+        # Get the top n tokens for the largest n requested, sorted in
+        # descending order so that items with a smaller n can take a prefix.
+        indices = np.argpartition(log_probs, -max_top_n, axis=-1)[:, -max_top_n:]
+        values = np.take_along_axis(log_probs, indices, axis=-1)
+        order = np.argsort(-values, axis=-1)
+        top_n_indices[start:end] = np.take_along_axis(indices, order, axis=-1)
+        top_n_log_probs[start:end] = np.take_along_axis(values, order, axis=-1)
 
         # Get the log probabilities of each sampled token.
-        sampled_log_probs = np.take_along_axis(
-            log_probs, samples.reshape(-1, 1), axis=1
+        sampled_log_probs[start:end] = np.take_along_axis(
+            log_probs, samples[start:end].reshape(-1, 1), axis=1
         ).reshape(-1)
 
-        # Store the stats for each sample token.
-        num_tokens = log_probs.shape[0]
-        token_log_probabilities = []
+    block_start = 0
+    filled = 0
+    for item_logits in batch_logits:
+        num_rows = item_logits.shape[0]
+        row = 0
+        while row < num_rows:
+            take = min(num_rows - row, block.shape[0] - filled)
+            block[filled : filled + take] = item_logits[row : row + take]
+            filled += take
+            row += take
+            if filled == block.shape[0]:
+                process_block(block_start, block_start + filled)
+                block_start += filled
+                filled = 0
+    if filled:
+        process_block(block_start, block_start + filled)
+
+    # Convert to Python values in bulk rather than per element.
+    all_top_tokens = top_n_indices.tolist()
+    all_top_log_probs = top_n_log_probs.tolist()
+    all_samples = samples.tolist()
+    all_sampled_log_probs = sampled_log_probs.tolist()
+
+    # Split the results back up per batch item.
+    start = 0
+    for (batch, top_n), item_logits in zip(requested, batch_logits):
+        end = start + item_logits.shape[0]
+        token_log_probabilities = all_sampled_log_probs[start:end]
         top_log_probabilities = []
-        for i in range(num_tokens):
-            token_log_probabilities.append(sampled_log_probs[i].item())
-
+        for i in range(start, end):
             # Compute top n log probs.
-            top_tokens = {}
-            for n in range(top_n):
-                top_token = top_n_indices[i][n]
-                top_token_logits = log_probs[i][top_token]
-                top_tokens[top_token] = top_token_logits.item()
+            top_tokens = dict(
+                zip(all_top_tokens[i][:top_n], all_top_log_probs[i][:top_n])
+            )
 
             # Include sampled token in the top tokens.
-            sampled_token = samples[i].item()
-            top_tokens[sampled_token] = sampled_log_probs[i].item()
+            top_tokens[all_samples[i]] = all_sampled_log_probs[i]
 
             top_log_probabilities.append(top_tokens)
 
-        log_probabilities.append(
-            LogProbabilities(
-                token_log_probabilities=token_log_probabilities,
-                top_log_probabilities=top_log_probabilities,
-            )
+        log_probabilities[batch] = LogProbabilities(
+            token_log_probabilities=token_log_probabilities,
+            top_log_probabilities=top_log_probabilities,
         )
+        start = end
 
     return log_probabilities
@@ -12,9 +12,14 @@
 # ===----------------------------------------------------------------------=== #
 
 import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
 from functools import wraps
 from inspect import signature
-from typing import Any, Callable, Dict, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from max.graph import Graph
 
 
 class Layer:
@@ -69,16 +74,130 @@ def clear_hooks():
     _LAYER_HOOKS.clear()
 
 
+@dataclass
+class LayerTypeProfile:
+    """Graph build cost of all the calls of one layer type.
+
+    `total_*` include the layers called from this layer type, while `self_*`
+    only include this layer type's own code and ops.
+    """
+
+    calls: int = 0
+    total_seconds: float = 0.0
+    self_seconds: float = 0.0
+    total_ops: int = 0
+    self_ops: int = 0
+
+
+class LayerProfiler:
+    """Records the graph build time and op count of each layer type.
+
+    Use with `profile_layers`.
+    """
+
+    def __init__(self):
+        self.layers: Dict[str, LayerTypeProfile] = {}
+        self.num_ops = 0
+        # Time and ops of the layers called by each layer on the call stack.
+        self._stack: List[List[Any]] = []
+
+    def _call(self, call_fn, layer, *args, **kwargs):
+        self._stack.append([0.0, 0])
+        start_ops = self.num_ops
+        start = time.perf_counter()
+        try:
+            return call_fn(layer, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            ops = self.num_ops - start_ops
+            child_seconds, child_ops = self._stack.pop()
+            if self._stack:
+                self._stack[-1][0] += seconds
+                self._stack[-1][1] += ops
+
+            profile = self.layers.get(type(layer).__name__)
+            if profile is None:
+                profile = self.layers[type(layer).__name__] = LayerTypeProfile()
+            profile.calls += 1
+            profile.total_seconds += seconds
+            profile.self_seconds += seconds - child_seconds
+            profile.total_ops += ops
+            profile.self_ops += ops - child_ops
+
+    def summary(self) -> str:
+        """Returns a table of the layer types, by decreasing self time."""
+        lines = [
+            f"{'layer':<32} {'calls':>7} {'self ms':>10} {'total ms':>10}"
+            f" {'self ops':>9} {'total ops':>10}"
+        ]
+        layers = sorted(
+            self.layers.items(), key=lambda item: item[1].self_seconds, reverse=True
+        )
+        for name, profile in layers:
+            lines.append(
+                f"{name:<32} {profile.calls:>7}"
+                f" {profile.self_seconds * 1000.0:>10.1f}"
+                f" {profile.total_seconds * 1000.0:>10.1f}"
+                f" {profile.self_ops:>9} {profile.total_ops:>10}"
+            )
+        return "\n".join(lines)
+
+
+_LAYER_PROFILER: Optional[LayerProfiler] = None
+
+
+@contextmanager
+def profile_layers() -> Iterator[LayerProfiler]:
+    """Profiles the layers called while building graphs in the `with` body.
+
+    Each layer type's graph build time and number of graph ops is recorded,
+    which shows the layers that dominate graph construction and, through
+    their op count, compilation.
+
+    ```python
+    with profile_layers() as profiler:
+        graph = build_graph(...)
+    print(profiler.summary())
+    ```
+    """
+    global _LAYER_PROFILER
+    profiler = LayerProfiler()
+    previous_profiler = _LAYER_PROFILER
+    # Count ops by wrapping the method that adds every op to a graph.
+    add_op = Graph._add_op
+
+    def _counting_add_op(graph, *args, **kwargs):
+        profiler.num_ops += 1
+        return add_op(graph, *args, **kwargs)
+
+    _LAYER_PROFILER = profiler
+    Graph._add_op = _counting_add_op  # type: ignore
+    try:
+        yield profiler
+    finally:
+        Graph._add_op = add_op  # type: ignore
+        _LAYER_PROFILER = previous_profiler
+
+
 def _call_with_hooks(call_fn):
+    # Bound once per layer class, rather than with each call.
+    call_signature = signature(call_fn)
+
     @wraps(call_fn)
     def __call_with_hooks(layer, *args, **kwargs):
         # Hide this wrapper from rich traceback.
         _rich_traceback_omit = True
 
-        outputs = call_fn(layer, *args, **kwargs)
+        if _LAYER_PROFILER is None:
+            outputs = call_fn(layer, *args, **kwargs)
+        else:
+            outputs = _LAYER_PROFILER._call(call_fn, layer, *args, **kwargs)
+        if not _LAYER_HOOKS:
+            return outputs
+
         # Use the inspect lib to ensure that args and kwargs are passed
         # to the hook as defined in the function signature.
-        bound_args = signature(call_fn).bind(layer, *args, **kwargs)
+        bound_args = call_signature.bind(layer, *args, **kwargs)
         for hook in _LAYER_HOOKS:
             # Call the hook. Note that the first argument in `bound_args.args`
             # is the layer, so it is skipped.
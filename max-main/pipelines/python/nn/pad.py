@@ -0,0 +1,67 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+
+from dataclasses import dataclass
+from typing import Tuple
+
+from max.graph import TensorValue, ops
+
+from .layer import Layer
+
+
+@dataclass
+class ConstantPad(Layer):
+    """Pads the trailing dimensions of a tensor with a constant value.
+
+    `padding` follows the `torch.nn.functional.pad` convention: pairs of
+    `(before, after)` sizes starting from the last dimension, so
+    `(left, right, top, bottom)` pads the last two dimensions.
+
+    Each padded dimension costs a single concat of the input with broadcast
+    constants, so the padded tensor is the only intermediate allocated.
+    Dimensions with no padding add no ops.
+    """
+
+    padding: Tuple[int, ...]
+    value: float = 0
+
+    def _constant_like(self, x: TensorValue, axis: int, size: int) -> TensorValue:
+        shape = list(x.shape)
+        shape[axis] = size
+        return ops.constant(self.value, x.dtype).broadcast_to(shape)
+
+    def __call__(self, x: TensorValue) -> TensorValue:
+        if len(self.padding) % 2 != 0:
+            msg = f"padding must have an even length, got {self.padding}"
+            raise ValueError(msg)
+        if len(self.padding) // 2 > x.rank:
+            msg = (
+                f"padding {self.padding} has more dimensions than the"
+                f" rank {x.rank} input"
+            )
+            raise ValueError(msg)
+
+        for i in range(len(self.padding) // 2):
+            before, after = self.padding[2 * i], self.padding[2 * i + 1]
+            if before == 0 and after == 0:
+                continue
+
+            axis = x.rank - 1 - i
+            regions = []
+            if before > 0:
+                regions.append(self._constant_like(x, axis, before))
+            regions.append(x)
+            if after > 0:
+                regions.append(self._constant_like(x, axis, after))
+            x = ops.concat(regions, axis=axis)
+        return x
@@ -18,6 +18,7 @@ import os
 import click
 from architectures import register_all_models
 from cli import (
+    generate_jsonl_for_pipeline,
     generate_text_for_pipeline,
     list_pipelines_to_console,
     pipeline_config_options,
@@ -76,6 +77,16 @@ def common_server_options(func):
         type=str,
         help="Deprecated, please use `huggingface_repo_id` instead. Optional model alias for serving the model.",
     )
+    @click.option(
+        "--shape-warmup",
+        is_flag=True,
+        show_default=True,
+        default=False,
+        help=(
+            "Before generating or serving, warm up the pipeline on synthetic"
+            " requests of each representative batch size and prompt length."
+        ),
+    )
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         return func(*args, **kwargs)
@@ -91,6 +102,7 @@ def cli_serve(
     performance_fake,
     batch_timeout,
     model_name,
+    shape_warmup,
     **config_kwargs,
 ):
     # Initialize config, and serve.
@@ -101,6 +113,7 @@ def cli_serve(
         performance_fake=performance_fake,
         batch_timeout=batch_timeout,
         model_name=model_name,
+        shape_warmup=shape_warmup,
     )
 
 
@@ -119,10 +132,97 @@ def cli_serve(
     show_default=True,
     help="# of warmup iterations to run before the final timed run.",
 )
-def cli_pipeline(prompt, num_warmups, **config_kwargs):
+@click.option(
+    "--profile-layers",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="Print the graph build time and op count of each layer type.",
+)
+@click.option(
+    "--prompts-file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help=(
+        "JSONL file of prompts to generate responses for, instead of --prompt."
+        ' Each line is a string, or an object with a "prompt" key.'
+    ),
+)
+@click.option(
+    "--batch-size",
+    type=int,
+    default=None,
+    help=(
+        "Number of --prompts-file requests to execute together. Defaults to"
+        " --max-cache-batch-size."
+    ),
+)
+@click.option(
+    "--output-file",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="JSONL file to write the --prompts-file responses to. Defaults to stdout.",
+)
+@click.option(
+    "--metrics-json",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="JSON file to write the generation metrics to, for dashboards.",
+)
+@click.option(
+    "--resource-sample-interval",
+    type=float,
+    default=None,
+    help=(
+        "Sample the memory, CPU usage and thread count every this many seconds"
+        " on a background thread, and report them for each phase."
+    ),
+)
+@click.option(
+    "--shape-warmup",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help=(
+        "Before generating or serving, warm up the pipeline on synthetic"
+        " requests of each representative batch size and prompt length."
+    ),
+)
+def cli_pipeline(
+    prompt,
+    num_warmups,
+    profile_layers,
+    prompts_file,
+    batch_size,
+    output_file,
+    metrics_json,
+    resource_sample_interval,
+    shape_warmup,
+    **config_kwargs,
+):
     # Load tokenizer & pipeline.
     pipeline_config = PipelineConfig(**config_kwargs)
-    generate_text_for_pipeline(pipeline_config, prompt=prompt, num_warmups=num_warmups)
+    if prompts_file:
+        generate_jsonl_for_pipeline(
+            pipeline_config,
+            prompts_file=prompts_file,
+            output_file=output_file,
+            batch_size=batch_size,
+            metrics_json=metrics_json,
+            resource_sample_interval=resource_sample_interval,
+            shape_warmup=shape_warmup,
+        )
+        return
+
+    generate_text_for_pipeline(
+        pipeline_config,
+        prompt=prompt,
+        num_warmups=num_warmups,
+        shape_warmup=shape_warmup,
+        profile_layers=profile_layers,
+        metrics_json=metrics_json,
+        resource_sample_interval=resource_sample_interval,
+    )
 
 
 @main.command(name="list")
@@ -164,6 +264,7 @@ def run_llama3(
     performance_fake,
     batch_timeout,
     model_name,
+    shape_warmup,
     **config_kwargs,
 ):
     """Runs the Llama3 pipeline."""
@@ -187,10 +288,14 @@ def run_llama3(
             performance_fake=performance_fake,
             batch_timeout=batch_timeout,
             model_name=model_name,
+            shape_warmup=shape_warmup,
         )
     else:
         generate_text_for_pipeline(
-            pipeline_config=config, prompt=prompt, num_warmups=num_warmups
+            pipeline_config=config,
+            prompt=prompt,
+            num_warmups=num_warmups,
+            shape_warmup=shape_warmup,
         )
 
 
@@ -225,6 +330,7 @@ def replit(
     performance_fake,
     batch_timeout,
     model_name,
+    shape_warmup,
     **config_kwargs,
 ):
     # Update basic parameters.
@@ -249,10 +355,14 @@ def replit(
             performance_fake=performance_fake,
             batch_timeout=batch_timeout,
             model_name=model_name,
+            shape_warmup=shape_warmup,
         )
     else:
         generate_text_for_pipeline(
-            pipeline_config, prompt=prompt, num_warmups=num_warmups
+            pipeline_config,
+            prompt=prompt,
+            num_warmups=num_warmups,
+            shape_warmup=shape_warmup,
         )
 
 
@@ -21,15 +21,51 @@ from .llava_decoder import Transformer
 from .llava_projector import LlavaMultiModalConnector
 
 
+@dataclass
+class LlavaImageEncoder(Layer):
+    """The LLAVA vision encoder and multimodal projector.
+
+    Runs as a separate graph from `LlavaConditionalGeneration`, so that the
+    image embeddings are computed once per request and reused by every token
+    generation step.
+    """
+
+    vision_encoder: VisionEncoder
+    multi_modal_projector: LlavaMultiModalConnector
+
+    # TODO: change pixel_values type to List[TensorValue] to support multiple images.
+    def __call__(
+        self,
+        pixel_values: TensorValue,  # (height, width, num_channels).
+    ) -> TensorValue:
+        """
+        Args:
+            pixel_values (`TensorValue` of shape `(batch_size, image_height, image_width, num_channels)):
+                The tensors corresponding to the input images. Pixel values can be obtained using ImageProcessor
+        """
+        # TODO: if the input is a list, change vision_encoder input to pixel_values
+        # Obtains image embeddings from the vision encoder.  Output shape = (num_images=batch_size, num_patches_in_image, vision_encoder_hidden_dim)
+        # TODO: Works now for batch_size=1, Maybe convert to a ragged tensor to be compatible with input embeds?
+        # Apply multimodal projection to  hidden states from the vision encoder. Output shape = (num_images, num_patches_in_image, language_model_hidden_dim)
+        return self.multi_modal_projector(
+            self.vision_encoder(
+                [
+                    pixel_values,
+                ]
+            )
+        )
+
+
 @dataclass
 class LlavaConditionalGeneration(Layer):
     """The LLAVA model which consists of a vision encoder and a language model.
 
+    The vision encoder is run separately by `LlavaImageEncoder`, and its image
+    embeddings are passed in.
+
     image_token_index: a specific token index used to denote images
     """
 
-    vision_encoder: VisionEncoder
-    multi_modal_projector: LlavaMultiModalConnector
     language_model: Transformer
     vocab_size: int
     image_token_index: int = 10
@@ -37,11 +73,10 @@ class LlavaConditionalGeneration(Layer):
     vision_feature_select_strategy: str = "full"
     image_seq_length: int = 1
 
-    # TODO: change pixel_values type to List[TensorValue] to support multiple images.
     def __call__(
         self,
         input_ids: TensorValue,  # Shape (batch_size, sequence_length). Indices of input sequence tokens in the vocabulary. Indices can be obtained from language model tokenizer.
-        pixel_values: TensorValue,  # (height, width, num_channels).
+        image_embeds: TensorValue,  # (num_images, num_patches_in_image, language_model_hidden_dim).
         kv_cache_inputs: tuple[TensorValue, TensorValue, TensorValue, TensorValue],
         **kwargs,
     ) -> TensorValue:
@@ -55,21 +90,9 @@ class LlavaConditionalGeneration(Layer):
                 The maximum number of image tokens in one sequence (prompt) =
                     (input_ids == self.image_token_index).sum(1).max())
                 Padding will be ignored by default should you provide it.
-            pixel_values (`TensorValue` of shape `(batch_size, image_height, image_width, num_channels)):
-                The tensors corresponding to the input images. Pixel values can be obtained using ImageProcessor
+            image_embeds (`TensorValue` of shape `(num_images, num_patches_in_image, language_model_hidden_dim)`):
+                Image embeddings computed by `LlavaImageEncoder`.
         """
-        # TODO: if the input is a list, change vision_encoder input to pixel_values
-        # Obtains image embeddings from the vision encoder.  Output shape = (num_images=batch_size, num_patches_in_image, vision_encoder_hidden_dim)
-        # TODO: Works now for batch_size=1, Maybe convert to a ragged tensor to be compatible with input embeds?
-        # Apply multimodal projection to  hidden states from the vision encoder. Output shape = (num_images, num_patches_in_image, language_model_hidden_dim)
-
-        image_embeds = self.multi_modal_projector(
-            self.vision_encoder(
-                [
-                    pixel_values,
-                ]
-            )
-        )
         # inputs_embeds shape (total_sequence_length=text_and_image_tokens_length for all seqs,
         #   language_model_hidden_dim)
         inputs_embeds = self.language_model.embedding(input_ids)
@@ -12,7 +12,7 @@
 # ===----------------------------------------------------------------------=== #
 
 from max.dtype import DType
-from max.graph import Graph, TensorType
+from max.graph import Graph, TensorType, ops
 from max.graph.weights import SafetensorWeights
 from max.pipelines import PipelineConfig
 from max.pipelines.kv_cache import KVCacheManager, KVCacheParams
@@ -20,7 +20,7 @@ from max.pipelines.kv_cache import KVCacheManager, KVCacheParams
 # from mistral.model.graph import _transformer
 from nn import Linear
 
-from ..llava.llava import LlavaConditionalGeneration
+from ..llava.llava import LlavaConditionalGeneration, LlavaImageEncoder
 from ..llava.llava_projector import LlavaMultiModalConnector
 from ..vision_encoder.graph import _vision_encoder
 from .mistral_graph import _transformer
@@ -68,12 +68,11 @@ def _multi_modal_projector(
     )
 
 
-def _llava(
+def _llava_image_encoder(
     graph: Graph,
     params: PipelineConfig,
     weights: SafetensorWeights,
-    kv_params: KVCacheParams,
-) -> LlavaConditionalGeneration:
+) -> LlavaImageEncoder:
     # params for vision encoder in pixtral config.json are under vision_config.
     # vision encoder params missing from pixtral config.json:
     # num_attention_heads, num_channels, hidden_size, attention_dropout, intermediate_size, num_hidden_layers
@@ -82,12 +81,19 @@ def _llava(
     multi_modal_projector = _multi_modal_projector(
         params.dtype, params, weights.multi_modal_projector
     )
+    return LlavaImageEncoder(vision_encoder, multi_modal_projector)
+
+
+def _llava(
+    graph: Graph,
+    params: PipelineConfig,
+    weights: SafetensorWeights,
+    kv_params: KVCacheParams,
+) -> LlavaConditionalGeneration:
     # Weights of pixtral have the same names and shapes as weights of mistral.
     language_model = _transformer(graph, params, weights, kv_params)
 
     return LlavaConditionalGeneration(
-        vision_encoder,
-        multi_modal_projector,
         language_model,
         params.huggingface_config.text_config.vocab_size,
         params.huggingface_config.image_token_index,
@@ -97,6 +103,24 @@ def _llava(
     )
 
 
+def _build_vision_graph(
+    params: PipelineConfig,
+    weights: SafetensorWeights,
+) -> Graph:
+    # TODO: should be changed to add "batch_size", "n_images" dims when working with multiple images
+    pixel_values_type = TensorType(
+        DType.bfloat16,
+        [304, 400, 3],  # ["height", "width", "num_channels"]
+    )
+
+    with Graph("pixtral-vision", input_types=[pixel_values_type]) as graph:
+        image_encoder = _llava_image_encoder(graph, params, weights)
+        (pixel_values,) = graph.inputs
+        image_embeds = image_encoder(pixel_values)  # type: ignore
+        graph.output(ops.cast(image_embeds, params.dtype))
+        return graph
+
+
 def _build_graph(
     params: PipelineConfig,
     weights: SafetensorWeights,
@@ -112,10 +136,14 @@ def _build_graph(
         DType.int64,
         ["total_seq_len"],
     )
-    # TODO: should be changed to add "batch_size", "n_images" dims when working with multiple images
-    pixel_values_type = TensorType(
-        DType.bfloat16,
-        [304, 400, 3],  # ["height", "width", "num_channels"]
+    # Image embeddings computed by the vision graph.
+    image_embeds_type = TensorType(
+        params.dtype,
+        [
+            "num_images",
+            "num_image_patches",
+            params.huggingface_config.text_config.hidden_size,
+        ],
     )
     # Type of start and end position of each batch in the combined total_seq_len dimension.
     input_row_offsets_type = TensorType(DType.uint32, shape=["input_row_offsets_len"])
@@ -126,16 +154,16 @@ def _build_graph(
         "pixtral",
         input_types=[
             input_ids_type,
-            pixel_values_type,
+            image_embeds_type,
             input_row_offsets_type,
             *kv_cache_types,
         ],
     ) as graph:
         model = _llava(graph, params, weights, kv_params)
-        input_ids, pixel_values, input_row_offsets, *kv_cache_inputs = graph.inputs
+        input_ids, image_embeds, input_row_offsets, *kv_cache_inputs = graph.inputs
         logits = model(
             input_ids=input_ids,  # type: ignore
-            pixel_values=pixel_values,  # type: ignore
+            image_embeds=image_embeds,  # type: ignore
             kv_cache_inputs=kv_cache_inputs,  # type: ignore
             input_row_offsets=input_row_offsets,
         )
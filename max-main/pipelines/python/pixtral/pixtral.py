@@ -16,6 +16,12 @@ from __future__ import annotations
 import logging
 
 import numpy as np
+from dataprocessing import (
+    RaggedBatchBuilder,
+    file_nbytes,
+    load_profile,
+    weights_registry_nbytes,
+)
 from max.driver import Tensor
 from max.engine import InferenceSession, Model
 from max.graph.weights import SafetensorWeights
@@ -27,7 +33,7 @@ from max.pipelines.kv_cache import (
     load_kv_manager,
 )
 
-from .model.graph import _build_graph
+from .model.graph import _build_graph, _build_vision_graph
 
 
 class PixtralModel(PipelineModel):
@@ -40,35 +46,49 @@ class PixtralModel(PipelineModel):
         self,
         context_batch: list[TextAndVisionContext],  # type: ignore
     ) -> tuple[Tensor, ...]:
+        # Input Ids: ["total_seq_len"], Int64
         # Input row offset type: ["input_row_offsets_len"], UInt32
-        input_row_offsets = Tensor.from_numpy(
-            np.cumsum(
-                [0] + [ctx.seq_len for ctx in context_batch],
-                dtype=np.uint32,
-            )
-        ).to(self.pipeline_config.device)
+        input_ids, input_row_offsets = self._ragged_batch_builder(
+            [ctx.next_tokens for ctx in context_batch]
+        )
 
-        # Input Ids: ["total_seq_len"], Int64
-        # Create a ragged token vector of length: sum(len(t) for t in tokens).
-        tokens = np.concatenate([ctx.next_tokens for ctx in context_batch])
-        input_ids = Tensor.from_numpy(tokens).to(self.pipeline_config.device)
+        # Image embeddings are computed once here and reused by every
+        # subsequent token generation step.
+        image_embeds = self._encode_images()
+        return (
+            input_ids,
+            image_embeds,
+            input_row_offsets,
+        )
 
+    def _encode_images(self) -> Tensor:
+        """Runs the vision encoder, returning the image embeddings."""
         # TODO: change this to include batch_size and num_images_in_seq dims.
         pixel_values = Tensor.zeros(
             dtype=self.pipeline_config.dtype, shape=[304, 400, 3]
         )
-        return (
-            input_ids,
-            pixel_values,
-            input_row_offsets,
-        )
+        image_embeds = self.vision_encoder.execute(
+            pixel_values.to(self.pipeline_config.device),
+            copy_inputs_to_device=False,
+        )[0]
+        assert isinstance(image_embeds, Tensor)
+        return image_embeds
 
     def prepare_next_token_inputs(
         self,
         next_tokens: Tensor,
         prev_model_inputs: tuple[Tensor, ...],
     ) -> tuple[Tensor, ...]:
-        raise NotImplementedError("not yet implemented.")
+        # Token generation steps contain no image tokens, so the image
+        # embeddings from the context encoding step are passed through as is.
+        _, image_embeds, prev_input_row_offsets = prev_model_inputs
+        row_offsets_size = prev_input_row_offsets.shape[0]
+        next_row_offsets = self._input_row_offsets_prealloc[:row_offsets_size]
+        return (
+            next_tokens,
+            image_embeds,
+            next_row_offsets,
+        )
 
     def _get_kv_params(self) -> KVCacheParams:
         return KVCacheParams(
@@ -108,7 +128,16 @@ class PixtralModel(PipelineModel):
             np.arange(self.pipeline_config.max_cache_batch_size + 1, dtype=np.uint32)
         ).to(self.pipeline_config.device)
 
-        self._weights = self.pipeline_config.load_weights()
+        # Reuse host staging buffers to build the ragged context encoding batch.
+        self._ragged_batch_builder = RaggedBatchBuilder(
+            max_batch_size=self.pipeline_config.max_cache_batch_size,
+            max_length=self.pipeline_config.max_length,
+            device=self.pipeline_config.device,
+        )
+
+        profile = load_profile()
+        with profile.phase("weight_read"):
+            self._weights = self.pipeline_config.load_weights()
 
         if not isinstance(self._weights, SafetensorWeights):
             msg = (
@@ -116,26 +145,44 @@ class PixtralModel(PipelineModel):
             )
             raise ValueError(msg)
 
+        logging.info("Building vision encoder...")
+        with profile.phase("graph_build"):
+            vision_graph = _build_vision_graph(self.pipeline_config, self._weights)
+        logging.info("Compiling vision encoder...")
+        weights_registry = self._weights.allocated_weights
+        with profile.phase("compile"):
+            self.vision_encoder = session.load(
+                vision_graph, weights_registry=weights_registry
+            )
+
         if serialized_path := self.pipeline_config.serialized_model_path:
             # Hydrate all weights to be referenced by the serialized graph.
             weights_registry = {}
             for (
                 name,
                 tensor,
-            ) in self.pipeline_config._tensors.items():  # type:ignore
+            ) in self.pipeline_config._tensors.items():  # type: ignore
                 weights_registry[name] = tensor.data
             logging.info("Loading serialized model from ", serialized_path, "...")
-            return session.load(
-                serialized_path,
-                weights_registry=weights_registry,
-            )
+            with profile.phase(
+                "mef_import",
+                nbytes=file_nbytes(serialized_path)
+                + weights_registry_nbytes(weights_registry),
+            ):
+                return session.load(
+                    serialized_path,
+                    weights_registry=weights_registry,
+                )
         else:
             logging.info("Building model...")
-            graph = _build_graph(
-                self.pipeline_config,
-                self._weights,
-                self._get_kv_params(),
-                self.kv_manager,
-            )
+            with profile.phase("graph_build"):
+                graph = _build_graph(
+                    self.pipeline_config,
+                    self._weights,
+                    self._get_kv_params(),
+                    self.kv_manager,
+                )
             logging.info("Compiling...")
-            return session.load(graph, weights_registry=self._weights.allocated_weights)
+            weights_registry = self._weights.allocated_weights
+            with profile.phase("compile"):
+                return session.load(graph, weights_registry=weights_registry)
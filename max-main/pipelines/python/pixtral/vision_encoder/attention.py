@@ -14,13 +14,13 @@
 
 import math
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Tuple, Union
 
 from max.graph import TensorValue, TensorValueLike, ops
 from nn.layer import Layer
 from nn.linear import Linear
 
-from .attention_utils import rotate_half
+from .attention_utils import BlockDiagonalMask, rotate_half
 
 
 @dataclass
@@ -75,7 +75,7 @@ class Attention(Layer):
         xq: TensorValueLike,
         xk: TensorValueLike,
         xv: TensorValueLike,
-        attn_mask: TensorValueLike,
+        attn_mask: Union[TensorValueLike, BlockDiagonalMask],
     ) -> TensorValue:
         # Broadcast the attention mask across heads.
         # Do so in the graph so that the broadcast can be fused downstream ops.
@@ -89,6 +89,9 @@ class Attention(Layer):
         xv = xv.transpose(1, 2)  # type: ignore
 
         scale = math.sqrt(1.0 / self.head_dim)
+        if isinstance(attn_mask, BlockDiagonalMask):
+            return self.block_diagonal_attention(xq, xk, xv, attn_mask, scale)
+
         scores = xq @ ops.transpose(xk, 2, 3)
         # Note, the graph compiler currently requires the order of operands
         # to be `scores * scale` in order to pattern match the fused attention
@@ -98,10 +101,43 @@ class Attention(Layer):
 
         return scores @ xv
 
+    def block_diagonal_attention(
+        self,
+        xq: TensorValueLike,
+        xk: TensorValueLike,
+        xv: TensorValueLike,
+        attn_mask: BlockDiagonalMask,
+        scale: float,
+    ) -> TensorValue:
+        """Attends within each image's block of patches only.
+
+        The scores of each block are computed separately and the outputs are
+        concatenated along the sequence dimension, so neither a
+        `(seq_len, seq_len)` mask nor a `(seq_len, seq_len)` score matrix is
+        built: memory grows with the sum of the squared image sizes rather
+        than with the square of the total number of patches.
+
+        Args:
+            xq, xk, xv: Queries, keys and values with shape
+                (batch, n_heads, seq_len, head_dim).
+            attn_mask: Image boundaries within the sequence.
+            scale: Scale of the attention scores.
+        """
+        outputs = []
+        for start, end in attn_mask.blocks():
+            q = xq[:, :, start:end, :]  # type: ignore
+            k = xk[:, :, start:end, :]  # type: ignore
+            v = xv[:, :, start:end, :]  # type: ignore
+            scores = ops.softmax(q @ ops.transpose(k, 2, 3) * scale)
+            outputs.append(scores @ v)
+        if len(outputs) == 1:
+            return outputs[0]
+        return ops.concat(outputs, axis=2)
+
     def __call__(
         self,
         x: TensorValue,
-        attention_mask: TensorValueLike,
+        attention_mask: Union[TensorValueLike, BlockDiagonalMask],
         position_embeddings: Tuple[TensorValue, TensorValue],
     ) -> TensorValue:
         """Computes attention on x, reusing the KV cache.
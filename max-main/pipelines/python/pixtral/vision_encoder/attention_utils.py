@@ -13,14 +13,102 @@
 
 from __future__ import annotations
 
-from typing import List
+from dataclasses import dataclass
+from typing import Iterable, List
 
 import numpy as np
-from max.graph import ops
+from max.dtype import DType
+from max.graph import TensorValue, ops
+
+# TODO(KERN-782): This should be -inf but softmax saturates with NaNs.
+MASK_FILL_VALUE = -10000.0
+
+
+@dataclass(frozen=True)
+class BlockDiagonalMask:
+    """Compact representation of a block diagonal attention mask.
+
+    Patches of an image only attend to patches of the same image, so the mask
+    over a sequence of several images' patches is zero on each image's diagonal
+    block and `MASK_FILL_VALUE` elsewhere. Instead of a dense
+    `(seq_len, seq_len)` matrix, only the image boundary offsets are stored:
+    image `i` spans patches `[offsets[i], offsets[i + 1])`.
+    """
+
+    offsets: np.ndarray
+
+    @classmethod
+    def from_num_patches(cls, num_patches_list: Iterable[int]) -> BlockDiagonalMask:
+        """Builds the mask from the number of patches in each image."""
+        num_patches = np.fromiter((int(n) for n in num_patches_list), dtype=np.int64)
+        offsets = np.zeros(len(num_patches) + 1, dtype=np.int64)
+        np.cumsum(num_patches, out=offsets[1:])
+        return cls(offsets)
+
+    @property
+    def num_blocks(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def seq_len(self) -> int:
+        return int(self.offsets[-1])
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes
+
+    def blocks(self) -> list[tuple[int, int]]:
+        """Returns the `(start, end)` patch range of each image."""
+        offsets = [int(offset) for offset in self.offsets]
+        return list(zip(offsets[:-1], offsets[1:]))
+
+    def segment_ids(self) -> np.ndarray:
+        """Returns the index of the image that each patch belongs to."""
+        return np.repeat(
+            np.arange(self.num_blocks, dtype=np.float32), np.diff(self.offsets)
+        )
+
+    def to_dense(
+        self, batch_size: int = 1, fill_val: float = MASK_FILL_VALUE
+    ) -> np.ndarray:
+        """Materializes the `(batch_size, 1, seq_len, seq_len)` float32 mask.
+
+        The batch dimension is a broadcast view and takes no extra memory.
+        """
+        segment_ids = self.segment_ids()
+        mask = np.where(
+            segment_ids[:, None] == segment_ids[None, :],
+            np.float32(0),
+            np.float32(fill_val),
+        )
+        return np.broadcast_to(
+            mask[None, None], (batch_size, 1, self.seq_len, self.seq_len)
+        )
+
+    def to_graph(self, fill_val: float = MASK_FILL_VALUE) -> TensorValue:
+        """Builds the dense `(1, 1, seq_len, seq_len)` float32 mask in the graph.
+
+        Only the per-patch segment ids are embedded as a constant, so the
+        compiled model does not store the dense mask, but the mask is still
+        materialized on the device. Prefer passing the `BlockDiagonalMask`
+        itself to the Pixtral vision encoder attention, which attends within
+        each block without a dense mask.
+        """
+        segment_ids = ops.constant(self.segment_ids(), DType.float32)
+        same_image = ops.equal(
+            ops.reshape(segment_ids, (self.seq_len, 1)),
+            ops.reshape(segment_ids, (1, self.seq_len)),
+        )
+        mask = ops.select(
+            same_image,
+            ops.constant(0, DType.float32),
+            ops.constant(fill_val, DType.float32),
+        )
+        return ops.reshape(mask, (1, 1, self.seq_len, self.seq_len))
 
 
 def causal_attention_mask_2d_from_imgs(
-    imgs: List[np.ndarray], patch_size, batch_size, fill_val=-10000.0
+    imgs: List[np.ndarray], patch_size, batch_size, fill_val=MASK_FILL_VALUE
 ):
     """
     imgs: list of images of shape = (height, width, num_channels)
@@ -32,28 +120,9 @@ def causal_attention_mask_2d_from_imgs(
     num_patches_list = [
         img.shape[0] // patch_size * img.shape[1] // patch_size for img in imgs
     ]
-
-    # seq_length is number of patches in all images
-    seq_len = sum(num_patches_list)
-    mask_shape = (seq_len, seq_len)
-
-    # TODO(KERN-782): This fill_val should be -inf but softmax saturates with NaNs.
-    fill_matrix = np.full(mask_shape, fill_val, dtype=np.float32)
-
-    # block_end_idx and block_start_idx are calculated using cumulative sums of
-    # patch_embeds_list. These indicate the starting and ending indices of each
-    # block of embeddings.
-    block_end_idx = np.cumsum(num_patches_list)
-    block_start_idx = np.cumsum(np.concatenate(([0], num_patches_list[:-1])))
-
-    # TODO(KERN-782): This should be -inf but softmax saturates with NaNs.
-    for start, end in zip(block_start_idx, block_end_idx):
-        fill_matrix[int(start) : int(end), int(start) : int(end)] = 0
-
-    # Expand the mask dimensions to match the expected input shape
-    fill_matrix = np.expand_dims(fill_matrix, axis=(0, 1))  # Add two new axes
-    fill_matrix = np.broadcast_to(fill_matrix, (batch_size, 1, seq_len, seq_len))
-    return fill_matrix
+    return BlockDiagonalMask.from_num_patches(num_patches_list).to_dense(
+        batch_size, fill_val
+    )
 
 
 def causal_attention_mask_2d(num_patches_list, patch_embeds):
@@ -62,29 +131,14 @@ def causal_attention_mask_2d(num_patches_list, patch_embeds):
     It is list representing the sizes of different blocks of patch embeddings.
     patch_embeds: embeddings of each patch. tensor shape = [batch_size, num_patches, hidden_size]
     """
-    seq_len = int(patch_embeds.shape[1])
-    mask_shape = (seq_len, seq_len)
-
-    # TODO(KERN-782): This should be -inf but softmax saturates with NaNs.
-    fill_val = -10000.0
-    fill_matrix = np.full(mask_shape, fill_val, dtype=np.float32)
-
-    # block_end_idx and block_start_idx are calculated using cumulative sums of
-    # patch_embeds_list. These indicate the starting and ending indices of each
-    # block of embeddings.
-    block_end_idx = np.cumsum(num_patches_list)
-    block_start_idx = np.cumsum(np.concatenate(([0], num_patches_list[:-1])))
-
-    # TODO(KERN-782): This should be -inf but softmax saturates with NaNs.
-    for start, end in zip(block_start_idx, block_end_idx):
-        fill_matrix[int(start) : int(end), int(start) : int(end)] = 0
-
-    # Expand the mask dimensions to match the expected input shape
-    fill_matrix = np.expand_dims(fill_matrix, axis=(0, 1))  # Add two new axes
-    fill_matrix = np.broadcast_to(
-        fill_matrix, (int(patch_embeds.shape[0]), 1, seq_len, seq_len)
-    )
-    return fill_matrix
+    mask = BlockDiagonalMask.from_num_patches(num_patches_list)
+    if mask.seq_len != int(patch_embeds.shape[1]):
+        msg = (
+            f"number of patches {mask.seq_len} does not match the sequence"
+            f" length {int(patch_embeds.shape[1])} of the patch embeddings"
+        )
+        raise ValueError(msg)
+    return mask.to_dense(int(patch_embeds.shape[0]))
 
 
 def rotate_half(x):
@@ -15,7 +15,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Union
 
 from max.dtype import DType
 from max.graph import TensorValue, TensorValueLike, ops
@@ -26,6 +26,7 @@ if TYPE_CHECKING:
     from nn.norm import RMSNorm
 
     from .attention import Attention
+    from .attention_utils import BlockDiagonalMask
 
 
 @dataclass
@@ -55,7 +56,7 @@ class TransformerBlock(Layer):
     def __call__(
         self,
         x: TensorValue,
-        attention_mask: TensorValueLike,
+        attention_mask: Union[TensorValueLike, BlockDiagonalMask],
         position_embeddings: TensorValue,
     ) -> tuple[TensorValue]:
         attention_out = self.attention(
@@ -21,7 +21,7 @@ from nn.conv import Conv2D
 from nn.layer import Layer
 from nn.norm import RMSNorm
 
-from .attention_utils import causal_attention_mask_2d
+from .attention_utils import BlockDiagonalMask
 from .rotary_embedding_2d import RotaryEmbedding2D, patch_position_ids
 from .transformer import Transformer
 
@@ -76,9 +76,11 @@ class VisionEncoder(Layer):
         position_embedding = self.patch_positional_embedding(patch_embeds, position_ids)
 
         # p.shape = batch_size, patches_per_height, patches_per_width, hidden_size
-        attention_mask = causal_attention_mask_2d(
-            [p.shape[1] * p.shape[2] for p in patch_embeds_list],
-            patch_embeds,
+        # Patches only attend to patches of the same image. The attention
+        # computes each image's block separately from the image boundaries,
+        # so no dense (seq_len, seq_len) mask is built.
+        attention_mask = BlockDiagonalMask.from_num_patches(
+            [p.shape[1] * p.shape[2] for p in patch_embeds_list]
         )
 
         encoder_output = self.transformer(
@@ -11,12 +11,12 @@
 # limitations under the License.
 # ===----------------------------------------------------------------------=== #
 
+from dataprocessing.tokenizer import CachedTextTokenizer
 from max.pipelines import (
     HuggingFaceFile,
     SupportedArchitecture,
     SupportedEncoding,
     SupportedVersion,
-    TextTokenizer,
     WeightsFormat,
 )
 from max.pipelines.kv_cache import KVCacheStrategy
@@ -53,6 +53,6 @@ replit_arch = SupportedArchitecture(
     ],
     default_version="1.5",
     pipeline_model=ReplitModel,
-    tokenizer=TextTokenizer,
+    tokenizer=CachedTextTokenizer,
     default_weights_format=WeightsFormat.gguf,
 )
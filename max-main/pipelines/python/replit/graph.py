@@ -13,6 +13,8 @@
 
 from typing import Optional
 
+import numpy as np
+from dataprocessing.causal_attention_mask import MASK_FILL_VALUE
 from max.dtype import DType
 from max.graph import Graph, TensorType, TensorValue, ops
 from max.graph.quantization import QuantizationEncoding
@@ -200,3 +202,52 @@ def _build_graph(
         )
         graph.output(*outputs)
         return graph
+
+
+def _build_next_token_inputs_graph(alibi_slopes: np.ndarray) -> Graph:
+    """Builds the graph that prepares the inputs of a token generation step.
+
+    Its inputs are the sampled `(batch_size,)` tokens, the number of tokens in
+    the KV cache of each request and the key positions `[0, post_seq_len)`.
+    It returns the `(batch_size, 1)` tokens, the
+    `(batch_size, n_heads, 1, post_seq_len)` ALiBi mask of the step and the
+    cache lengths after the step.
+
+    Each row of the mask ends at its request's own position, so the bias of
+    the most recent keys stays close to 0 after it is cast to the model dtype.
+    """
+    n_heads = len(alibi_slopes)
+    tokens_type = TensorType(DType.int64, shape=["batch_size"])
+    cache_lengths_type = TensorType(DType.int64, shape=["batch_size"])
+    key_positions_type = TensorType(DType.int64, shape=["post_seq_len"])
+
+    with Graph(
+        "replit_next_token_inputs",
+        input_types=[tokens_type, cache_lengths_type, key_positions_type],
+    ) as graph:
+        tokens, cache_lengths, key_positions = graph.inputs
+        batch_size = tokens.shape[0]
+        post_seq_len = key_positions.shape[0]
+
+        # The new token sits at the position given by its cache length, so
+        # keys after it have a positive distance and are masked out.
+        distance = ops.cast(
+            ops.reshape(key_positions, (1, 1, 1, post_seq_len))
+            - ops.reshape(cache_lengths, (batch_size, 1, 1, 1)),
+            DType.float32,
+        )
+        slopes = ops.constant(
+            alibi_slopes.reshape(1, n_heads, 1, 1).astype(np.float32), DType.float32
+        )
+        bias = slopes * distance
+        attention_mask = ops.select(
+            ops.greater(bias, ops.constant(0, DType.float32)),
+            ops.constant(MASK_FILL_VALUE, DType.float32),
+            bias,
+        )
+        graph.output(
+            ops.reshape(tokens, (batch_size, 1)),
+            attention_mask,
+            cache_lengths + ops.constant(1, DType.int64),
+        )
+        return graph
@@ -14,11 +14,23 @@
 from __future__ import annotations
 
 import logging
+import os
 import warnings
-from typing import Sequence
+from typing import Sequence, Union
 
 import numpy as np
-from dataprocessing import causal_attention_mask_with_alibi, collate_batch
+from dataprocessing import (
+    CompiledModelCache,
+    alibi_bias,
+    alibi_slopes,
+    causal_attention_mask_with_alibi,
+    collate_batch,
+    compiled_model_cache_enabled,
+    file_nbytes,
+    load_profile,
+    pipeline_config_fingerprint,
+    weights_registry_nbytes,
+)
 from max.driver import CPU, Tensor
 from max.engine import InferenceSession, Model
 from max.graph.weights import GGUFWeights
@@ -29,9 +41,9 @@ from max.pipelines.kv_cache import (
     estimate_kv_cache_size,
     load_kv_manager,
 )
-from nn.compute_log_probabilities import compute_log_probabilities
+from nn.compute_log_probabilities import LazyLogits, compute_log_probabilities
 
-from .graph import _build_graph
+from .graph import _build_graph, _build_next_token_inputs_graph
 
 
 class ReplitModel(PipelineModel):
@@ -49,6 +61,18 @@ class ReplitModel(PipelineModel):
             assert isinstance(model_outputs[0], Tensor)
             return ModelOutputs(next_token_logits=model_outputs[0])
 
+    def _attention_mask(self, start_pos: list[int], seq_len: list[int]) -> np.ndarray:
+        return causal_attention_mask_with_alibi(
+            original_start_pos=start_pos,
+            original_seq_len=seq_len,
+            pad_to_multiple_of=self.pipeline_config.pad_to_multiple_of,
+            alibi_bias_max=self.pipeline_config.huggingface_config.attn_config[
+                "alibi_bias_max"
+            ],
+            n_heads=self.pipeline_config.huggingface_config.n_heads,
+            alibi_bias_table=self._alibi_bias,
+        )
+
     def prepare_initial_token_inputs(
         self,
         context_batch: list[TextContext],  # type: ignore
@@ -67,15 +91,15 @@ class ReplitModel(PipelineModel):
             pad_to_multiple_of=self.pipeline_config.pad_to_multiple_of,
         )
 
-        attention_mask = causal_attention_mask_with_alibi(
-            original_start_pos=start_pos,
-            original_seq_len=[len(t) for t in tokens],
-            pad_to_multiple_of=self.pipeline_config.pad_to_multiple_of,
-            alibi_bias_max=self.pipeline_config.huggingface_config.attn_config[
-                "alibi_bias_max"
-            ],
-            n_heads=self.pipeline_config.huggingface_config.n_heads,
-        )
+        attention_mask = self._attention_mask(start_pos, [len(t) for t in tokens])
+
+        # Token generation steps build their masks on the device from the
+        # number of tokens in each request's KV cache.
+        cache_lengths = [ctx.current_length for ctx in context_batch]
+        self._next_token_cache_lengths = Tensor.from_numpy(
+            np.array(cache_lengths, np.int64)
+        ).to(self.pipeline_config.device)
+        self._next_token_max_cache_length = max(cache_lengths)
 
         return (
             Tensor.from_numpy(next_tokens_batch).to(self.pipeline_config.device),
@@ -90,35 +114,50 @@ class ReplitModel(PipelineModel):
         next_tokens: Tensor,
         prev_model_inputs: tuple[Tensor, ...],
     ) -> tuple[Tensor, ...]:
-        # Update valid_lengths by one for all inputs.
-        prev_tokens, prev_attention_mask, valid_lengths = prev_model_inputs
-        valid_lengths += 1  # type: ignore
-
-        batch_size = prev_tokens.shape[0]
-        start_pos = [prev_attention_mask.shape[-1]] * batch_size
-        next_tokens_batch = collate_batch(
-            next_tokens,  # type: ignore
-            batch_size=batch_size,
-            pad_to_multiple_of=self.pipeline_config.pad_to_multiple_of,
-        )
+        """Prepare the inputs for the next token in multistep execution.
 
-        attention_mask = causal_attention_mask_with_alibi(
-            original_start_pos=start_pos,
-            original_seq_len=[len(t) for t in next_tokens],  # type: ignore
-            pad_to_multiple_of=self.pipeline_config.pad_to_multiple_of,
-            alibi_bias_max=self.pipeline_config.huggingface_config.attn_config[
-                "alibi_bias_max"
-            ],
-            n_heads=self.pipeline_config.huggingface_config.n_heads,
+        All inputs stay on the device: the sampled tokens are reshaped to
+        `(batch_size, 1)` and the attention mask is built by the model of
+        `_build_next_token_inputs_graph`, and the valid lengths are a slice
+        of a buffer preallocated in `load_model`. Only the width of the mask
+        is tracked on the host, so no copies are needed between steps.
+        """
+        batch_size = prev_model_inputs[0].shape[0]
+        post_seq_len = self._next_token_max_cache_length + 1
+        tokens, attention_mask, self._next_token_cache_lengths = (
+            self._next_token_inputs_model.execute(
+                next_tokens,
+                self._next_token_cache_lengths,
+                self._next_token_key_positions_prealloc[:post_seq_len],
+                copy_inputs_to_device=False,
+            )
         )
-
-        # I believe, next_tokens_batch & valid_lengths, should already be resident on the GPU.
-        # The attention mask is a new tensor, and thus has to be moved over.
+        self._next_token_max_cache_length += 1
         return (
-            Tensor.from_numpy(next_tokens_batch),  # type: ignore
-            Tensor.from_numpy(attention_mask).to(self.pipeline_config.device),
-            Tensor.from_numpy(valid_lengths),  # type: ignore
+            tokens,
+            attention_mask,
+            self._next_token_valid_lengths_prealloc[:batch_size],
+        )
+
+    def _load_next_token_inputs_model(self, session: InferenceSession) -> None:
+        # Each token generation step encodes exactly one token per batch item.
+        self._next_token_valid_lengths_prealloc = Tensor.from_numpy(
+            np.ones(self.pipeline_config.max_cache_batch_size, dtype=np.uint32)
+        ).to(self.pipeline_config.device)
+        self._next_token_key_positions_prealloc = Tensor.from_numpy(
+            np.arange(self.kv_manager.max_sequence_length + 1, dtype=np.int64)
+        ).to(self.pipeline_config.device)
+
+        # Each row of the mask has to end at its own request's position: a
+        # constant shift of the ALiBi bias leaves the softmax unchanged in
+        # exact arithmetic, but not once the mask is cast to bfloat16.
+        graph = _build_next_token_inputs_graph(
+            alibi_slopes(
+                self.pipeline_config.huggingface_config.attn_config["alibi_bias_max"],
+                self.pipeline_config.huggingface_config.n_heads,
+            )
         )
+        self._next_token_inputs_model = session.load(graph)
 
     def _get_kv_params(self) -> KVCacheParams:
         return KVCacheParams(
@@ -154,45 +193,93 @@ class ReplitModel(PipelineModel):
         self,
         session: InferenceSession,
     ) -> Model:
-        # TODO: AIPIPE-235 - Support Multistep scheduling for Replit
-        if self.pipeline_config.max_num_steps > 1:
-            msg = "Replit pipeline does not support max_num_steps > 1"
-            raise ValueError(msg)
+        profile = load_profile()
 
         # Read in weights.
-        weights = self.pipeline_config.load_weights()
+        with profile.phase("weight_read"):
+            weights = self.pipeline_config.load_weights()
         if not isinstance(weights, GGUFWeights):
             msg = "only gguf weights supported in Replit."
             raise ValueError(msg)
 
         self._weights = weights
 
-        if serialized_path := self.pipeline_config.serialized_model_path:
-            # Hydrate all weights to be referenced by the serialized path.
-            weights_registry = {}
-            for name, tensor in self._weights._tensors.items():
-                weights_registry[name] = tensor.data
+        # Precompute the ALiBi bias once, so that each step only has to slice
+        # it. Masks are offset by the KV cache's max sequence length, so the
+        # table has to cover up to twice that many positions.
+        self._alibi_bias = alibi_bias(
+            max_seq_len=2 * self.kv_manager.max_sequence_length,
+            alibi_bias_max=self.pipeline_config.huggingface_config.attn_config[
+                "alibi_bias_max"
+            ],
+            n_heads=self.pipeline_config.huggingface_config.n_heads,
+        )
+
+        # Prepare the token generation inputs on the device, so that
+        # multistep execution can run without a host round trip per step.
+        self._load_next_token_inputs_model(session)
 
+        if serialized_path := self.pipeline_config.serialized_model_path:
             logging.info("Loading serialized model from ", serialized_path)
+            return self._load_serialized_model(session, serialized_path)
 
-            return session.load(serialized_path, weights_registry=weights_registry)
+        # Only models with GGUF weights are cached, since the serialized model
+        # references the weights by their names in the GGUF file.
+        cache = CompiledModelCache()
+        cache_key = None
+        if compiled_model_cache_enabled() and isinstance(self._weights, GGUFWeights):
+            cache_key = pipeline_config_fingerprint(
+                self.pipeline_config,
+                source_dirs=[os.path.dirname(__file__)],
+                model=type(self).__name__,
+            )
+        if cache_key is not None and (cached_path := cache.lookup(cache_key)):
+            logging.info("Loading cached compiled model from %s", cached_path)
+            try:
+                return self._load_serialized_model(session, cached_path)
+            except Exception as e:
+                logging.warning("Recompiling, unable to load cached model: %s", e)
+                cache.remove(cache_key)
 
-        else:
-            logging.info("Building model...")
+        logging.info("Building model...")
+        with profile.phase("graph_build"):
             graph = _build_graph(
                 self.pipeline_config,
                 self._weights,
                 self._get_kv_params(),
                 kv_manager=self.kv_manager,
             )
-            logging.info("Compiling...")
-            model = session.load(
-                graph, weights_registry=self._weights.allocated_weights
-            )
-            if export_path := self.pipeline_config.save_to_serialized_model_path:
-                logging.info("Exporting serialized model to %s", export_path)
+        logging.info("Compiling...")
+        weights_registry = self._weights.allocated_weights
+        with profile.phase("compile"):
+            model = session.load(graph, weights_registry=weights_registry)
+        if export_path := self.pipeline_config.save_to_serialized_model_path:
+            logging.info("Exporting serialized model to %s", export_path)
+            with profile.phase("mef_export"):
                 model._export_mef(export_path)
-            return model
+            profile.add_bytes("mef_export", file_nbytes(export_path))
+        if cache_key is not None:
+            with profile.phase("mef_export"):
+                cached_path = cache.store(cache_key, model._export_mef)
+            if cached_path is not None:
+                logging.info("Cached compiled model in %s", cached_path)
+                profile.add_bytes("mef_export", file_nbytes(cached_path))
+        return model
+
+    def _load_serialized_model(
+        self, session: InferenceSession, serialized_path: Union[str, os.PathLike]
+    ) -> Model:
+        # Hydrate all weights to be referenced by the serialized path.
+        weights_registry = {}
+        for name, tensor in self._weights._tensors.items():
+            weights_registry[name] = tensor.data
+
+        with load_profile().phase(
+            "mef_import",
+            nbytes=file_nbytes(serialized_path)
+            + weights_registry_nbytes(weights_registry),
+        ):
+            return session.load(serialized_path, weights_registry=weights_registry)
 
     def compute_log_probabilities(
         self,
@@ -214,7 +301,9 @@ class ReplitModel(PipelineModel):
                     not self.pipeline_config.enable_echo
                 ), "Echo was enabled but logits were not returned."
                 return None
-            logits = model_outputs.logits.to(CPU()).to_numpy()
+            # Leave the full logits on the device, they are copied to the host
+            # in blocks of rows while computing the log probabilities.
+            logits = model_outputs.logits
         next_token_logits = model_outputs.next_token_logits.to(CPU()).to_numpy()
 
         sampled_tokens = next_tokens.to(CPU()).to_numpy()
@@ -225,12 +314,14 @@ class ReplitModel(PipelineModel):
 
         def _get_logits_and_samples(
             batch_index: int, echo: bool
-        ) -> tuple[np.ndarray, np.ndarray]:
+        ) -> tuple[np.ndarray | LazyLogits, np.ndarray]:
             if echo:
                 seq_len = valid_lengths[batch_index]
                 padded_tokens = tokens[batch_index]
                 assert model_outputs.logits is not None
-                batch_logits = logits[batch_index, :seq_len]
+                batch_logits = LazyLogits(
+                    logits, num_rows=int(seq_len), batch_index=batch_index
+                )
                 samples = np.concatenate(
                     (
                         padded_tokens[1:seq_len],
@@ -0,0 +1,47 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+
+import numpy as np
+import pytest
+from dataprocessing import causal_attention_mask
+from dataprocessing.causal_attention_mask import MASK_FILL_VALUE
+
+
+def _reference_mask(start_pos: list[int], seq_len: int) -> np.ndarray:
+    post_seq_len = max(start_pos) + seq_len
+    fill_matrix = np.full((seq_len, post_seq_len), MASK_FILL_VALUE, np.float32)
+    return np.stack([np.triu(fill_matrix, k=k + 1) for k in start_pos])
+
+
+@pytest.mark.parametrize("seq_len", [1, 7])
+def test_causal_attention_mask_matches_reference(seq_len: int):
+    start_pos = [0, 3, 11]
+    mask = causal_attention_mask(start_pos, [seq_len] * len(start_pos))
+    np.testing.assert_array_equal(mask, _reference_mask(start_pos, seq_len))
+
+
+@pytest.mark.parametrize("seq_len", [1, 7])
+def test_causal_attention_mask_is_writable_and_exportable(seq_len: int):
+    # Masks are handed to `Model.execute`, which exports them with DLPack.
+    # That requires a writable array, including on a cache hit.
+    for _ in range(2):
+        mask = causal_attention_mask([2, 5], [seq_len, seq_len])
+        assert mask.flags.writeable
+        np.testing.assert_array_equal(np.from_dlpack(mask), mask)
+
+
+def test_causal_attention_mask_cache_hits_are_not_shared():
+    first = causal_attention_mask([4], [8])
+    first[...] = 1.0
+    second = causal_attention_mask([4], [8])
+    np.testing.assert_array_equal(second, _reference_mask([4], 8))
@@ -0,0 +1,40 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+
+import numpy as np
+from dataprocessing import (
+    IncrementalCausalAttentionMask,
+    causal_attention_mask,
+)
+from max.driver import Tensor
+
+
+def test_append_matches_rebuilt_mask():
+    incremental = IncrementalCausalAttentionMask()
+    mask = causal_attention_mask([0, 4], [6, 2])
+    for _ in range(40):
+        # The next token of each batch item sits after the previous columns.
+        expected = causal_attention_mask([mask.shape[-1]] * 2, [1, 1])
+        mask = incremental.append(mask)
+        np.testing.assert_array_equal(mask, expected)
+
+
+def test_appended_mask_converts_to_tensor():
+    # `Llama3Model` passes the appended mask straight to `Model.execute`,
+    # which exports its inputs with DLPack.
+    incremental = IncrementalCausalAttentionMask()
+    mask = causal_attention_mask([3, 3], [5, 5])
+    for _ in range(3):
+        mask = incremental.append(mask)
+        tensor = Tensor.from_numpy(mask)
+        np.testing.assert_array_equal(tensor.to_numpy(), mask)
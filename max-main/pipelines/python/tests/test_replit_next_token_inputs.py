@@ -0,0 +1,77 @@
+# ===----------------------------------------------------------------------=== #
+# Copyright (c) 2024, Modular Inc. All rights reserved.
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions:
+# https://llvm.org/LICENSE.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===----------------------------------------------------------------------=== #
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from dataprocessing import alibi_bias
+from dataprocessing.causal_attention_mask import MASK_FILL_VALUE
+
+pytest.importorskip("max.engine")
+
+from max.driver import CPU, Tensor  # noqa: E402
+from max.engine import InferenceSession  # noqa: E402
+from replit.model import ReplitModel  # noqa: E402
+
+MAX_SEQ_LEN = 32
+N_HEADS = 4
+ALIBI_BIAS_MAX = 8
+
+
+def _replit_model() -> ReplitModel:
+    # Only the attributes that preparing the inputs reads are set up.
+    model = ReplitModel.__new__(ReplitModel)
+    model.pipeline_config = SimpleNamespace(
+        device=CPU(),
+        max_cache_batch_size=4,
+        pad_to_multiple_of=1,
+        huggingface_config=SimpleNamespace(
+            n_heads=N_HEADS, attn_config={"alibi_bias_max": ALIBI_BIAS_MAX}
+        ),
+    )
+    model.kv_manager = SimpleNamespace(max_sequence_length=MAX_SEQ_LEN)
+    model._alibi_bias = alibi_bias(2 * MAX_SEQ_LEN, ALIBI_BIAS_MAX, N_HEADS)
+    model._load_next_token_inputs_model(InferenceSession(devices=[CPU()]))
+    return model
+
+
+def test_multistep_next_token_inputs():
+    model = _replit_model()
+    prompt_lengths = [3, 7]
+    contexts = [
+        SimpleNamespace(
+            next_tokens=np.arange(n, dtype=np.int64), seq_len=n, current_length=n
+        )
+        for n in prompt_lengths
+    ]
+    inputs = model.prepare_initial_token_inputs(contexts)  # type: ignore
+
+    table = alibi_bias(2 * MAX_SEQ_LEN, ALIBI_BIAS_MAX, N_HEADS)
+    for step in range(3):
+        sampled = np.array([10 + step, 20 + step], dtype=np.int64)
+        inputs = model.prepare_next_token_inputs(Tensor.from_numpy(sampled), inputs)
+        tokens, mask, valid_lengths = (t.to_numpy() for t in inputs)
+
+        np.testing.assert_array_equal(tokens, sampled[:, None])
+        np.testing.assert_array_equal(valid_lengths, [1, 1])
+        assert mask.shape == (2, N_HEADS, 1, max(prompt_lengths) + step + 1)
+        for row, prompt_length in enumerate(prompt_lengths):
+            # The new token sits after the prompt and the previous steps, and
+            # its own column has no bias.
+            cache_length = prompt_length + step
+            np.testing.assert_allclose(
+                mask[row, :, 0, : cache_length + 1],
+                table[:, -(cache_length + 1) :],
+            )
+            assert (mask[row, :, 0, cache_length + 1 :] == MASK_FILL_VALUE).all()